@@ -0,0 +1,302 @@
+# === benchmarks/components.py ===
+
+"""
+组件微基准
+
+在 2 / 8 / 32 个参与者的遭遇战上分别计时热点组件：
+掷骰、智能体输出的 JSON 解析、各智能体的提示词构建、参与者增量合并、
+先攻、回合推进，以及用桩 LLM 驱动的完整工作流回合（只剩编排本身的开销）。
+
+结果可以写成 JSON，并与保存的基线比较，中位数变慢超过容差时返回非零，
+方便在改动前后或 CI 里发现回归。
+
+用法:
+    python benchmarks/components.py
+    python benchmarks/components.py --sizes 2 8 --filter roll_dice --json results.json
+    python benchmarks/components.py --json baseline.json
+    python benchmarks/components.py --baseline baseline.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 基准不应调用真实的 LLM
+os.environ.pop("CLAUDE_API_KEY", None)
+os.environ.pop("GOOGLE_API_KEY", None)
+os.environ["LLM_MODE"] = "live"
+os.environ["SPECULATIVE_ACTION"] = "false"
+
+from langchain_core.language_models.chat_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, BaseMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+
+from src import agents  # noqa: E402
+from src.agents import agent_registry  # noqa: E402
+from src.coc_keeper import determine_next_step, roll_initiative  # noqa: E402
+from src.coc_keeper_demo import (  # noqa: E402
+    create_default_map, create_ghoul1, create_investigator1, create_investigator2,
+)
+from src.combat_session import CombatSession, new_combat_state  # noqa: E402
+from src.context_builder import build_combat_context, compact_json  # noqa: E402
+from src.replay_llm import _ToolBindingMixin  # noqa: E402
+from src.rules import apply_participant_deltas  # noqa: E402
+from src.tools.dice_tools import roll_dice  # noqa: E402
+from src.types import GraphState, Participant  # noqa: E402
+
+DEFAULT_SIZES = [2, 8, 32]
+
+# ==================== 桩 LLM ====================
+
+# 所有工具智能体都能接受的输出：有效的非攻击行动，不改变参与者
+_STUB_ACTION = json.dumps({
+    "isValid": True,
+    "description": "食尸鬼低吼着绕到一旁，伺机而动。",
+    "action": {"type": "move"},
+    "result": [],
+    "requiresPlayerInput": False,
+}, ensure_ascii=False)
+
+class StubChatModel(_ToolBindingMixin, BaseChatModel):
+    """立即返回固定回复的模型：意图分类返回 direct_action，其他返回 _STUB_ACTION"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-stub"
+
+    def _reply(self, messages: List[BaseMessage]) -> ChatResult:
+        text = "direct_action" if "意图分类" in str(messages[0].content) else f"```json\n{_STUB_ACTION}\n```"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self._reply(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self._reply(messages)
+
+# ==================== 遭遇战 ====================
+
+def build_encounter(size: int) -> GraphState:
+    """size 个参与者的遭遇战：两名调查员，其余是食尸鬼
+
+    先攻顺序固定为调查员1、食尸鬼1、调查员2、其余食尸鬼，
+    这样一个完整回合的步数不随规模变化，差异只来自状态大小。
+    """
+    investigators = [create_investigator1(), create_investigator2()][:max(size, 1)]
+    ghouls: List[Participant] = []
+    for i in range(size - len(investigators)):
+        ghoul = create_ghoul1()
+        ghoul["id"] = f"ghoul_{i + 1}"
+        ghoul["name"] = f"食尸鬼{i + 1}"
+        ghouls.append(ghoul)
+
+    state = new_combat_state(investigators[:1] + ghouls[:1] + investigators[1:] + ghouls[1:], create_default_map())
+    state["round_number"] = 1
+    state["initiative_order"] = [p["id"] for p in state["participants"]]
+    # 一段中等长度的战斗日志，让上下文构建走到摘要分支
+    state["combat_log"] = [
+        f"[守秘人]: {p['name']} 挥动利爪，造成 {i % 5 + 1} 点伤害。"
+        for i, p in enumerate(state["participants"] * 4)
+    ]
+    state["previous_context"] = ["艾米莉亚·克拉克: 我举起手电筒照向黑暗的走廊"]
+    return state
+
+# 智能体输出样例：代码块、裸 JSON、无法解析（走回退）
+_AGENT_OUTPUTS = [
+    f"好的，以下是结算结果：\n```json\n{_STUB_ACTION}\n```",
+    _STUB_ACTION,
+    "食尸鬼没有行动。",
+]
+
+# ==================== 用例 ====================
+
+def case_roll_dice(state: GraphState) -> Callable[[], Any]:
+    notations = ["1d100", "1d6+1d4+2", "1d8+DB"]
+    def run() -> None:
+        for notation in notations:
+            roll_dice(notation, "+1d4")
+    return run
+
+def case_parse_json(state: GraphState) -> Callable[[], Any]:
+    def run() -> None:
+        for output in _AGENT_OUTPUTS:
+            agents._parse_json_output(output, {"description": output})
+    return run
+
+def _prompt_case(agent: str) -> Callable[[GraphState], Callable[[], Any]]:
+    """构建上下文并渲染该智能体的完整提示词"""
+    def factory(state: GraphState) -> Callable[[], Any]:
+        actor = state["participants"][0]
+        def run() -> Any:
+            context = build_combat_context(state, agent)
+            if agent == "keeper_narrator":
+                return agents._KEEPER_NARRATOR_PROMPT.format_messages(
+                    event_data=context.log_text, participants_info=context.participants, map_info=context.map,
+                )
+            prompt = agents._PLAYER_ACTION_PROMPT if agent == "player_action" else agents._MONSTER_AI_PROMPT
+            return prompt.format_messages(
+                context_info=context.previous_context,
+                current_actor_id=actor["id"],
+                combat_log_text=context.log_text,
+                map_info=context.map,
+                participants_info=context.participants,
+                current_actor_info=compact_json(actor),
+                input="我用手枪射击食尸鬼",
+                is_temp=False,
+                agent_scratchpad=[],
+            )
+        return run
+    return factory
+
+def case_apply_deltas(state: GraphState) -> Callable[[], Any]:
+    participants = state["participants"]
+    deltas = [
+        {"id": p["id"], "HP": -1, "add_effects": ["流血"], "location": "走廊"}
+        for p in participants
+    ] + [{"id": "nobody", "HP": -1}, {"id": participants[0]["id"], "POW": 99}]
+    return lambda: apply_participant_deltas(participants, deltas)
+
+def case_roll_initiative(state: GraphState) -> Callable[[], Any]:
+    return lambda: roll_initiative(state)
+
+def case_determine_next_step(state: GraphState) -> Callable[[], Any]:
+    # determine_next_step 会修改状态，每次用一份浅拷贝
+    def run() -> Any:
+        return determine_next_step({**state, "combat_log": [], "current_actor_index": 0})  # type: ignore[typeddict-item]
+    return run
+
+def case_graph_turn(state: GraphState) -> Callable[[], Any]:
+    """调查员1行动，随后食尸鬼1行动，直到轮到调查员2"""
+    loop = asyncio.new_event_loop()
+    session_id = f"bench-{len(state['participants'])}"
+
+    async def turn() -> None:
+        # 固定的 thread_id：检查点按 keep_last 裁剪，不会随迭代次数增长
+        session = CombatSession(copy.deepcopy(state), session_id=session_id)
+        session.awaiting_input = True
+        async for _ in session.advance("我用手枪射击食尸鬼"):
+            pass
+
+    return lambda: loop.run_until_complete(turn())
+
+CASES: Dict[str, Callable[[GraphState], Callable[[], Any]]] = {
+    "roll_dice": case_roll_dice,
+    "parse_json_output": case_parse_json,
+    "prompt.monster_ai": _prompt_case("monster_ai"),
+    "prompt.player_action": _prompt_case("player_action"),
+    "prompt.keeper_narrator": _prompt_case("keeper_narrator"),
+    "apply_participant_deltas": case_apply_deltas,
+    "roll_initiative": case_roll_initiative,
+    "determine_next_step": case_determine_next_step,
+    "graph_turn": case_graph_turn,
+}
+
+# 与遭遇规模无关的用例只跑一次
+_SIZE_INDEPENDENT = {"roll_dice", "parse_json_output"}
+
+# ==================== 计时 ====================
+
+def measure(func: Callable[[], Any], repeats: int, min_time: float) -> Dict[str, Any]:
+    """自动确定每轮迭代次数（每轮至少 min_time 秒），返回每次调用耗时的统计（微秒）"""
+    func()  # 预热：填充缓存、构建智能体
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or iterations >= 1_000_000:
+            break
+        iterations *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    samples = [elapsed / iterations]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        samples.append((time.perf_counter() - start) / iterations)
+    return {
+        "median_us": statistics.median(samples) * 1e6,
+        "min_us": min(samples) * 1e6,
+        "iterations": iterations,
+        "repeats": repeats,
+    }
+
+def run_cases(sizes: List[int], pattern: Optional[str], repeats: int, min_time: float) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, factory in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        for size in sizes[:1] if name in _SIZE_INDEPENDENT else sizes:
+            key = name if name in _SIZE_INDEPENDENT else f"{name}[{size}]"
+            results[key] = measure(factory(build_encounter(size)), repeats, min_time)
+            print(f"{key:32s} median {results[key]['median_us']:12.2f} µs  min {results[key]['min_us']:12.2f} µs")
+    return results
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """与基线比较中位数，返回超出容差的用例"""
+    regressions = []
+    print(f"\n{'用例':30s} {'基线 µs':>12s} {'当前 µs':>12s} {'比值':>8s}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result["median_us"] / max(baseline[key]["median_us"], 1e-9)
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = "  ❌"
+        print(f"{key:32s} {baseline[key]['median_us']:12.2f} {result['median_us']:12.2f} {ratio:8.2f}{flag}")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="组件微基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="遭遇战参与者数量")
+    parser.add_argument("--filter", default=None, help="只运行名称包含该字符串的用例")
+    parser.add_argument("--repeats", type=int, default=5, help="每个用例的计时轮数")
+    parser.add_argument("--min-time", type=float, default=0.1, help="每轮最少计时秒数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", default=None, help="把结果写入该文件（可作为之后的基线）")
+    parser.add_argument("--baseline", default=None, help="与该基线文件比较")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的中位数变慢比例")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    stub = StubChatModel()
+    for llm_agent in (None, "ooc", "rules_keeper"):
+        agent_registry.set_llm(stub, llm_agent)
+
+    results = run_cases(args.sizes, args.filter, args.repeats, args.min_time)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} 个用例变慢超过 {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        print("✅ 没有超出容差的回归")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
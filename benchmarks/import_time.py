@@ -0,0 +1,68 @@
+# === benchmarks/import_time.py ===
+
+"""
+导入耗时基准
+
+每次在新的子进程里执行导入语句，统计多次运行的耗时，
+用来发现 "import src" 之类的冷启动回归。模拟进程和命令行工具都依赖冷启动速度。
+
+用法:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 20 --budget 0.3
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 名称 -> 要计时的导入语句
+CASES: Dict[str, str] = {
+    "import src": "import src",
+    "src.roll_dice": "import src; src.roll_dice('1d100')",
+    "src.tools.dice_notation": "from src.tools.dice_notation import compile_dice; compile_dice('1d6+DB')",
+    "src.rules": "import src.rules",
+    "src.intent_classifier": "import src.intent_classifier",
+}
+
+# 在子进程里计时，排除解释器本身的启动时间
+_TIMER = "import time; _t = time.perf_counter(); {stmt}; print(time.perf_counter() - _t)"
+
+def time_import(stmt: str, runs: int) -> List[float]:
+    """在新进程里执行 runs 次导入语句，返回每次的耗时（秒）"""
+    env = dict(os.environ)
+    # 导入本身不应依赖 API 密钥
+    env.pop("CLAUDE_API_KEY", None)
+    env.pop("GOOGLE_API_KEY", None)
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _TIMER.format(stmt=stmt)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="导入耗时基准")
+    parser.add_argument("--runs", type=int, default=10, help="每个用例的运行次数")
+    parser.add_argument("--budget", type=float, default=None, help="\"import src\" 中位数耗时上限（秒），超出时返回非零")
+    args = parser.parse_args()
+
+    results = {}
+    for name, stmt in CASES.items():
+        timings = time_import(stmt, args.runs)
+        results[name] = statistics.median(timings)
+        print(f"{name:28s} median {results[name] * 1000:8.1f} ms  min {min(timings) * 1000:8.1f} ms")
+
+    if args.budget is not None and results["import src"] > args.budget:
+        print(f"❌ import src 耗时 {results['import src']:.3f}s 超出预算 {args.budget:.3f}s")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# === benchmarks/prompt_prefix.py ===
+
+"""
+提示词前缀稳定性检查
+
+用记录提示词的桩 LLM 连续推进同一局战斗的多个回合（日志、参与者状态、玩家输入都在变化），
+检查每个智能体每次调用的前缀（system 消息）是否逐字节相同。
+前缀一旦混进每回合变化的内容，提供方的提示词缓存就不会命中；有变化时返回非零。
+
+用法:
+    python benchmarks/prompt_prefix.py
+    python benchmarks/prompt_prefix.py --turns 10 --size 6
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from typing import Dict, List, Optional, Set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.components import StubChatModel, build_encounter  # noqa: E402
+from langchain_core.messages import BaseMessage  # noqa: E402
+
+from src import agents  # noqa: E402
+from src.agents import agent_registry  # noqa: E402
+from src.combat_session import CombatSession  # noqa: E402
+from src.prompt_cache import prefix_digest  # noqa: E402
+
+# 智能体 -> 提示词，用前缀的第一段识别调用来自哪个智能体
+PROMPTS = {
+    "player_input_triage": agents._TRIAGE_PROMPT,
+    "monster_ai": agents._MONSTER_AI_PROMPT,
+    "player_action": agents._PLAYER_ACTION_PROMPT,
+    "keeper_narrator": agents._KEEPER_NARRATOR_PROMPT,
+    "ooc": agents._OOC_PROMPT,
+    "rules_keeper": agents._RULES_KEEPER_PROMPT,
+}
+
+INPUTS = ["我用手枪射击食尸鬼", "我举起猎刀砍向最近的食尸鬼", "我后退一步再开枪"]
+
+class PrefixRecordingStub(StubChatModel):
+    """记录每次调用的前缀哈希，回复与 StubChatModel 相同"""
+
+    digests: Dict[str, List[Optional[str]]] = {}
+
+    def _reply(self, messages: List[BaseMessage]):
+        system = str(messages[0].content) if messages and messages[0].type == "system" else ""
+        agent = next((name for name, prompt in PROMPTS.items() if system.startswith(prompt.prefix[0][:40])), "unknown")
+        self.digests.setdefault(agent, []).append(prefix_digest(messages))
+        return super()._reply(messages)
+
+async def run_turns(turns: int, size: int) -> Dict[str, List[Optional[str]]]:
+    state = build_encounter(size)
+    # 让怪物走 LLM 决策，覆盖 monster_ai 的提示词
+    for participant in state["participants"]:
+        if participant["type"] == "enemy":
+            participant["intelligent"] = True
+    stub = PrefixRecordingStub()
+    for llm_agent in (None, "ooc", "rules_keeper"):
+        agent_registry.set_llm(stub, llm_agent)
+
+    session = CombatSession(state, session_id="prompt-prefix-check")
+    session.awaiting_input = True
+    for turn in range(turns):
+        async for _ in session.advance(INPUTS[turn % len(INPUTS)]):
+            pass
+    return stub.digests
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="检查各智能体提示词前缀在回合间是否逐字节相同")
+    parser.add_argument("--turns", type=int, default=5, help="推进的玩家回合数")
+    parser.add_argument("--size", type=int, default=4, help="参与者人数")
+    args = parser.parse_args()
+
+    digests = asyncio.run(run_turns(args.turns, args.size))
+    unstable: Set[str] = set()
+    for agent, values in sorted(digests.items()):
+        distinct = set(values)
+        status = "稳定" if len(distinct) == 1 and None not in distinct else "变化"
+        if status != "稳定":
+            unstable.add(agent)
+        print(f"{agent:<22} 调用 {len(values):>3} 次  前缀 {len(distinct)} 种  {status}")
+    if unstable:
+        print(f"\n前缀不稳定: {', '.join(sorted(unstable))}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,32 +9,49 @@ CoC战斗系统 - Python版本
 __version__ = "1.0.0"
 __author__ = "CoC Fight Team"
 
-# 导出主要类和函数
-from .types import (
-    GraphState,
-    Participant,
-    ParticipantStatus,
-    ClassifiedIntent,
-    Map,
-    MapZone
-)
-
-from .coc_keeper import combat_workflow
-
-from .agents import (
-    player_input_triage_agent,
-    monster_ai_agent,
-    rules_keeper_agent,
-    keeper_narrator_agent,
-    ooc_agent,
-    player_action_agent
-)
-
-from .tools.dice_tools import (
-    roll_dice,
-    roll_dice_tool,
-    DiceResult
-)
+from importlib import import_module
+
+# 导出主要类和函数：按需导入，"import src" 不会加载 LangChain、LLM 提供方或 NumPy
+_LAZY_ATTRS = {
+    # 类型
+    "GraphState": ".types",
+    "Participant": ".types",
+    "ParticipantStatus": ".types",
+    "ClassifiedIntent": ".types",
+    "Map": ".types",
+    "MapZone": ".types",
+
+    # 工作流
+    "combat_workflow": ".coc_keeper",
+
+    # 智能体
+    "player_input_triage_agent": ".agents",
+    "monster_ai_agent": ".agents",
+    "rules_keeper_agent": ".agents",
+    "keeper_narrator_agent": ".agents",
+    "ooc_agent": ".agents",
+    "player_action_agent": ".agents",
+
+    # 工具
+    "roll_dice": ".tools.dice_tools",
+    "roll_dice_tool": ".tools.dice_tools",
+    "map_query_tool": ".tools.map_tools",
+    "DiceResult": ".tools.dice_tools",
+    "roll_dice_batch": ".tools.dice_batch",
+    "roll_dice_many": ".tools.dice_batch",
+    "BatchDiceResult": ".tools.dice_batch",
+}
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
 
 __all__ = [
     # 类型
@@ -59,5 +76,9 @@ __all__ = [
     # 工具
     "roll_dice",
     "roll_dice_tool",
-    "DiceResult"
+    "map_query_tool",
+    "DiceResult",
+    "roll_dice_batch",
+    "roll_dice_many",
+    "BatchDiceResult"
 ] 
\ No newline at end of file
@@ -0,0 +1,87 @@
+# === src/agent_registry.py ===
+
+"""
+智能体注册表
+
+每个智能体的链（prompt | llm）或 AgentExecutor 只构建一次，
+在回合和会话之间复用，不再在每次调用时重新创建。
+
+构建结果与所用的 LLM 实例绑定：
+- LLM 配置（提供方、模型、密钥）变化时自动失效并重建
+- set_llm 替换某个 LLM 时，只重建依赖它的智能体
+- invalidate 手动清空全部
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+# 这些环境变量决定 get_llm 创建什么模型，任一变化都要重建
+LLM_CONFIG_ENV = ("CLAUDE_API_KEY", "CLAUDE_MODEL", "GOOGLE_API_KEY", "GEMINI_MODEL", "LLM_MODE")
+
+class _Registration(NamedTuple):
+    builder: Callable[[Any], Any]  # 接收 LLM，返回可调用的链或执行器
+    llm_agent: Optional[str]  # 传给 LLM 工厂的智能体名（决定是否使用响应缓存）
+
+class AgentRegistry:
+    """按 LLM 实例缓存智能体的链和执行器"""
+
+    def __init__(self, llm_factory: Callable[[Optional[str]], Any]):
+        self._llm_factory = llm_factory
+        self._registrations: Dict[str, _Registration] = {}
+        self._llms: Dict[Optional[str], Any] = {}
+        self._runnables: Dict[str, Tuple[Any, Any]] = {}  # 名字 -> (构建时使用的 LLM, 链/执行器)
+        self._config: Optional[Tuple[Optional[str], ...]] = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable[[Any], Any], llm_agent: Optional[str] = None) -> None:
+        """注册智能体的构建函数；重复注册会替换旧的构建结果"""
+        with self._lock:
+            self._registrations[name] = _Registration(builder, llm_agent)
+            self._runnables.pop(name, None)
+
+    def _check_config(self) -> None:
+        config = tuple(os.getenv(name) for name in LLM_CONFIG_ENV)
+        if config != self._config:
+            self._llms.clear()
+            self._runnables.clear()
+            self._config = config
+
+    def get_llm(self, agent: Optional[str] = None) -> Any:
+        """返回 LLM，第一次使用时创建"""
+        with self._lock:
+            return self._get_llm(agent)
+
+    def _get_llm(self, agent: Optional[str]) -> Any:
+        self._check_config()
+        if agent not in self._llms:
+            self._llms[agent] = self._llm_factory(agent)
+        return self._llms[agent]
+
+    def set_llm(self, llm: Any, agent: Optional[str] = None) -> None:
+        """替换某个 LLM（例如测试或回放时），依赖它的智能体会在下次使用时重建"""
+        with self._lock:
+            self._check_config()
+            self._llms[agent] = llm
+            for name, registration in self._registrations.items():
+                if registration.llm_agent == agent:
+                    self._runnables.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """返回智能体的链或执行器，必要时构建"""
+        with self._lock:
+            registration = self._registrations[name]
+            llm = self._get_llm(registration.llm_agent)
+            cached = self._runnables.get(name)
+            if cached is not None and cached[0] is llm:
+                return cached[1]
+            runnable = registration.builder(llm)
+            self._runnables[name] = (llm, runnable)
+            return runnable
+
+    def invalidate(self) -> None:
+        """清空所有 LLM 和构建结果，下次使用时按当前配置重建"""
+        with self._lock:
+            self._llms.clear()
+            self._runnables.clear()
+            self._config = None
@@ -1,17 +1,59 @@
 # === src/agents.py ===
 
 import os
-import json
-import re
-from typing import Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Type
 from dotenv import load_dotenv
-from langchain_anthropic import ChatAnthropic
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
+from pydantic import BaseModel
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from src.types import ClassifiedIntent, GraphState, Participant
 
+from .agent_registry import AgentRegistry
+from .combat_stream import DICE_ROLLED, emit_event
+from .context_builder import build_combat_context, compact_json
+from .llm_cache import get_response_cache
+from .participant_store import SideCounts, copy_counts, count_sides, find_participant
+from .prompt_cache import CachedPrompt
+from .replay_llm import current_mode, wrap_llm
+from .round_planner import (
+    CONCURRENT_MONSTER_PLANNING,
+    plan_dependencies,
+    plan_is_current,
+    plan_monster_phase,
+    planning_stats,
+    situation,
+)
+from .rules_index import format_passages, lookup_rules
+from .structured_output import (
+    MonsterActionResult,
+    PlayerActionResult,
+    extract_json,
+    parse_structured_output,
+    repair_prompt,
+    submit_tool,
+)
+from .tactics import (
+    ATTACK,
+    FLEE,
+    MONSTER_TACTICS,
+    MOVE,
+    choose_monster_defense,
+    decide_monster_action,
+    fight_back_weapon,
+    flee_delta,
+    move_delta,
+)
+from .telemetry import instrument_llm
+from .rules import (
+    DEFENSE_DODGE,
+    DEFENSE_FIGHT_BACK,
+    apply_attack_outcome,
+    apply_participant_deltas,
+    describe_attack,
+    get_weapon,
+    resolve_attack,
+)
 from .tools.dice_tools import roll_dice_tool
+from .tools.map_tools import map_query_tool, spatial_context
 
 # 加载环境变量
 load_dotenv()
@@ -19,32 +61,259 @@ load_dotenv()
 IS_DEBUG = os.getenv("IS_DEBUG", "false").lower() == "true"
 
 # 根据环境变量选择LLM
-def get_llm():
-    """根据环境变量选择使用Claude还是Google Gemini"""
+def get_llm(agent: Optional[str] = None):
+    """根据环境变量选择使用Claude还是Google Gemini
+
+    只导入选中的提供方模块。LLM_MODE 为 record / replay 时录制或回放调用（见 replay_llm）。
+    开启 TELEMETRY_ENABLED 时挂上指标回调（见 telemetry）。
+
+    Args:
+        agent: 调用方智能体的名字，开启了响应缓存的智能体会拿到带缓存的模型
+    """
+    if current_mode() == "replay":
+        # 回放录制的响应，不需要密钥和网络
+        return instrument_llm(wrap_llm(None), agent)
+    cache = get_response_cache(agent)
+    cache_kwargs = {"cache": cache} if cache is not None else {}
     anthropic_api_key = os.getenv("CLAUDE_API_KEY")
     google_api_key = os.getenv("GOOGLE_API_KEY")
 
     # 优先使用Claude
     if anthropic_api_key:
-        return ChatAnthropic(
+        from langchain_anthropic import ChatAnthropic
+
+        return instrument_llm(wrap_llm(ChatAnthropic(
             anthropic_api_key=anthropic_api_key,
             model=os.getenv("CLAUDE_MODEL", "claude-3-5-sonnet-20241022"),
             temperature=0.1,
             max_retries=3,
-            streaming=False,
-        )
+            **cache_kwargs,
+        )), agent)
     elif google_api_key:
-        return ChatGoogleGenerativeAI(
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return instrument_llm(wrap_llm(ChatGoogleGenerativeAI(
             model=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
             google_api_key=google_api_key,
             temperature=0.1,
             max_retries=3,
-        )
+            **cache_kwargs,
+        )), agent)
     else:
         raise ValueError("需要设置 ANTHROPIC_API_KEY 或 GOOGLE_API_KEY")
 
-# 初始化LLM
-llm = get_llm()
+# 各智能体的链和执行器只构建一次，LLM在第一次调用智能体时才创建
+agent_registry = AgentRegistry(get_llm)
+
+def get_agent_llm(agent: Optional[str] = None):
+    """返回智能体使用的LLM，第一次使用时创建
+
+    规则查询和OOC按配置使用响应缓存，战斗结算不缓存。
+    """
+    return agent_registry.get_llm(agent)
+
+def invalidate_agents() -> None:
+    """丢弃已创建的LLM和智能体，下次调用时按当前配置重建"""
+    agent_registry.invalidate()
+
+# ==================== 公共辅助函数 ====================
+
+def _parse_json_output(output: str, fallback: Dict[str, Any]) -> Dict[str, Any]:
+    """解析智能体输出的JSON，可能包含在代码块中或带有说明文字；解析失败时返回 fallback"""
+    try:
+        parsed = extract_json(output)
+    except ValueError:
+        return fallback
+    return parsed if isinstance(parsed, dict) else fallback
+
+def _message_text(content: Any) -> str:
+    """模型回复的文本；Claude 的回复可能是内容块列表"""
+    if isinstance(content, list):
+        return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return str(content)
+
+async def _parse_agent_result(agent: str, output: Any, schema: Type[BaseModel], fallback: Dict[str, Any]) -> Dict[str, Any]:
+    """按结果模型解析智能体的输出，失败时让模型按 Schema 修复，仍然失败时返回 fallback"""
+    async def repair(previous: str, error: str) -> str:
+        if IS_DEBUG:
+            print(f"Repair {agent} output: {error}")
+        response = await get_agent_llm().ainvoke(repair_prompt(previous, error, schema))
+        return _message_text(response.content)
+
+    result = await parse_structured_output(agent, _message_text(output), schema, repair)
+    return result.model_dump(exclude_none=True) if result is not None else fallback
+
+def _side_counts(state: GraphState) -> SideCounts:
+    """这个节点要更新的每方人数（状态里计数的副本，旧检查点没有计数时全量统计一次）"""
+    counts = state.get("side_counts")
+    return copy_counts(counts) if counts else count_sides(state["participants"])
+
+def _apply_deltas(participants: List[Participant], deltas: Any, counts: SideCounts) -> List[Participant]:
+    """合并LLM返回的参与者增量，丢弃不合法的字段；counts 随之更新"""
+    updated_participants, errors = apply_participant_deltas(participants, deltas if isinstance(deltas, list) else [], counts)
+    if errors and IS_DEBUG:
+        print(f"Rejected Deltas: {errors}")
+    return updated_participants
+
+async def _resolve_attack_action(
+    state: GraphState,
+    attacker: Participant,
+    defender: Participant,
+    weapon_name: Optional[str],
+    response: Optional[str] = None,
+) -> Dict[str, Any]:
+    """用规则引擎结算一次攻击，返回日志文本、更新后的参与者和每方人数"""
+    outcome = resolve_attack(attacker, defender, weapon_name, response, defender_weapon=fight_back_weapon(defender))
+    counts = _side_counts(state)
+    updated_participants = apply_attack_outcome(state["participants"], outcome, counts)
+    if IS_DEBUG:
+        print(f"Attack Outcome: {outcome.to_dict()}")
+    # 规则引擎的掷骰结果推送给事件流
+    await emit_event(DICE_ROLLED, outcome.to_dict())
+    return {
+        "text": describe_attack(outcome, updated_participants),
+        "participants": updated_participants,
+        "side_counts": counts,
+    }
+
+# ==================== 提示词模板 ====================
+
+# 前缀（system）只放不含变量的说明；每回合变化的内容（包括只保留相关区域的地图）都放进后缀（human）
+
+_TRIAGE_PROMPT = CachedPrompt(
+    prefix=["""你是一个游戏助手，负责将玩家在《克苏鲁的呼唤》游戏中的输入进行意图分类。根据玩家输入和当前上下文进行判断。
+    如果玩家输入是关于他的行动的，比如，"我使用武器攻击"，"闪避"，"对抗"，请返回 "direct_action"。
+    如果玩家输入是关于规则和状态的，请返回 "query"。
+    如果玩家输入是关于OOC的，请返回 "ooc"。
+    如果玩家输入是模糊的，请返回 "fuzzy_intent"。
+    请只返回意图分类，不要其他内容。
+"""],
+    suffix="""当前场景: 战斗在第{round_number}轮，轮到玩家 {player_id} 行动。
+    玩家输入: "{input}"
+    请对以上输入进行分类。""",
+)
+
+_MONSTER_AI_PROMPT = CachedPrompt(
+    prefix=["""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
+    重要：攻击的命中、闪避、反击和伤害都由规则引擎判定，你只需要决定怪物的行动意图，不要为攻击掷骰子。
+    其他需要掷骰子的行动，必须使用roll_dice_tool工具，不可以跳过掷骰子。
+    现在正在进行战斗轮，你正在扮演怪物。
+    地图信息只包含相关的区域，distances是你到其他角色的步数；需要其他区域的距离、路径或范围时使用map_query_tool工具。
+
+    决定你控制的怪物的行动，把行动意图描述出来放进description里。
+    如果是攻击，请把action.type设置为"attack"，并给出目标的id和使用的武器（如爪击、啃咬、徒手），规则引擎会完成判定并在需要时询问玩家闪避或反击。
+    如果是其他行动，请把action.type设置为"other"，把行动造成的结果完全描述出来，并带上掷骰子的动作和结果；
+    如果造成了数值变化或者location变化，只把变化量放进result数组里，不要返回完整的participant对象，例如：
+    {{"id": "角色id", "HP": -3, "SAN": -1, "status": "unconscious", "location": "区域名", "add_effects": ["流血"], "remove_effects": [], "add_items": [], "remove_items": ["医疗包"]}}
+    HP和SAN填写增减量，只写发生变化的字段，其他属性和技能不能修改。
+    最后调用submit_result工具提交结构化结果；无法调用工具时，返回JSON blob：
+    {{
+      "description": "行动意图(具体做了什么)",
+      "action": {{"type": "attack 或 other", "target": "攻击目标的id", "weapon": "使用的武器"}},
+      "result": "仅当action.type为other时，参与者的变化量[]",
+      "requiresPlayerInput": "是否需要玩家补充信息（攻击时由规则引擎决定，不用填写）",
+      "temp_player_actor": "需要补充信息的玩家的名字"
+    }}
+"""],
+    suffix="""之前的上下文信息: {context_info}
+    当前游戏状态: 轮到怪物 {current_actor_id} 行动。
+    最近的log: "{combat_log_text}",
+    地图信息：{map_info},
+    所有角色状态：{participants_info}
+    你的状态：{current_actor_info}""",
+    scratchpad=True,
+)
+
+_OOC_PROMPT = CachedPrompt(
+    prefix=["""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
+    请根据规则和常识，以KP的口吻清晰地回答玩家的问题，并引导他做出最终决定。注意，玩家可能会发表一些ooc，请合理的回复ooc即可
+"""],
+    suffix="""当前游戏状态: 轮到玩家 {player_id} 行动。
+    玩家的输入: "{input}"，
+    最近的log: {combat_log}""",
+)
+
+_RULES_KEEPER_PROMPT = CachedPrompt(
+    prefix=["""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
+    请优先依据相关规则，结合常识，以KP的口吻简洁地回答玩家的问题，并引导他做出最终决定。
+"""],
+    suffix="""当前游戏状态: 轮到玩家 {player_id} 行动。
+    玩家的输入: "{input}"，
+    最近的log: {combat_log}
+    相关规则: 
+    {rules_context}""",
+)
+
+_PLAYER_ACTION_PROMPT = CachedPrompt(
+    prefix=["""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
+    重要：攻击、闪避、反击的命中和伤害都由规则引擎判定，你只需要判断行动是否合法并给出行动意图，不要为这些行动掷骰子。
+    其他需要掷骰子的行动（如急救、侦查），必须使用roll_dice_tool工具，不可以跳过掷骰子。
+    
+    现在正在进行战斗轮，玩家输入的行动需要进行合法性判断。
+    如果是玩家的临时行动，玩家只能选择闪避(dodge)或者对抗(fight_back)，其他的行为不允许。
+    地图信息只包含相关的区域，distances是玩家到其他角色的步数；判断移动、距离和射程时，需要更多信息可以使用map_query_tool工具。
+
+    如果行为合法，把玩家的行动意图描述出来放进description里。
+    如果是攻击，请把action.type设置为"attack"，并给出目标的id和使用的武器（如手枪、猎刀、徒手）；如果是闪避或对抗，请把action.type设置为"dodge"或"fight_back"。
+    如果是其他行动，请把action.type设置为"other"，把行动造成的结果完全描述出来，并带上掷骰子的动作和结果；
+    如果造成了数值变化或者location变化，只把变化量放进result数组里，不要返回完整的participant对象，例如：
+    {{"id": "角色id", "HP": -3, "SAN": -1, "status": "unconscious", "location": "区域名", "add_effects": ["流血"], "remove_effects": [], "add_items": [], "remove_items": ["医疗包"]}}
+    HP和SAN填写增减量，只写发生变化的字段，其他属性和技能不能修改。
+    如果行为不合法，需要把不合法的原因放进description里。
+    如果需要某玩家补充信息,请把requiresPlayerInput设置为true，请把temp_player_actor设置为目标玩家的名字。
+    请分析玩家输入，最后调用submit_result工具提交结构化结果；无法调用工具时，返回JSON blob：
+    {{
+      "isValid": "输入是否合法",
+      "description": "不合法的原因，或者合法的行动意图(具体做了什么)",
+      "action": {{"type": "attack、dodge、fight_back 或 other", "target": "攻击目标的id", "weapon": "使用的武器"}},
+      "result": "仅当action.type为other时，参与者的变化量[]",
+      "requiresPlayerInput": "是否需要玩家补充信息",
+      "temp_player_actor": "需要补充信息的玩家名"
+    }}
+"""],
+    suffix="""当前是否为玩家的临时行动: {is_temp}
+    之前的上下文信息: {context_info}
+    当前游戏状态: 轮到玩家 {current_actor_id} 行动。
+    玩家的输入: "{input}"，
+    最近的log: "{combat_log_text}",
+    地图信息：{map_info},
+    所有角色状态：{participants_info}
+    当前玩家状态：{current_actor_info}""",
+    scratchpad=True,
+)
+
+_KEEPER_NARRATOR_PROMPT = CachedPrompt(
+    prefix=["""你是一位《克苏鲁的呼唤》的守秘人，擅长营造恐怖氛围。
+      请根据发生的事件，生成一段生动的战斗描述。给玩家反馈，或者告诉玩家轮到他行动。不要给玩家行动建议。也不要在输出里带上[守秘人]。
+      描述时要包括投骰子的命令和投骰子的结果，把它们融合进描述中。
+      描述中要区分不同的玩家，不要混淆称呼。
+      战斗描述要包含战斗的场景，战斗的参与者，战斗的行动，战斗的结果(如玩家对怪物造成1点伤害，怪物hp减少1点)。
+      描述里要把每个角色都带到，比如大致位置等。
+"""],
+    suffix="""所有角色：{participants_info}，
+      地图（角色所在的区域）：{map_info}
+      发生的事: {event_data}""",
+)
+
+# ==================== 智能体注册 ====================
+
+def _build_tool_agent(prompt: CachedPrompt, schema: Type[BaseModel]) -> Callable[[Any], AgentExecutor]:
+    """构建带掷骰工具和结果提交工具的 AgentExecutor
+
+    提交工具的参数就是结果模型的 JSON Schema，由提供方的工具调用保证结构；它 return_direct，参数即最终输出。
+    """
+    def builder(llm: Any) -> AgentExecutor:
+        tools = [roll_dice_tool, map_query_tool, submit_tool(schema)]
+        agent = create_tool_calling_agent(llm, tools, prompt.for_llm(llm))
+        return AgentExecutor(agent=agent, tools=tools)
+    return builder
+
+agent_registry.register("player_input_triage", lambda llm: _TRIAGE_PROMPT.for_llm(llm) | llm)
+agent_registry.register("monster_ai", _build_tool_agent(_MONSTER_AI_PROMPT, MonsterActionResult))
+agent_registry.register("ooc", lambda llm: _OOC_PROMPT.for_llm(llm) | llm, llm_agent="ooc")
+agent_registry.register("rules_keeper", lambda llm: _RULES_KEEPER_PROMPT.for_llm(llm) | llm, llm_agent="rules_keeper")
+agent_registry.register("player_action", _build_tool_agent(_PLAYER_ACTION_PROMPT, PlayerActionResult))
+agent_registry.register("keeper_narrator", lambda llm: _KEEPER_NARRATOR_PROMPT.for_llm(llm) | llm)
 
 # --- Agent 1: Player Input Triage Agent ---
 
@@ -52,21 +321,8 @@ async def player_input_triage_agent(state: GraphState) -> Dict[str, Any]:
     """玩家输入意图分类智能体"""
     if IS_DEBUG:
         print("--- 调用: Player Input Triage Agent ---")
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "你是一个游戏助手，负责将玩家在《克苏鲁的呼唤》游戏中的输入进行意图分类。根据玩家输入和当前上下文进行判断"),
-        ("human", """当前场景: 战斗在第{round_number}轮，轮到玩家 {player_id} 行动。
-        玩家输入: "{input}"
-        请对以上输入进行分类和解析。
-        如果玩家输入是关于他的行动的，比如，"我使用武器攻击"，"闪避"，"对抗"，请返回 "direct_action"。
-        如果玩家输入是关于规则和状态的，请返回 "query"。
-        如果玩家输入是关于OOC的，请返回 "ooc"。
-        如果玩家输入是模糊的，请返回 "fuzzy_intent"。
-        
-        请只返回意图分类，不要其他内容。""")
-    ])
-
-    chain = prompt.pipe(llm)
+
+    chain = agent_registry.get("player_input_triage")
     result = await chain.ainvoke({
         "round_number": state["round_number"],
         "player_id": state["initiative_order"][state["current_actor_index"]] if state["current_actor_index"] < len(state["initiative_order"]) else "unknown",
@@ -93,80 +349,122 @@ async def monster_ai_agent(state: GraphState) -> Dict[str, Any]:
     if IS_DEBUG:
         print("--- 调用: Monster AI Agent ---")
     
-    context_info = "\n".join(state["previous_context"])
     current_actor_id = state["initiative_order"][state["current_actor_index"]] if state["current_actor_index"] < len(state["initiative_order"]) else "unknown"
-    combat_log_text = "\n".join(state["combat_log"])
-    map_info = json.dumps(state["map"]) if state["map"] else "无地图信息"
-    participants_info = json.dumps(state["participants"])
-    current_actor_info = json.dumps(next((p for p in state["participants"] if p["id"] == current_actor_id), {}))
-    
-    prompt = ChatPromptTemplate.from_template("""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
-    重要：当你需要掷骰子时，必须使用roll_dice_tool工具，尤其是伤害，在判定命中后需要投伤害骰，通过roll_dice_tool工具计算。不可以跳过掷骰子，一定要用roll_dice_tool工具。
-    现在正在进行战斗轮，你正在扮演怪物。
-    之前的上下文信息: {context_info}
-    当前游戏状态: 轮到怪物 {current_actor_id} 行动。
-    最近的log: "{combat_log_text}",
-    地图信息：{map_info},
-    所有角色状态：{participants_info}
-    你的状态：{current_actor_info}
-    
-    决定你控制的怪物的行动，并把行动造成的结果完全描述出来放进description里,如果需要玩家补充信息，请也放进description里（如选择闪避或者对抗）。
-    比如：食尸鬼使用了爪击，需要描述命中，对方的闪避或者对抗，对方的血量变化，对方的状态变化，对方的死亡，等等。！！不要忘了带上掷骰子的动作和结果。
-    如果行动造成了数值变化或者location变化，需要把把更新后的对应participant对象放进result数组里。如玩家对食尸鬼造成1点伤害，那么result数组里需要有食尸鬼的更新后的对象，hp比之前少1点。
-    如果需要某玩家补充信息,请把requiresPlayerInput设置为true，请把temp_player_actor设置为目标玩家的名字。
-    返回JSON blob的结构化结果：
-    {{
-      "description": "行动信息(具体做了什么，造成了什么影响，)",
-      "result": "participants中发生数据变化的对象[]",
-      "requiresPlayerInput": "是否需要玩家补充信息",
-      "temp_player_actor": "需要补充信息的玩家的名字"
-    }}
+    current_actor = find_participant(state["participants"], current_actor_id)
+
+    # 没有智慧的怪物由战术引擎直接决定行动，不调用LLM
+    if MONSTER_TACTICS and current_actor:
+        decision = decide_monster_action(current_actor, state["participants"], state.get("map"))
+        if decision is not None:
+            if IS_DEBUG:
+                print(f"Tactical Decision: {decision}")
+            target = find_participant(state["participants"], decision.target_id)
+            if decision.kind == ATTACK and target:
+                return await _monster_attack(state, current_actor, target, decision.weapon, decision.description)
+            deltas = []
+            if decision.kind == FLEE:
+                deltas = [flee_delta(current_actor)]
+            elif decision.kind == MOVE and decision.zone:
+                deltas = [move_delta(current_actor, decision.zone)]
+            counts = _side_counts(state)
+            return {
+                "combat_log": [f"[守秘人]: {decision.description}"],
+                "participants": _apply_deltas(state["participants"], deltas, counts),
+                "side_counts": counts,
+                "requires_player_input": False,
+                "temp_player_actor": None,
+            }
+
+    # 需要LLM决策：优先使用并发规划好的计划，局势变化时只为这个怪物重新规划
+    plans = dict(state.get("monster_plans") or {})
+    plan = plans.pop(current_actor_id, None)
+    if plan is None and CONCURRENT_MONSTER_PLANNING:
+        plans = await plan_monster_phase(state, plan_monster_action)
+        plan = plans.pop(current_actor_id, None)
+    elif plan is not None:
+        current = plan_is_current(state, plan)
+        planning_stats.record_use(current)
+        if not current:
+            if IS_DEBUG:
+                print(f"Replan: {current_actor_id}")
+            plan = None
+    if plan is None:
+        plan = await plan_monster_action(state, current_actor_id)
+
+    parsed_result = plan["decision"]
+    description = parsed_result.get("description", "")
+    action = parsed_result.get("action") or {}
+    target = find_participant(state["participants"], action.get("target"))
+    common = {"context_summaries": plan["context_summaries"], "monster_plans": plans}
+
+    if action.get("type") == "attack" and current_actor and target:
+        return {**await _monster_attack(state, current_actor, target, action.get("weapon"), description), **common}
+
+    # 其他行动：合并LLM返回的参与者增量
+    counts = _side_counts(state)
+    return {
+        "combat_log": [f"[守秘人]: {description}"],
+        "participants": _apply_deltas(state["participants"], parsed_result.get("result"), counts),
+        "side_counts": counts,
+        "requires_player_input": parsed_result.get("requiresPlayerInput", False),
+        "temp_player_actor": parsed_result.get("temp_player_actor", None),
+        **common,
+    }
 
-    {agent_scratchpad}
-    """)
+async def plan_monster_action(state: GraphState, actor_id: str) -> Dict[str, Any]:
+    """让LLM决定一个怪物的行动（不结算），返回计划：决策、规划时的局势和上下文摘要进度"""
+    # 按token预算压缩上下文：旧事件进入滚动摘要，最近事件原样保留
+    context = build_combat_context(state, "monster_ai", actor_id=actor_id)
     
-    tools = [roll_dice_tool]
-    agent = create_tool_calling_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
-
-    result = await agent_executor.ainvoke({
-        "context_info": context_info,
-        "current_actor_id": current_actor_id,
-        "combat_log_text": combat_log_text,
-        "map_info": map_info,
-        "participants_info": participants_info,
-        "current_actor_info": current_actor_info
-    })
+    agent_executor = agent_registry.get("monster_ai")
+
+    with spatial_context(state.get("map"), state["participants"]):
+        result = await agent_executor.ainvoke({
+            "context_info": context.previous_context,
+            "current_actor_id": actor_id,
+            "combat_log_text": context.log_text,
+            "map_info": context.map,
+            "participants_info": context.participants,
+            "current_actor_info": compact_json(find_participant(state["participants"], actor_id) or {})
+        })
     
     # 解析结果
     output = result["output"]
-    parsed_result = None
-    
-    # 处理 LLM 返回的内容，可能包含在代码块中
-    if "```json" in output:
-        json_match = re.search(r"```json\s*([\s\S]*?)\s*```", output)
-        if json_match:
-            parsed_result = json.loads(json_match.group(1))
-    else:
-        # 尝试直接解析JSON
-        try:
-            parsed_result = json.loads(output)
-        except:
-            parsed_result = {"description": output, "result": [], "requiresPlayerInput": False}
-
-    # 更新参与者
-    updated_participants = state["participants"].copy()
-    if parsed_result and "result" in parsed_result:
-        for updated_participant_data in parsed_result["result"]:
-            for i, participant in enumerate(updated_participants):
-                if participant["id"] == updated_participant_data.get("id"):
-                    updated_participants[i] = updated_participant_data
-                    break
+    parsed_result = await _parse_agent_result(
+        "monster_ai", output, MonsterActionResult,
+        {"description": _message_text(output), "result": [], "requiresPlayerInput": False},
+    )
     return {
-        "combat_log": [f"[守秘人]: {parsed_result.get('description', '')}"],
-        "participants": updated_participants,
-        "requires_player_input": parsed_result.get("requiresPlayerInput", False) if parsed_result else False,
-        "temp_player_actor": parsed_result.get("temp_player_actor", None) if parsed_result else None,
+        "decision": parsed_result,
+        "round": state.get("round_number"),
+        "situation": situation(state["participants"], plan_dependencies(actor_id, parsed_result)),
+        "context_summaries": context.summary_update,
+    }
+
+async def _monster_attack(
+    state: GraphState,
+    attacker: Participant,
+    target: Participant,
+    weapon_name: Optional[str],
+    description: str,
+) -> Dict[str, Any]:
+    """怪物发起攻击：近战攻击调查员时等待玩家选择闪避或反击，否则直接结算"""
+    weapon = get_weapon(weapon_name)
+    if target["type"] == "investigator" and weapon.skill == "fighting":
+        return {
+            "combat_log": [f"[守秘人]: {description} {attacker['name']} 使用{weapon.name}攻击 {target['name']}，{target['name']} 需要选择闪避或者反击。"],
+            "participants": state["participants"],
+            "pending_attack": {"attacker_id": attacker["id"], "defender_id": target["id"], "weapon": weapon.name},
+            "requires_player_input": True,
+            "temp_player_actor": target["name"],
+        }
+    resolution = await _resolve_attack_action(state, attacker, target, weapon.name)
+    return {
+        "combat_log": [f"[守秘人]: {description} {resolution['text']}"],
+        "participants": resolution["participants"],
+        "side_counts": resolution["side_counts"],
+        "requires_player_input": False,
+        "temp_player_actor": None,
     }
 
 # --- Agent 3: OOC Agent ---
@@ -176,13 +474,7 @@ async def ooc_agent(state: GraphState) -> Dict[str, Any]:
     if IS_DEBUG:
         print("--- 调用: ooc Agent ---")
     
-    prompt = ChatPromptTemplate.from_template("""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
-    当前游戏状态: 轮到玩家 {player_id} 行动。
-    玩家的输入: "{input}"，
-    最近的log: {combat_log}
-    请根据规则和常识，以KP的口吻清晰地回答玩家的问题，并引导他做出最终决定。注意，玩家可能会发表一些ooc，请合理的回复ooc即可""")
-    
-    chain = prompt.pipe(llm)
+    chain = agent_registry.get("ooc")
     result = await chain.ainvoke({
         "player_id": state["initiative_order"][state["current_actor_index"]] if state["current_actor_index"] < len(state["initiative_order"]) else "unknown",
         "input": state["player_input"] or "",
@@ -203,18 +495,23 @@ async def rules_keeper_agent(state: GraphState) -> Dict[str, Any]:
     
     if state["classified_intent"] != ClassifiedIntent.QUERY:
         return {}
+
+    # 先查本地规则索引，高置信度命中时直接用规则原文回答
+    rules = lookup_rules(state["player_input"] or "")
+    if rules.direct_answer:
+        if IS_DEBUG:
+            print(f"规则索引直接回答: {rules.direct_answer}")
+        return {
+            "combat_log": [f"[守秘人]: {rules.direct_answer}"],
+            "llm_output": rules.direct_answer
+        }
     
-    prompt = ChatPromptTemplate.from_template("""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
-    当前游戏状态: 轮到玩家 {player_id} 行动。
-    玩家的输入: "{input}"，
-    最近的log: {combat_log}
-    请根据规则和常识，以KP的口吻清晰地回答玩家的问题，并引导他做出最终决定。""")
-    
-    chain = prompt.pipe(llm)
+    chain = agent_registry.get("rules_keeper")
     result = await chain.ainvoke({
         "player_id": state["initiative_order"][state["current_actor_index"]] if state["current_actor_index"] < len(state["initiative_order"]) else "unknown",
         "input": state["player_input"] or "",
         "combat_log": "\n".join(state["combat_log"][-7:]),
+        "rules_context": format_passages(rules.matches),
     })
     
     return {
@@ -232,89 +529,92 @@ async def player_action_agent(state: GraphState) -> Dict[str, Any]:
     if state["classified_intent"] != ClassifiedIntent.DIRECT_ACTION:
         return {}
     
-    tools = [roll_dice_tool]
-    prompt = ChatPromptTemplate.from_template("""你是一位经验丰富的《克苏鲁的呼唤》守秘人(KP)。
-    重要：当你需要掷骰子时，必须使用roll_dice_tool工具，尤其是伤害，在判定命中后需要投伤害骰，也要通过roll_dice_tool工具计算。不可以跳过掷骰子，一定要用roll_dice_tool工具。
-    
-    现在正在进行战斗轮，玩家输入的行动需要进行合法性判断。
-    当前是否为玩家的临时行动: {is_temp}, 如果是临时行动，玩家只能选择闪避或者对抗，其他的行为不允许。
-    之前的上下文信息: {context_info}
-    当前游戏状态: 轮到玩家 {current_actor_id} 行动。
-    玩家的输入: "{input}"，
-    最近的log: "{combat_log_text}",
-    地图信息：{map_info},
-    所有角色状态：{participants_info}
-    当前玩家状态：{current_actor_info}
-    
-    如果行为合法，需要把玩家输入的行为造成的结果完全描述出来放进description里。比如：玩家对怪物使用了武器，需要描述武器的命中，怪物的闪避或者对抗，怪物的血量变化，怪物的状态变化，怪物的死亡，等等。！！不要忘了带上掷骰子的动作和结果。
-    如果行为不合法，需要把不合法的原因放进description里。
-    如果玩家的行为造成了数值变化或者location变化，需要把把更新后的对应participant对象放进result数组里。如玩家对食尸鬼造成1点伤害，那么result数组里需要有食尸鬼的更新后的对象，hp比之前少1点。
-    如果需要某玩家补充信息,请把requiresPlayerInput设置为true，请把temp_player_actor设置为目标玩家的名字。
-    请分析玩家输入并返回JSON blob的结构化结果：
-    {{
-      "isValid": "输入是否合法",
-      "description": "不合法的原因，或者合法的行动信息(具体做了什么，造成了什么影响，)",
-      "result": "participants中发生数据变化的对象[]",
-      "requiresPlayerInput": "是否需要玩家补充信息",
-      "temp_player_actor": "需要补充信息的玩家名"
-    }}
-
-    {agent_scratchpad}
-    """)
+    current_actor_id = state["initiative_order"][state["current_actor_index"]] if state["current_actor_index"] < len(state["initiative_order"]) else "unknown"
+    pending_attack = state.get("pending_attack")
     
-    agent = create_tool_calling_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools)
-
-    result = await agent_executor.ainvoke({
-        "context_info": "\n".join(state["previous_context"]),
-        "current_actor_id": state["initiative_order"][state["current_actor_index"]] if state["current_actor_index"] < len(state["initiative_order"]) else "unknown",
-        "combat_log_text": "\n".join(state["combat_log"]),
-        "map_info": json.dumps(state["map"]) if state["map"] else "无地图信息",
-        "participants_info": json.dumps(state["participants"]),
-        "current_actor_info": json.dumps(next((p for p in state["participants"] if p["id"] == state["initiative_order"][state["current_actor_index"]]), {})),
-        "input": state["player_input"] or "",
-        "is_temp": state["temp_player_actor"] is not None,
-    })
+    context = build_combat_context(state, "player_action", actor_id=current_actor_id)
+    agent_executor = agent_registry.get("player_action")
+
+    with spatial_context(state.get("map"), state["participants"]):
+        result = await agent_executor.ainvoke({
+            "context_info": context.previous_context,
+            "current_actor_id": current_actor_id,
+            "combat_log_text": context.log_text,
+            "map_info": context.map,
+            "participants_info": context.participants,
+            "current_actor_info": compact_json(find_participant(state["participants"], current_actor_id) or {}),
+            "input": state["player_input"] or "",
+            "is_temp": state["temp_player_actor"] is not None,
+        })
     
     output = result["output"]
-    parsed_result = None
-    
-    # 处理 LLM 返回的内容，可能包含在代码块中
-    if "```json" in output:
-        json_match = re.search(r"```json\s*([\s\S]*?)\s*```", output)
-        if json_match:
-            parsed_result = json.loads(json_match.group(1))
-    else:
-        # 尝试直接解析JSON
-        try:
-            parsed_result = json.loads(output)
-        except:
-            parsed_result = {"isValid": False, "description": output, "result": []}
+    parsed_result = await _parse_agent_result(
+        "player_action", output, PlayerActionResult,
+        {"isValid": False, "description": _message_text(output), "result": []},
+    )
 
     if IS_DEBUG:
         print(f"Player Action Result: {parsed_result}")
 
+    description = parsed_result.get("description", "")
     if not parsed_result.get("isValid", False):
         return {
-            "combat_log": [f"[守秘人]: {parsed_result.get('description', '')}"],
+            "combat_log": [f"[守秘人]: {description}"],
             "is_valid_action": False,
+            "context_summaries": context.summary_update,
         }
 
-    # 更新participants
-    updated_participants = state["participants"].copy()
-    if "result" in parsed_result:
-        for updated_participant_data in parsed_result["result"]:
-            for i, participant in enumerate(updated_participants):
-                if participant["id"] == updated_participant_data.get("id"):
-                    updated_participants[i] = updated_participant_data
-                    break
-
+    action = parsed_result.get("action") or {}
+    action_type = action.get("type")
+
+    # 对之前怪物的攻击做出闪避或反击
+    if pending_attack and action_type in (DEFENSE_DODGE, DEFENSE_FIGHT_BACK):
+        attacker = find_participant(state["participants"], pending_attack["attacker_id"])
+        defender = find_participant(state["participants"], pending_attack["defender_id"])
+        if attacker and defender:
+            resolution = await _resolve_attack_action(
+                state, attacker, defender, pending_attack["weapon"], action_type
+            )
+            return {
+                "combat_log": [f"[守秘人]: {description} {resolution['text']}"],
+                "is_valid_action": True,
+                "participants": resolution["participants"],
+                "side_counts": resolution["side_counts"],
+                "pending_attack": None,
+                "requires_player_input": False,
+                "temp_player_actor": None,
+                "context_summaries": context.summary_update,
+            }
+
+    # 玩家发起攻击，怪物按战术选择闪避或反击，其余由规则引擎自动选择
+    if action_type == "attack":
+        attacker = find_participant(state["participants"], current_actor_id)
+        target = find_participant(state["participants"], action.get("target"))
+        if attacker and target:
+            resolution = await _resolve_attack_action(
+                state, attacker, target, action.get("weapon"),
+                choose_monster_defense(target, action.get("weapon")) if MONSTER_TACTICS else None,
+            )
+            return {
+                "combat_log": [f"[守秘人]: {description} {resolution['text']}"],
+                "is_valid_action": True,
+                "participants": resolution["participants"],
+                "side_counts": resolution["side_counts"],
+                "requires_player_input": False,
+                "temp_player_actor": None,
+                "context_summaries": context.summary_update,
+            }
+
+    # 其他行动：合并LLM返回的参与者增量
+    counts = _side_counts(state)
     return {
-        "combat_log": [f"[守秘人]: {parsed_result.get('description', '')}"],
+        "combat_log": [f"[守秘人]: {description}"],
         "is_valid_action": True,
-        "participants": updated_participants,
-        "requires_player_input": parsed_result.get("requiresPlayerInput", False) if parsed_result else False,
-        "temp_player_actor": parsed_result.get("temp_player_actor", None) if parsed_result else None,
+        "participants": _apply_deltas(state["participants"], parsed_result.get("result"), counts),
+        "side_counts": counts,
+        "requires_player_input": parsed_result.get("requiresPlayerInput", False),
+        "temp_player_actor": parsed_result.get("temp_player_actor", None),
+        "context_summaries": context.summary_update,
     }
 
 # --- Agent 6: Keeper Narrator Agent ---
@@ -323,22 +623,13 @@ async def keeper_narrator_agent(state: GraphState) -> Dict[str, Any]:
     """守秘人叙述智能体"""
     if IS_DEBUG:
         print("--- 调用: Keeper Narrator Agent ---", state["combat_log"])
-
-    prompt = ChatPromptTemplate.from_template("""你是一位《克苏鲁的呼唤》的守秘人，擅长营造恐怖氛围。
-      所有角色：{participants_info}，
-      地图：{map_info}
-      请根据以下发生的事件，生成一段生动的战斗描述。给玩家反馈，或者告诉玩家轮到他行动。不要给玩家行动建议。也不要在输出里带上[守秘人]。
-      描述时要包括投骰子的命令和投骰子的结果，把它们融合进描述中。
-      描述中要区分不同的玩家，不要混淆称呼。
-      战斗描述要包含战斗的场景，战斗的参与者，战斗的行动，战斗的结果(如玩家对怪物造成1点伤害，怪物hp减少1点)。
-      描述里要把每个角色都带到，比如大致位置等。
-      发生的事: {event_data}""")
     
-    chain = prompt.pipe(llm)
+    context = build_combat_context(state, "keeper_narrator")
+    chain = agent_registry.get("keeper_narrator")
     result = await chain.ainvoke({
-        "event_data": json.dumps("\n".join(state["combat_log"])),
-        "participants_info": json.dumps(state["participants"]),
-        "map_info": json.dumps(state["map"]) if state["map"] else "{}",
+        "event_data": context.log_text,
+        "participants_info": context.participants,
+        "map_info": context.map,
     })
 
-    return {"llm_output": result.content} 
\ No newline at end of file
+    return {"llm_output": result.content, "context_summaries": context.summary_update} 
\ No newline at end of file
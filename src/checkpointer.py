@@ -0,0 +1,751 @@
+# === src/checkpointer.py ===
+
+"""
+检查点存储
+
+combat_workflow 使用的 LangGraph 检查点存储，由 CHECKPOINTER 选择：
+- bounded: BoundedMemorySaver（默认），内存中每个会话只保留最近的检查点，空闲会话按 LRU/TTL 淘汰
+  （设置 CHECKPOINT_SPILL_DIR 时淘汰到磁盘）
+- memory: LangGraph 自带的 MemorySaver，进程内保存全部历史，重启后丢失
+- sqlite: SQLiteSaver，保存在本地 SQLite 文件（WAL 模式）
+
+SQLiteSaver:
+- 写入先进入缓冲区，由后台线程按 CHECKPOINT_FLUSH_INTERVAL 批量提交（一次事务）；
+  读取前会先提交缓冲区，所以读到的总是最新状态。间隔为 0 时每次写入立即提交
+- 每个会话只保留最近 CHECKPOINT_KEEP_LAST 个检查点，提交时顺带清理被写入的会话；
+  prune() 清理全部会话，可以单独运行: python -m src.checkpointer --prune
+"""
+
+import argparse
+import asyncio
+import atexit
+import hashlib
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Set, Tuple, cast
+
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+# 加载环境变量
+load_dotenv()
+
+CHECKPOINTER = os.getenv("CHECKPOINTER", "bounded").lower()
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", ".cache/checkpoints.sqlite3")
+# 每个会话保留的检查点数，0 表示全部保留
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "20"))
+# 批量提交的间隔（秒），0 表示每次写入立即提交
+CHECKPOINT_FLUSH_INTERVAL = float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "0.5"))
+# 缓冲区达到该条数时立即提交
+CHECKPOINT_BATCH_SIZE = int(os.getenv("CHECKPOINT_BATCH_SIZE", "64"))
+# 有界内存存储：驻留会话数上限和空闲超时（秒），0 表示不限
+CHECKPOINT_MAX_SESSIONS = int(os.getenv("CHECKPOINT_MAX_SESSIONS", "256"))
+CHECKPOINT_SESSION_TTL = float(os.getenv("CHECKPOINT_SESSION_TTL", "1800"))
+# 设置后淘汰的会话写入该目录（第一次写入时创建），下次访问时读回；默认不设置，直接丢弃
+CHECKPOINT_SPILL_DIR = os.getenv("CHECKPOINT_SPILL_DIR") or None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+def _checkpoint_config(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+def _next_version(current: Optional[str]) -> str:
+    """与 MemorySaver 相同的版本号格式：递增序号 + 随机后缀"""
+    if current is None:
+        current_v = 0
+    elif isinstance(current, int):
+        current_v = current
+    else:
+        current_v = int(current.split(".")[0])
+    return f"{current_v + 1:032}.{random.random():016}"
+
+class SQLiteSaver(BaseCheckpointSaver[str]):
+    """SQLite 检查点存储，批量提交并按会话保留最近的检查点"""
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB_PATH,
+        *,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        flush_interval: float = CHECKPOINT_FLUSH_INTERVAL,
+        batch_size: int = CHECKPOINT_BATCH_SIZE,
+        serde: Optional[SerializerProtocol] = None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.keep_last = keep_last
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()  # 保护连接
+        self._buffer_lock = threading.Lock()  # 保护缓冲区
+        self._buffer: List[Tuple[str, tuple]] = []
+        self._touched: Set[Tuple[str, str]] = set()  # 缓冲区中写入过检查点的 (thread_id, checkpoint_ns)
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flusher", daemon=True)
+            self._flusher.start()
+
+    # ---------- 写缓冲 ----------
+
+    def _enqueue(self, statements: List[Tuple[str, tuple]], touched: Optional[Tuple[str, str]] = None) -> None:
+        with self._buffer_lock:
+            self._buffer.extend(statements)
+            if touched is not None:
+                self._touched.add(touched)
+            pending = len(self._buffer)
+        if self._flusher is None:
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """在一个事务中提交缓冲区，并清理被写入会话的旧检查点；返回提交的语句数"""
+        with self._lock:
+            with self._buffer_lock:
+                statements, self._buffer = self._buffer, []
+                touched, self._touched = self._touched, set()
+            if not statements:
+                return 0
+            with self._conn:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+                for thread_id, checkpoint_ns in touched:
+                    self._prune_thread(thread_id, checkpoint_ns)
+            return len(statements)
+
+    def close(self) -> None:
+        """提交剩余的写入并关闭连接"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # ---------- 保留策略 ----------
+
+    def _prune_thread(self, thread_id: str, checkpoint_ns: str) -> int:
+        if self.keep_last <= 0:
+            return 0
+        cursor = self._conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id IN ("
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?)",
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last),
+        )
+        if cursor.rowcount:
+            self._conn.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ("
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+            )
+        return cursor.rowcount
+
+    def prune(self, thread_id: Optional[str] = None) -> int:
+        """清理旧检查点（默认所有会话），返回删除的检查点数"""
+        self.flush()
+        with self._lock, self._conn:
+            if thread_id is None:
+                threads = self._conn.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints").fetchall()
+            else:
+                threads = self._conn.execute(
+                    "SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+                ).fetchall()
+            return sum(self._prune_thread(thread, ns) for thread, ns in threads)
+
+    def stats(self) -> Dict[str, int]:
+        self.flush()
+        with self._lock:
+            threads, checkpoints = self._conn.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ).fetchone()
+            writes = self._conn.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+        return {"threads": threads, "checkpoints": checkpoints, "writes": writes}
+
+    # ---------- 读取 ----------
+
+    def _load_tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config=_checkpoint_config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)) if metadata_type else {},
+            parent_config=(
+                _checkpoint_config(thread_id, checkpoint_ns, parent_checkpoint_id) if parent_checkpoint_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        self.flush()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    f"{columns} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"{columns} WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._load_tuple(thread_id, checkpoint_ns, row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        self.flush()
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        sql = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+               "FROM checkpoints")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            results = []
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                item = self._load_tuple(thread_id, checkpoint_ns, tuple(row))
+                if filter and not all(item.metadata.get(key) == value for key, value in filter.items()):
+                    continue
+                results.append(item)
+        yield from results
+
+    # ---------- 写入 ----------
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        self._enqueue(
+            [(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, data, metadata_type, metadata_data),
+            )],
+            touched=(thread_id, checkpoint_ns),
+        )
+        return _checkpoint_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        statements = []
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            # 特殊写入（错误、中断）覆盖旧值，普通写入保留第一次的结果
+            verb = "INSERT OR REPLACE" if write_idx < 0 else "INSERT OR IGNORE"
+            type_, data = self.serde.dumps_typed(value)
+            statements.append((
+                f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx, channel, type_, data, task_path),
+            ))
+        self._enqueue(statements)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    # ---------- 异步接口：读取和删除可能要等待提交，放到线程中运行 ----------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        if self._flusher is None:
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        if self._flusher is None:
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return _next_version(current)
+
+# ==================== 有界内存存储 ====================
+
+class _ThreadCheckpoints:
+    """一个会话的检查点，全部是序列化后的字节，可以直接 pickle 到磁盘"""
+
+    __slots__ = ("checkpoints", "writes", "bytes", "last_access")
+
+    def __init__(self):
+        # checkpoint_ns -> checkpoint_id -> (type, checkpoint, metadata_type, metadata, parent_checkpoint_id)
+        self.checkpoints: Dict[str, Dict[str, Tuple[str, bytes, str, bytes, Optional[str]]]] = {}
+        # (checkpoint_ns, checkpoint_id) -> (task_id, idx) -> (task_id, channel, type, value, task_path)
+        self.writes: Dict[Tuple[str, str], Dict[Tuple[str, int], Tuple[str, str, str, bytes, str]]] = {}
+        self.bytes = 0
+        self.last_access = time.time()
+
+    def __getstate__(self):
+        return (self.checkpoints, self.writes, self.bytes)
+
+    def __setstate__(self, state):
+        self.checkpoints, self.writes, self.bytes = state
+        self.last_access = time.time()
+
+class BoundedMemorySaver(BaseCheckpointSaver[str]):
+    """有界的内存检查点存储
+
+    - 每个会话只保留最近 keep_last 个检查点
+    - 会话数超过 max_sessions 时按最近使用淘汰，空闲超过 session_ttl 秒的会话也会被淘汰
+    - 设置了 spill_dir 时，淘汰的会话写入磁盘（目录在第一次写入时创建），下次访问该 thread_id 时自动读回；
+      否则直接丢弃。这时异步接口在线程中运行，读写文件不阻塞事件循环
+    """
+
+    def __init__(
+        self,
+        *,
+        keep_last: int = CHECKPOINT_KEEP_LAST,
+        max_sessions: int = CHECKPOINT_MAX_SESSIONS,
+        session_ttl: float = CHECKPOINT_SESSION_TTL,
+        spill_dir: Optional[str] = CHECKPOINT_SPILL_DIR,
+        serde: Optional[SerializerProtocol] = None,
+    ):
+        super().__init__(serde=serde)
+        self.keep_last = keep_last
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.spill_dir = spill_dir or None
+        self._threads: "OrderedDict[str, _ThreadCheckpoints]" = OrderedDict()  # 按最近使用排序
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self._evictions = 0
+        self._spills = 0
+        self._rehydrations = 0
+
+    # ---------- 会话驻留 ----------
+
+    def _spill_path(self, thread_id: str) -> str:
+        return os.path.join(cast(str, self.spill_dir), hashlib.sha1(thread_id.encode("utf-8")).hexdigest() + ".pkl")
+
+    def _thread(self, thread_id: str, create: bool = False) -> Optional[_ThreadCheckpoints]:
+        """取出会话（必要时从磁盘读回），并标记为最近使用"""
+        data = self._threads.get(thread_id)
+        if data is None and self.spill_dir:
+            path = self._spill_path(thread_id)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = pickle.load(f)
+                os.remove(path)
+                self._threads[thread_id] = data
+                self._bytes += data.bytes
+                self._rehydrations += 1
+        if data is None and create:
+            data = self._threads[thread_id] = _ThreadCheckpoints()
+        if data is not None:
+            self._threads.move_to_end(thread_id)
+            data.last_access = time.time()
+            if len(self._threads) > self.max_sessions > 0:
+                self.evict_idle(keep=thread_id)
+        return data
+
+    def _evict_one(self, thread_id: str) -> None:
+        data = self._threads.pop(thread_id)
+        self._bytes -= data.bytes
+        self._evictions += 1
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = self._spill_path(thread_id)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            self._spills += 1
+
+    def evict_idle(self, keep: Optional[str] = None) -> int:
+        """淘汰空闲超时和超出数量上限的会话（keep 除外），返回淘汰数"""
+        with self._lock:
+            evicted = 0
+            if self.session_ttl > 0:
+                deadline = time.time() - self.session_ttl
+                # 按最近使用排序，最前面的最久未使用
+                for thread_id in [t for t, data in self._threads.items() if data.last_access < deadline and t != keep]:
+                    self._evict_one(thread_id)
+                    evicted += 1
+            while self.max_sessions > 0 and len(self._threads) > self.max_sessions:
+                thread_id = next(iter(self._threads))
+                if thread_id == keep:
+                    self._threads.move_to_end(thread_id)
+                    thread_id = next(iter(self._threads))
+                self._evict_one(thread_id)
+                evicted += 1
+            return evicted
+
+    def _trim(self, data: _ThreadCheckpoints, checkpoint_ns: str) -> None:
+        """只保留最近 keep_last 个检查点"""
+        checkpoints = data.checkpoints.get(checkpoint_ns, {})
+        if self.keep_last <= 0 or len(checkpoints) <= self.keep_last:
+            return
+        for checkpoint_id in sorted(checkpoints)[:len(checkpoints) - self.keep_last]:
+            _, checkpoint, _, metadata, _ = checkpoints.pop(checkpoint_id)
+            freed = len(checkpoint) + len(metadata)
+            for write in data.writes.pop((checkpoint_ns, checkpoint_id), {}).values():
+                freed += len(write[3])
+            data.bytes -= freed
+            self._bytes -= freed
+
+    def stats(self) -> Dict[str, int]:
+        """驻留会话数和字节数等计数"""
+        with self._lock:
+            return {
+                "resident_sessions": len(self._threads),
+                "resident_bytes": self._bytes,
+                "resident_checkpoints": sum(
+                    len(checkpoints) for data in self._threads.values() for checkpoints in data.checkpoints.values()
+                ),
+                "evictions": self._evictions,
+                "spills": self._spills,
+                "rehydrations": self._rehydrations,
+            }
+
+    # ---------- 读取 ----------
+
+    def _make_tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, data: _ThreadCheckpoints) -> CheckpointTuple:
+        type_, checkpoint, metadata_type, metadata, parent_checkpoint_id = data.checkpoints[checkpoint_ns][checkpoint_id]
+        writes = data.writes.get((checkpoint_ns, checkpoint_id), {})
+        return CheckpointTuple(
+            config=_checkpoint_config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                _checkpoint_config(thread_id, checkpoint_ns, parent_checkpoint_id) if parent_checkpoint_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v, _ in writes.values()],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            data = self._thread(thread_id)
+            checkpoints = data.checkpoints.get(checkpoint_ns) if data else None
+            if not checkpoints:
+                return None
+            checkpoint_id = get_checkpoint_id(config) or max(checkpoints)
+            if checkpoint_id not in checkpoints:
+                return None
+            return self._make_tuple(thread_id, checkpoint_ns, checkpoint_id, cast(_ThreadCheckpoints, data))
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """列出检查点；不指定 thread_id 时只包括驻留在内存中的会话"""
+        config_ns = config["configurable"].get("checkpoint_ns") if config else None
+        config_id = get_checkpoint_id(config) if config else None
+        before_id = get_checkpoint_id(before) if before else None
+        results: List[CheckpointTuple] = []
+        with self._lock:
+            if config:
+                thread_ids = [config["configurable"]["thread_id"]]
+                self._thread(thread_ids[0])
+            else:
+                thread_ids = list(self._threads)
+            for thread_id in thread_ids:
+                data = self._threads.get(thread_id)
+                if data is None:
+                    continue
+                for checkpoint_ns, checkpoints in data.checkpoints.items():
+                    if config_ns is not None and checkpoint_ns != config_ns:
+                        continue
+                    for checkpoint_id in sorted(checkpoints, reverse=True):
+                        if config_id and checkpoint_id != config_id:
+                            continue
+                        if before_id and checkpoint_id >= before_id:
+                            continue
+                        if limit is not None and len(results) >= limit:
+                            break
+                        item = self._make_tuple(thread_id, checkpoint_ns, checkpoint_id, data)
+                        if filter and not all(item.metadata.get(key) == value for key, value in filter.items()):
+                            continue
+                        results.append(item)
+        yield from results
+
+    # ---------- 写入 ----------
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, data_bytes = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_bytes = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            data = cast(_ThreadCheckpoints, self._thread(thread_id, create=True))
+            checkpoints = data.checkpoints.setdefault(checkpoint_ns, {})
+            old = checkpoints.get(checkpoint["id"])
+            if old is not None:
+                freed = len(old[1]) + len(old[3])
+                data.bytes -= freed
+                self._bytes -= freed
+            checkpoints[checkpoint["id"]] = (
+                type_, data_bytes, metadata_type, metadata_bytes, config["configurable"].get("checkpoint_id")
+            )
+            added = len(data_bytes) + len(metadata_bytes)
+            data.bytes += added
+            self._bytes += added
+            self._trim(data, checkpoint_ns)
+            self.evict_idle(keep=thread_id)
+        return _checkpoint_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            data = cast(_ThreadCheckpoints, self._thread(thread_id, create=True))
+            stored = data.writes.setdefault((checkpoint_ns, checkpoint_id), {})
+            for idx, (channel, value) in enumerate(writes):
+                key = (task_id, WRITES_IDX_MAP.get(channel, idx))
+                # 特殊写入（错误、中断）覆盖旧值，普通写入保留第一次的结果
+                if key[1] >= 0 and key in stored:
+                    continue
+                type_, value_bytes = self.serde.dumps_typed(value)
+                old = stored.get(key)
+                delta = len(value_bytes) - (len(old[3]) if old else 0)
+                stored[key] = (task_id, channel, type_, value_bytes, task_path)
+                data.bytes += delta
+                self._bytes += delta
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            data = self._threads.pop(thread_id, None)
+            if data is not None:
+                self._bytes -= data.bytes
+            if self.spill_dir and os.path.exists(self._spill_path(thread_id)):
+                os.remove(self._spill_path(thread_id))
+
+    # ---------- 异步接口：只在内存中时直接完成，会淘汰到磁盘时放到线程中运行 ----------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        if self.spill_dir:
+            return await asyncio.to_thread(self.get_tuple, config)
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        if self.spill_dir:
+            items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        else:
+            items = list(self.list(config, filter=filter, before=before, limit=limit))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        if self.spill_dir:
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        if self.spill_dir:
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        if self.spill_dir:
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+        self.delete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return _next_version(current)
+
+def create_checkpointer(kind: str = CHECKPOINTER) -> BaseCheckpointSaver:
+    """按配置创建检查点存储"""
+    if kind == "sqlite":
+        saver = SQLiteSaver()
+        # 退出时提交缓冲区中还没写入的检查点
+        atexit.register(saver.close)
+        return saver
+    if kind == "bounded":
+        return BoundedMemorySaver()
+    if kind != "memory":
+        raise ValueError(f"未知的检查点存储: {kind}（可选 bounded、memory、sqlite）")
+    from langgraph.checkpoint.memory import MemorySaver
+
+    return MemorySaver()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite 检查点维护")
+    parser.add_argument("--path", default=CHECKPOINT_DB_PATH)
+    parser.add_argument("--keep-last", type=int, default=CHECKPOINT_KEEP_LAST)
+    parser.add_argument("--prune", action="store_true", help="清理每个会话超出保留数的旧检查点")
+    parser.add_argument("--vacuum", action="store_true", help="清理后压缩数据库文件")
+    args = parser.parse_args()
+
+    saver = SQLiteSaver(args.path, keep_last=args.keep_last, flush_interval=0)
+    try:
+        if args.prune:
+            print(f"删除了 {saver.prune()} 个旧检查点")
+        if args.vacuum:
+            with saver._lock:
+                saver._conn.execute("VACUUM")
+        print(saver.stats())
+    finally:
+        saver.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,17 @@
 
 import os
 import random
-from typing import Dict, Any
+from typing import Dict, Any, cast
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 from src.types import ClassifiedIntent, GraphState, ParticipantStatus
 
+from .checkpointer import create_checkpointer
+from .intent_classifier import INTENT_CONFIDENCE_THRESHOLD, classify_intent
+from .participant_store import count_sides, find_participant, is_down, side_defeated
+from .speculation import SPECULATION_MIN_CONFIDENCE, SPECULATIVE_ACTION, speculate
+from .telemetry import traced_node
+
 from .agents import (
     player_input_triage_agent,
     monster_ai_agent,
@@ -24,6 +29,11 @@ IS_DEBUG = os.getenv("IS_DEBUG", "false").lower() == "true"
 
 # ==================== 战斗流程节点 ====================
 
+def _merge_context_summaries(state: GraphState, result: Dict[str, Any]) -> None:
+    """保存智能体返回的上下文摘要进度"""
+    if "context_summaries" in result:
+        state["context_summaries"] = {**(state.get("context_summaries") or {}), **result["context_summaries"]}
+
 async def route_input(state: GraphState) -> GraphState:
     """战斗开始节点"""
     if IS_DEBUG:
@@ -32,10 +42,32 @@ async def route_input(state: GraphState) -> GraphState:
     if state["round_number"] == 0:
         state["combat_log"].append("战斗开始！空气中弥漫着不祥的气息...")
     
-    # 如果有玩家输入，进行意图分类
+    state["speculative_action"] = None
+    
+    # 如果有玩家输入，进行意图分类：先用本地分类器，置信度不足时再调用LLM
     if state["player_input"]:
-        triage_result = await player_input_triage_agent(state)
-        state["classified_intent"] = triage_result.get("classified_intent")
+        prediction = classify_intent(state["player_input"])
+        if IS_DEBUG:
+            print(f"本地意图分类: {prediction}")
+        if prediction.confidence >= INTENT_CONFIDENCE_THRESHOLD:
+            state["classified_intent"] = prediction.intent
+        elif (SPECULATIVE_ACTION and state["round_number"] > 0
+              and prediction.intent == ClassifiedIntent.DIRECT_ACTION
+              and prediction.confidence >= SPECULATION_MIN_CONFIDENCE):
+            # 看起来像直接行动：LLM分类的同时推测执行行动解析，分类确认后直接采用
+            speculative_state = cast(GraphState, {**state, "classified_intent": ClassifiedIntent.DIRECT_ACTION})
+            triage_result, action_result = await speculate(
+                player_input_triage_agent(state),
+                lambda: player_action_agent(speculative_state),
+                lambda result: result.get("classified_intent") == ClassifiedIntent.DIRECT_ACTION,
+            )
+            state["classified_intent"] = triage_result.get("classified_intent")
+            state["speculative_action"] = action_result
+            if IS_DEBUG:
+                print(f"推测执行{'命中' if action_result is not None else '未命中'}")
+        else:
+            triage_result = await player_input_triage_agent(state)
+            state["classified_intent"] = triage_result.get("classified_intent")
     
     return state
 
@@ -91,30 +123,36 @@ def determine_next_step(state: GraphState) -> GraphState:
     if IS_DEBUG:
         print("=== 确定下一步 ===")
     
-    # 检查战斗是否结束
-    investigators = [p for p in state["participants"] if p["type"] == "investigator"]
-    enemies = [p for p in state["participants"] if p["type"] == "enemy"]
+    # 检查战斗是否结束：每一方的存活人数随参与者变化增量维护（side_counts），不扫描参与者
+    counts = state.get("side_counts")
+    if not counts:
+        counts = state["side_counts"] = count_sides(state["participants"])
     
-    if all(p["stats"].get("HP", 0) <= 0 or p["status"] != ParticipantStatus.ACTIVE for p in investigators):
+    if side_defeated(counts, "investigator"):
         state["combat_log"].append("所有调查员都已倒下，战斗结束！")
         state["fight_ended"] = True
         return state
-    elif all(p["stats"].get("HP", 0) <= 0 or p["status"] != ParticipantStatus.ACTIVE for p in enemies):
+    elif side_defeated(counts, "enemy"):
         state["combat_log"].append("所有敌人都已倒下，调查员们获胜！")
         state["fight_ended"] = True
         return state
     
     current_actor_index = state["current_actor_index"]
+    current_actor = None
     if state["temp_player_actor"] is None:
-        current_actor_index = state["current_actor_index"] + 1
-        # 确定下一个行动者
-        if current_actor_index >= len(state["initiative_order"]):
-            state["combat_log"].append("本轮结束，准备开始下一轮")
-            state["round_ended"] = True
-            state["current_actor_index"] = -1  # 重置为-1，这样下一轮会从0开始
-            return state
-    
-    current_actor = next((p for p in state["participants"] if p["id"] == state["initiative_order"][current_actor_index]), None)
+        # 确定下一个行动者：本轮中已经倒下、逃跑的角色跳过
+        while True:
+            current_actor_index += 1
+            if current_actor_index >= len(state["initiative_order"]):
+                state["combat_log"].append("本轮结束，准备开始下一轮")
+                state["round_ended"] = True
+                state["current_actor_index"] = -1  # 重置为-1，这样下一轮会从0开始
+                return state
+            current_actor = find_participant(state["participants"], state["initiative_order"][current_actor_index])
+            if current_actor is None or not is_down(current_actor):
+                break
+    else:
+        current_actor = find_participant(state["participants"], state["initiative_order"][current_actor_index])
     
     if not current_actor:
         state["combat_log"].append("错误：找不到当前行动者")
@@ -137,6 +175,7 @@ async def prepare_for_next_input(state: GraphState) -> GraphState:
     keeper_narrator_result = await keeper_narrator_agent(state)
     if "llm_output" in keeper_narrator_result:
         state["llm_output"] = keeper_narrator_result["llm_output"]
+    _merge_context_summaries(state, keeper_narrator_result)
     return state
 
 async def combat_end(state: GraphState) -> GraphState:
@@ -144,6 +183,7 @@ async def combat_end(state: GraphState) -> GraphState:
     keeper_narrator_result = await keeper_narrator_agent(state)
     if "llm_output" in keeper_narrator_result:
         state["llm_output"] = keeper_narrator_result["llm_output"]
+    _merge_context_summaries(state, keeper_narrator_result)
     return state
 
 # ==================== 智能体节点 ====================
@@ -172,7 +212,9 @@ async def handle_query(state: GraphState) -> GraphState:
 
 async def direct_action(state: GraphState) -> GraphState:
     """处理直接行动"""
-    action_result = await player_action_agent(state)
+    # route_input 中推测执行的结果（基于同一状态），有则直接使用
+    action_result = state.get("speculative_action") or await player_action_agent(state)
+    state["speculative_action"] = None
     
     if "combat_log" in action_result:
         state["combat_log"].extend(action_result["combat_log"])
@@ -180,8 +222,15 @@ async def direct_action(state: GraphState) -> GraphState:
         state["is_valid_action"] = action_result["is_valid_action"]
     if "participants" in action_result:
         state["participants"] = action_result["participants"]
+    if "side_counts" in action_result:
+        state["side_counts"] = action_result["side_counts"]
+    if "requires_player_input" in action_result:
+        state["requires_player_input"] = action_result["requires_player_input"]
     if "temp_player_actor" in action_result:
         state["temp_player_actor"] = action_result["temp_player_actor"]
+    if "pending_attack" in action_result:
+        state["pending_attack"] = action_result["pending_attack"]
+    _merge_context_summaries(state, action_result)
     return state
 
 async def monster_ai(state: GraphState) -> GraphState:
@@ -192,10 +241,17 @@ async def monster_ai(state: GraphState) -> GraphState:
         state["combat_log"].extend(monster_result["combat_log"])
     if "participants" in monster_result:
         state["participants"] = monster_result["participants"]
+    if "side_counts" in monster_result:
+        state["side_counts"] = monster_result["side_counts"]
     if "requires_player_input" in monster_result:
         state["requires_player_input"] = monster_result["requires_player_input"]
     if "temp_player_actor" in monster_result:
         state["temp_player_actor"] = monster_result["temp_player_actor"]
+    if "pending_attack" in monster_result:
+        state["pending_attack"] = monster_result["pending_attack"]
+    if "monster_plans" in monster_result:
+        state["monster_plans"] = monster_result["monster_plans"]
+    _merge_context_summaries(state, monster_result)
     return state
 
 # ==================== 条件函数 ====================
@@ -240,16 +296,16 @@ def create_combat_workflow() -> StateGraph:
     """创建战斗工作流"""
     workflow = StateGraph(GraphState)
     
-    # 添加节点
-    workflow.add_node("route_input", route_input)
-    workflow.add_node("handle_ooc", handle_ooc)
-    workflow.add_node("handle_query", handle_query)
-    workflow.add_node("direct_action", direct_action)
-    workflow.add_node("initialize_combat", initialize_combat)
-    workflow.add_node("determine_next_step", determine_next_step)
-    workflow.add_node("prepare_for_next_input", prepare_for_next_input)
-    workflow.add_node("combat_end", combat_end)
-    workflow.add_node("monster_ai", monster_ai)
+    # 添加节点（开启 TELEMETRY_ENABLED 时每个节点记录 span）
+    workflow.add_node("route_input", traced_node("route_input", route_input))
+    workflow.add_node("handle_ooc", traced_node("handle_ooc", handle_ooc))
+    workflow.add_node("handle_query", traced_node("handle_query", handle_query))
+    workflow.add_node("direct_action", traced_node("direct_action", direct_action))
+    workflow.add_node("initialize_combat", traced_node("initialize_combat", initialize_combat))
+    workflow.add_node("determine_next_step", traced_node("determine_next_step", determine_next_step))
+    workflow.add_node("prepare_for_next_input", traced_node("prepare_for_next_input", prepare_for_next_input))
+    workflow.add_node("combat_end", traced_node("combat_end", combat_end))
+    workflow.add_node("monster_ai", traced_node("monster_ai", monster_ai))
     
     # 添加边
     workflow.add_edge(START, "route_input")
@@ -305,4 +361,4 @@ def create_combat_workflow() -> StateGraph:
 
 # ==================== 导出工作流 ====================
 
-combat_workflow = create_combat_workflow().compile(checkpointer=MemorySaver()) 
\ No newline at end of file
+combat_workflow = create_combat_workflow().compile(checkpointer=create_checkpointer()) 
\ No newline at end of file
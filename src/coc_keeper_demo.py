@@ -1,10 +1,13 @@
 # === src/coc_keeper_demo.py ===
 
 import asyncio
-from typing import cast
 try:
     from .types import GraphState, Participant, ParticipantStatus, Map
     from .coc_keeper import combat_workflow
+    from .combat_stream import DICE_ROLLED, LOG_APPENDED, NARRATOR_TOKEN, PARTICIPANT_CHANGED, CombatEvent
+    from .combat_session import AWAITING_INPUT, STEP_COMPLETED, CombatSession, current_actor_name, new_combat_state
+    from .telemetry import TELEMETRY_METRICS_PORT, start_metrics_server
+    from .replay_llm import seed_rules_rng
 except ImportError:
     # 如果相对导入失败，尝试绝对导入
     import sys
@@ -12,6 +15,10 @@ except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from src.types import GraphState, Participant, ParticipantStatus, Map
     from src.coc_keeper import combat_workflow
+    from src.combat_stream import DICE_ROLLED, LOG_APPENDED, NARRATOR_TOKEN, PARTICIPANT_CHANGED, CombatEvent
+    from src.combat_session import AWAITING_INPUT, STEP_COMPLETED, CombatSession, current_actor_name, new_combat_state
+    from src.telemetry import TELEMETRY_METRICS_PORT, start_metrics_server
+    from src.replay_llm import seed_rules_rng
 
 # ==================== 预设角色数据 ====================
 
@@ -87,6 +94,7 @@ def create_ghoul1() -> Participant:
         "id": "ghoul_1",
         "name": "食尸鬼A",
         "type": "enemy",
+        "monster_type": "ghoul",
         "stats": {
             "HP": 13,
             "max_HP": 13,
@@ -120,6 +128,7 @@ def create_ghoul2() -> Participant:
         "id": "ghoul_2",
         "name": "食尸鬼B",
         "type": "enemy",
+        "monster_type": "ghoul",
         "stats": {
             "HP": 11,
             "max_HP": 11,
@@ -147,42 +156,31 @@ def create_ghoul2() -> Participant:
         "items": []
     }
 
+def create_default_map() -> Map:
+    """创建演示地图"""
+    return {
+        "name": "禁忌图书馆",
+        "zones": {
+            "entrance": {
+                "description": "图书馆的入口，一扇巨大的橡木门敞开着。",
+                "adjacent_zones": ["main_hall"],
+                "properties": ["has_light"]
+            }
+        }
+    }
+
 # ==================== 命令行界面 ====================
 
 class CombatCLI:
     """战斗命令行界面"""
     
     def __init__(self):
-        default_map: Map = {
-            "name": "禁忌图书馆",
-            "zones": {
-                "entrance": {
-                    "description": "图书馆的入口，一扇巨大的橡木门敞开着。",
-                    "adjacent_zones": ["main_hall"],
-                    "properties": ["has_light"]
-                }
-            }
-        }
-        
-        self.state: GraphState = {
-            "participants": [create_investigator1(), create_ghoul1()],
-            "map": default_map,
-            "fight_ended": False,
-            "round_ended": False,
-            "round_number": 0,
-            "current_actor_index": 0,
-            "temp_player_actor": None,
-            "combat_log": [],
-            "previous_context": [],
-            "player_input": None,
-            "is_valid_action": False,
-            "classified_intent": None,
-            "requires_player_input": False,
-            "llm_output": "",
-            "initiative_order": []
-        }
+        self.state: GraphState = new_combat_state([create_investigator1(), create_ghoul1()], create_default_map())
         self.workflow = combat_workflow
-        self.messages = []
+        # 每次运行使用独立的 thread_id
+        self.session = CombatSession(self.state, workflow=self.workflow)
+        # 已经逐字输出过叙述的节点，它们写入日志的同一段话不再打印
+        self.streamed_nodes: set = set()
 
     async def start(self):
         """开始战斗演示"""
@@ -194,92 +192,71 @@ class CombatCLI:
 
     async def pause(self):
         """暂停等待用户输入"""
-        input("按回车键继续...")
+        await self.get_user_input("按回车键继续...")
 
     async def get_user_input(self, prompt: str) -> str:
-        """获取用户输入"""
-        return input(prompt).strip()
+        """获取用户输入（在线程中读取，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        return (await loop.run_in_executor(None, input, prompt)).strip()
 
     async def run_combat(self):
         """运行战斗"""
-        config = {
-            "configurable": {
-                "thread_id": "combat_demo"
-            }
-        }
-
-        current_state = self.state
-        step_count = 0
-        max_steps = 50  # 防止无限循环
-
-        while step_count < max_steps and not current_state["fight_ended"]:
-            step_count += 1
-            
-            # 处理玩家输入
-            player_input = await self.handle_player_input(current_state)
-            current_actor_index = current_state["current_actor_index"]
-            initiative_order = current_state["initiative_order"]
-            temp_player_actor = current_state["temp_player_actor"]
-            current_actor_name = initiative_order[current_actor_index] if current_actor_index < len(initiative_order) else 'unknown'
-            if temp_player_actor:
-                current_actor_name = temp_player_actor
-            player_message = f"{current_actor_name}: {player_input}"
-
-            self.messages.append({
-                "role": "user",
-                "content": player_message
-            })
-
-            # 更新状态
-            previous_messages = [msg["content"] for msg in self.messages[-4:]]
-            
-            current_state = cast(GraphState, {
-                "participants": current_state["participants"],
-                "map": current_state["map"],
-                "fight_ended": current_state["fight_ended"],
-                "round_ended": current_state["round_ended"],
-                "round_number": current_state["round_number"],
-                "current_actor_index": current_state["current_actor_index"],
-                "temp_player_actor": temp_player_actor,
-                "combat_log": [],
-                "previous_context": previous_messages,
-                "player_input": player_message if player_input else None,
-                "is_valid_action": False,
-                "classified_intent": None,
-                "requires_player_input": False,
-                "llm_output": "",
-                "initiative_order": current_state["initiative_order"],
-            })
+        player_input = ""
+        while True:
+            # 推进战斗直到需要玩家输入或战斗结束，边运行边显示事件和叙述
+            async for event in self.session.advance(player_input):
+                self.render_event(event)
+            print()
+            self.state = self.session.state
             
-            # 运行工作流
-            result = await self.workflow.ainvoke(current_state, config)
-            current_state = cast(GraphState, result)
-            
-            self.messages.append({
-                "role": "assistant",
-                "content": current_state["llm_output"]
-            })
-            
-            print(current_state["llm_output"])
-            
-            # 短暂暂停
-            await asyncio.sleep(1)
+            if self.state["fight_ended"] or not self.session.awaiting_input:
+                break
+            player_input = await self.handle_player_input(self.state)
         
-        if step_count >= max_steps:
+        if not self.state["fight_ended"]:
             print("\n⚠️ 达到最大步数限制，战斗强制结束")
 
+    def render_event(self, event: CombatEvent):
+        """实时显示工作流事件"""
+        if event.type == NARRATOR_TOKEN:
+            self.streamed_nodes.add(event.node)
+            print(event.data["text"], end="", flush=True)
+        elif event.type == DICE_ROLLED:
+            if event.data["source"] == "rules":
+                print(f"🎲 {event.data['attacker_id']} → {event.data['defender_id']}：{event.data['weapon']}"
+                      f" {event.data['attack']['roll']}/{event.data['attack']['skill']}")
+            else:
+                print(f"🎲 {event.data['result']}")
+        elif event.type == PARTICIPANT_CHANGED:
+            changes = "，".join(f"{key} {old} → {new}" for key, (old, new) in event.data["changes"].items())
+            print(f"📋 {event.data['name']}：{changes}")
+        elif event.type == LOG_APPENDED and event.data["line"].startswith("[守秘人]"):
+            if event.node in self.streamed_nodes:
+                # OOC、规则查询等回答已经逐字显示过，只换行
+                self.streamed_nodes.discard(event.node)
+                print()
+            else:
+                print(event.data["line"])
+        elif event.type == STEP_COMPLETED:
+            self.streamed_nodes.clear()
+        elif event.type == AWAITING_INPUT:
+            print(f"\n轮到 {event.data['actor']}")
+
     async def handle_player_input(self, state: GraphState) -> str:
         """处理玩家输入"""
-        if not state["requires_player_input"]:
-            return ""
-        
-        user_input = await self.get_user_input("你的输入: ")
-        return user_input
+        while True:
+            user_input = await self.get_user_input(f"{current_actor_name(state)} 的输入: ")
+            if user_input:
+                return user_input
 
 # ==================== 主函数 ====================
 
 async def main():
     """主函数"""
+    if TELEMETRY_METRICS_PORT:
+        start_metrics_server(TELEMETRY_METRICS_PORT)
+    # 录制 / 回放时固定掷骰结果
+    seed_rules_rng()
     cli = CombatCLI()
     await cli.start()
     
@@ -288,4 +265,4 @@ if __name__ == "__main__":
     asyncio.run(main())
 
 # 导出类和函数
-__all__ = ["CombatCLI", "main", "create_investigator1", "create_investigator2", "create_ghoul1", "create_ghoul2"] 
\ No newline at end of file
+__all__ = ["CombatCLI", "main", "create_default_map", "create_investigator1", "create_investigator2", "create_ghoul1", "create_ghoul2"] 
\ No newline at end of file
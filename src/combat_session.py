@@ -0,0 +1,213 @@
+# === src/combat_session.py ===
+
+"""
+战斗会话
+
+一场战斗 = 一个 thread_id + 当前状态 + 最近的对话。
+所有会话共用同一个编译好的 combat_workflow，各自的检查点按 thread_id 隔离。
+
+advance() 推进战斗直到需要玩家输入或战斗结束，边运行边产出事件；
+同一会话同一时间只有一次推进在运行（会话锁）。
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, cast
+
+from .combat_stream import COMPLETED, CombatEvent, stream_combat
+from .context_builder import carry_over_summaries
+from .participant_store import count_sides
+from .types import GraphState, Map, Participant
+
+# advance 额外产出的事件类型
+STEP_COMPLETED = "step_completed"
+AWAITING_INPUT = "awaiting_input"
+COMBAT_ENDED = "combat_ended"
+
+# 一次 advance 最多运行的工作流步数，防止无限循环
+MAX_STEPS_PER_ADVANCE = 50
+
+def new_combat_state(participants: List[Participant], combat_map: Optional[Map] = None) -> GraphState:
+    """尚未开始的战斗的初始状态"""
+    return {
+        "participants": participants,
+        "side_counts": count_sides(participants),
+        "map": combat_map,
+        "fight_ended": False,
+        "round_ended": False,
+        "round_number": 0,
+        "current_actor_index": 0,
+        "temp_player_actor": None,
+        "pending_attack": None,
+        "combat_log": [],
+        "previous_context": [],
+        "player_input": None,
+        "is_valid_action": False,
+        "classified_intent": None,
+        "requires_player_input": False,
+        "llm_output": "",
+        "initiative_order": [],
+    }
+
+def current_actor_name(state: GraphState) -> str:
+    """当前应该输入的角色名（临时行动者优先，如被攻击时选择闪避或反击的调查员）"""
+    if state.get("temp_player_actor"):
+        return cast(str, state["temp_player_actor"])
+    index = state["current_actor_index"]
+    order = state["initiative_order"]
+    return order[index] if index < len(order) else "unknown"
+
+def build_step_state(state: GraphState, player_message: Optional[str], previous_context: List[str]) -> GraphState:
+    """用上一步的结果和新的玩家输入构造下一步工作流的输入状态
+
+    combat_log 每一步从空列表开始，上一步的日志先并入各智能体的上下文摘要。
+    """
+    return cast(GraphState, {
+        "participants": state["participants"],
+        "side_counts": state.get("side_counts") or count_sides(state["participants"]),
+        "map": state["map"],
+        "fight_ended": state["fight_ended"],
+        "round_ended": state["round_ended"],
+        "round_number": state["round_number"],
+        "current_actor_index": state["current_actor_index"],
+        "temp_player_actor": state["temp_player_actor"],
+        "pending_attack": state.get("pending_attack"),
+        "combat_log": [],
+        "context_summaries": carry_over_summaries(state.get("context_summaries"), state.get("combat_log") or []),
+        "previous_context": previous_context,
+        "player_input": player_message,
+        "is_valid_action": False,
+        "classified_intent": None,
+        "requires_player_input": False,
+        "llm_output": "",
+        "initiative_order": state["initiative_order"],
+    })
+
+class CombatSession:
+    """一场战斗会话"""
+
+    def __init__(self, state: GraphState, session_id: Optional[str] = None, workflow: Any = None):
+        self.id = session_id or uuid.uuid4().hex
+        self.thread_id = f"combat-{self.id}"
+        self.state = state
+        self.workflow = workflow
+        self.messages: List[Dict[str, str]] = []
+        # 需要玩家输入：当前调查员行动，或者上一次输入不是有效行动（规则查询/OOC等），还在等待真正的行动
+        self.awaiting_input = False
+        self.lock = asyncio.Lock()
+        self.pending = 0  # 正在运行和排队等待的 advance 次数
+        self.created_at = time.time()
+        self.last_active = self.created_at
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": self.thread_id}}
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """会话的当前概况"""
+        return {
+            "session_id": self.id,
+            "round_number": self.state["round_number"],
+            "awaiting_input": self.awaiting_input,
+            "actor": current_actor_name(self.state) if self.awaiting_input else None,
+            "fight_ended": self.state["fight_ended"],
+            "participants": self.state["participants"],
+            "llm_output": self.state.get("llm_output", ""),
+            "busy": self.busy,
+        }
+
+    async def advance(self, player_input: str = "", step_slots: Optional[asyncio.Semaphore] = None) -> AsyncIterator[CombatEvent]:
+        """推进战斗直到需要玩家输入或战斗结束
+
+        Args:
+            player_input: 玩家输入；会话不在等待输入时忽略
+            step_slots: 限制全局同时运行的工作流步数
+
+        Yields:
+            CombatEvent: 工作流事件；每步结束产出 STEP_COMPLETED，最后是 AWAITING_INPUT 或 COMBAT_ENDED
+        """
+        self.pending += 1
+        try:
+            async with self.lock:
+                async for event in self._advance(player_input.strip(), step_slots):
+                    yield event
+        finally:
+            self.pending -= 1
+            self.last_active = time.time()
+
+    async def _advance(self, player_input: str, step_slots: Optional[asyncio.Semaphore]) -> AsyncIterator[CombatEvent]:
+        for _ in range(MAX_STEPS_PER_ADVANCE):
+            if self.state["fight_ended"]:
+                break
+            if self.awaiting_input and not player_input:
+                break
+
+            player_message = None
+            if self.awaiting_input:
+                player_message = f"{current_actor_name(self.state)}: {player_input}"
+                self.messages.append({"role": "user", "content": player_message})
+                player_input = ""
+            step_state = build_step_state(
+                self.state, player_message, [message["content"] for message in self.messages[-4:]]
+            )
+
+            async for event in self._run_step(step_state, step_slots):
+                if event.type == COMPLETED:
+                    self.state = cast(GraphState, event.data["state"])
+                else:
+                    yield event
+
+            self.messages.append({"role": "assistant", "content": self.state["llm_output"]})
+            # 规则查询、OOC和无效行动不消耗行动，同一个角色继续输入
+            answered_only = player_message is not None and not self.state.get("is_valid_action")
+            self.awaiting_input = self.state["requires_player_input"] or answered_only
+            yield CombatEvent(STEP_COMPLETED, {
+                "round_number": self.state["round_number"],
+                "llm_output": self.state["llm_output"],
+                "fight_ended": self.state["fight_ended"],
+            })
+
+        if self.state["fight_ended"]:
+            yield CombatEvent(COMBAT_ENDED, {"llm_output": self.state["llm_output"]})
+        else:
+            yield CombatEvent(AWAITING_INPUT, {"actor": current_actor_name(self.state)})
+
+    async def _run_step(self, step_state: GraphState, step_slots: Optional[asyncio.Semaphore]) -> AsyncIterator[CombatEvent]:
+        """运行一步工作流
+
+        工作流在单独的任务里运行，事件先放进本会话的队列；全局名额在这一步运行完就释放，
+        不会因为客户端读得慢而一直占用。
+        """
+        queue: "asyncio.Queue[Optional[CombatEvent]]" = asyncio.Queue()
+
+        async def run() -> None:
+            async for event in stream_combat(step_state, self.config, self.workflow):
+                queue.put_nowait(event)
+
+        async def produce() -> None:
+            try:
+                if step_slots is None:
+                    await run()
+                else:
+                    async with step_slots:
+                        await run()
+            finally:
+                queue.put_nowait(None)
+
+        task = asyncio.create_task(produce())
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+            await task  # 传出工作流的异常
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
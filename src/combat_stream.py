@@ -0,0 +1,165 @@
+# === src/combat_stream.py ===
+
+"""
+战斗事件流
+
+把 combat_workflow 的一次运行变成异步生成器，边运行边产出类型化的事件：
+进入节点、掷骰、参与者变化、新的战斗日志，以及守秘人叙述的逐字输出。
+界面可以立即显示进度，不必等整个工作流结束。
+
+用法:
+    async for event in stream_combat(state, config):
+        if event.type == NARRATOR_TOKEN:
+            print(event.data["text"], end="", flush=True)
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from langchain_core.callbacks.manager import adispatch_custom_event
+
+from .types import GraphState, Participant
+
+# 事件类型
+NODE_ENTERED = "node_entered"
+DICE_ROLLED = "dice_rolled"
+PARTICIPANT_CHANGED = "participant_changed"
+LOG_APPENDED = "log_appended"
+NARRATOR_TOKEN = "narrator_token"
+COMPLETED = "completed"
+
+# 这些节点中的 LLM 输出直接面向玩家，逐字转发
+NARRATION_NODES = frozenset({"prepare_for_next_input", "combat_end", "handle_ooc", "handle_query"})
+
+# 推测执行（见 speculation）在 route_input 中解析行动，结果由 direct_action 采用；
+# 推测任务的掷骰事件先暂存，采用时在 direct_action 中发出，未采用时丢弃
+SPECULATION_NODE = "route_input"
+SPECULATION_CONSUMER = "direct_action"
+
+@dataclass
+class CombatEvent:
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    node: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "node": self.node, "data": self.data}
+
+async def emit_event(name: str, data: Dict[str, Any]) -> None:
+    """在工作流节点内发出自定义事件（如规则引擎的掷骰结果）"""
+    try:
+        await adispatch_custom_event(name, data)
+    except RuntimeError:
+        # 不在工作流中运行（例如直接调用智能体），没有人订阅事件
+        pass
+
+def _chunk_text(chunk: Any) -> str:
+    """取出流式消息块中的文本（Claude 的内容可能是分块列表）"""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return ""
+
+def _diff_participant(before: Optional[Participant], after: Participant) -> Dict[str, Any]:
+    """参与者发生变化的字段：{字段: [之前, 之后]}"""
+    if before is None:
+        return {"added": [None, after["name"]]}
+    changes: Dict[str, Any] = {}
+    for key, value in after["stats"].items():
+        old = before["stats"].get(key)
+        if old != value:
+            changes[key] = [old, value]
+    for key in ("status", "effects", "items", "location"):
+        if before.get(key) != after.get(key):
+            changes[key] = [before.get(key), after.get(key)]
+    return changes
+
+class _StateTracker:
+    """对比每个节点结束时的状态，产出参与者变化和新日志"""
+
+    def __init__(self, state: GraphState):
+        self.participants = {p["id"]: p for p in state.get("participants") or []}
+        self.log_length = len(state.get("combat_log") or [])
+
+    def diff(self, output: Any, node: str) -> List[CombatEvent]:
+        if not isinstance(output, dict):
+            return []
+        events = []
+        for participant in output.get("participants") or []:
+            changes = _diff_participant(self.participants.get(participant["id"]), participant)
+            if changes:
+                events.append(CombatEvent(
+                    PARTICIPANT_CHANGED,
+                    {"id": participant["id"], "name": participant["name"], "changes": changes},
+                    node,
+                ))
+            self.participants[participant["id"]] = participant
+        log = output.get("combat_log")
+        if isinstance(log, list):
+            # 日志被重置过时从头开始
+            start = self.log_length if len(log) >= self.log_length else 0
+            events.extend(CombatEvent(LOG_APPENDED, {"line": line}, node) for line in log[start:])
+            self.log_length = len(log)
+        return events
+
+async def stream_combat(state: GraphState, config: Dict[str, Any], workflow: Any = None) -> AsyncIterator[CombatEvent]:
+    """运行一步战斗工作流，边运行边产出事件
+
+    Args:
+        state: 工作流输入状态
+        config: LangGraph 配置（包含 thread_id）
+        workflow: 编译后的工作流，默认使用 combat_workflow
+
+    Yields:
+        CombatEvent: 最后一个事件是 COMPLETED，data["state"] 为最终状态
+    """
+    if workflow is None:
+        from .coc_keeper import combat_workflow
+
+        workflow = combat_workflow
+
+    tracker = _StateTracker(state)
+    final_state: Optional[Dict[str, Any]] = None
+    speculative: List[CombatEvent] = []
+    async for event in workflow.astream_events(state, config, version="v2"):
+        kind = event["event"]
+        name = event.get("name")
+        node = event.get("metadata", {}).get("langgraph_node")
+
+        if kind == "on_chain_start" and name == node:
+            yield CombatEvent(NODE_ENTERED, {"node": node}, node)
+            if node == SPECULATION_CONSUMER:
+                for buffered in speculative:
+                    yield CombatEvent(buffered.type, buffered.data, node)
+                speculative = []
+        elif kind == "on_chain_end" and name == node:
+            output = event["data"].get("output")
+            if node == SPECULATION_NODE and not (isinstance(output, dict) and output.get("speculative_action")):
+                speculative = []
+            for change in tracker.diff(output, node):
+                yield change
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            final_state = event["data"].get("output")
+        elif kind == "on_chat_model_stream" and node in NARRATION_NODES:
+            text = _chunk_text(event["data"].get("chunk"))
+            if text:
+                yield CombatEvent(NARRATOR_TOKEN, {"text": text}, node)
+        elif kind == "on_tool_end" and name == "roll_dice_tool":
+            output = event["data"].get("output")
+            dice = CombatEvent(DICE_ROLLED, {"source": "tool", "result": getattr(output, "content", output)}, node)
+            if node == SPECULATION_NODE:
+                speculative.append(dice)
+            else:
+                yield dice
+        elif kind == "on_custom_event" and name == DICE_ROLLED:
+            dice = CombatEvent(DICE_ROLLED, {"source": "rules", **event["data"]}, node)
+            if node == SPECULATION_NODE:
+                speculative.append(dice)
+            else:
+                yield dice
+
+    if final_state is None:
+        final_state = dict(workflow.get_state(config).values)
+    yield CombatEvent(COMPLETED, {"state": final_state})
@@ -0,0 +1,204 @@
+# === src/context_builder.py ===
+
+"""
+提示词上下文构建
+
+按智能体的 token 预算组装战斗日志、参与者、地图等上下文：
+- 地图只保留与行动者和在场参与者有关的区域（见 map_index.relevant_map）
+- 最近的事件原样保留
+- 放不下的旧事件压缩成摘要条目，追加到滚动摘要里（增量更新，不重新生成）
+- 摘要本身也有上限，超出时丢弃最早的条目
+
+摘要进度保存在 GraphState.context_summaries 中，每个智能体一份，
+因此战斗越长，提示词大小也基本保持不变。
+每次调用工作流时 combat_log 从空列表开始，进度里的 folded 只对上一次调用的日志有效：
+构造下一次的输入时用 carry_over_summaries 把上一次还没折叠的日志并入摘要，folded 归零。
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from .map_index import relevant_map
+from .types import GraphState, ParticipantStatus
+
+# 加载环境变量
+load_dotenv()
+
+# 每个智能体提示词中可变上下文（日志、参与者、地图、之前的上下文）的 token 预算
+DEFAULT_TOKEN_BUDGETS: Dict[str, int] = {
+    "monster_ai": 1500,
+    "player_action": 1500,
+    "keeper_narrator": 1200,
+}
+
+def _parse_budgets(value: Optional[str]) -> Dict[str, int]:
+    """解析 "monster_ai=1500,keeper_narrator=800" 形式的配置"""
+    budgets = dict(DEFAULT_TOKEN_BUDGETS)
+    for item in (value or "").split(","):
+        if "=" in item:
+            agent, budget = item.split("=", 1)
+            budgets[agent.strip()] = int(budget)
+    return budgets
+
+CONTEXT_TOKEN_BUDGETS = _parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS"))
+
+# 日志预算中留给滚动摘要的比例，其余给最近的原始事件
+_SUMMARY_SHARE = 0.3
+# 无论预算多紧，都原样保留的最近事件数
+_MIN_RECENT_EVENTS = 3
+# 单条摘要的最大字符数
+_SUMMARY_ENTRY_CHARS = 60
+# 日志可用的最小预算，防止固定部分过大时日志被挤没
+_MIN_LOG_BUDGET = 200
+
+# ==================== token 估算 ====================
+
+_CJK = re.compile(r"[　-〿㐀-鿿＀-￯]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个，其余按 4 个字符 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def compact_json(data: Any) -> str:
+    """紧凑的 JSON：不转义中文，不加空格"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+# ==================== 事件摘要 ====================
+
+# 只推进流程、不需要进入摘要的日志
+_NOISE = re.compile(r"^(轮到 .+ 行动|本轮结束，准备开始下一轮|参与者们根据先攻重新确定行动顺序.*)$")
+_SPEAKER = re.compile(r"^\[[^\]]+\]:\s*")
+# 骰子表达式，摘要里只保留掷出的结果
+_DICE_DETAIL = re.compile(r"\d*d\d+[^，。=（(]*=\s*", re.IGNORECASE)
+
+def summarize_event(line: str) -> Optional[str]:
+    """把一条日志压缩成摘要条目；无关紧要的日志返回 None"""
+    text = _SPEAKER.sub("", line.strip())
+    if not text or _NOISE.match(text):
+        return None
+    text = _DICE_DETAIL.sub("", text)
+    text = re.sub(r"\s+", " ", text).strip(" ：:")
+    if len(text) > _SUMMARY_ENTRY_CHARS:
+        text = text[:_SUMMARY_ENTRY_CHARS] + "…"
+    return text
+
+def carry_over_summaries(
+    summaries: Optional[Dict[str, Dict[str, Any]]], log: List[str],
+) -> Dict[str, Dict[str, Any]]:
+    """日志清空前，把每个智能体尚未折叠的日志并入摘要，folded 归零
+
+    还没有进度的智能体也会得到一份，以免这次调用的事件在它第一次构建上下文时已经不在日志里。
+    摘要超出预算的部分在下一次 build_combat_context 时丢弃。
+    """
+    summaries = summaries or {}
+    carried: Dict[str, Dict[str, Any]] = {}
+    for agent in set(CONTEXT_TOKEN_BUDGETS) | set(summaries):
+        progress = summaries.get(agent) or {}
+        summary = list(progress.get("summary", []))
+        for line in log[min(progress.get("folded", 0), len(log)):]:
+            entry = summarize_event(line)
+            if entry:
+                summary.append(entry)
+        carried[agent] = {"summary": summary, "folded": 0, "omitted": progress.get("omitted", 0)}
+    return carried
+
+# ==================== 上下文组装 ====================
+
+class CombatContext(NamedTuple):
+    previous_context: str
+    log_text: str  # 摘要 + 最近事件
+    participants: str
+    map: str
+    summary_update: Dict[str, Dict[str, Any]]  # 写回 GraphState.context_summaries
+
+def compact_participants(participants: List[Dict[str, Any]]) -> str:
+    """已退场的角色只保留身份和状态"""
+    compacted = [
+        p if p.get("status") == ParticipantStatus.ACTIVE
+        else {"id": p["id"], "name": p["name"], "type": p["type"], "status": p["status"]}
+        for p in participants
+    ]
+    return compact_json(compacted)
+
+def _fit_tail(lines: List[str], budget: int, keep_at_least: int) -> int:
+    """从末尾开始能放进预算的行数"""
+    used, count = 0, 0
+    for line in reversed(lines):
+        cost = estimate_tokens(line) + 1
+        if count >= keep_at_least and used + cost > budget:
+            break
+        used += cost
+        count += 1
+    return count
+
+def build_combat_context(
+    state: GraphState, agent: str, budget: Optional[int] = None, actor_id: Optional[str] = None,
+) -> CombatContext:
+    """按智能体的 token 预算构建上下文
+
+    Args:
+        state: 当前状态
+        agent: 智能体名，决定预算和摘要进度
+        budget: 覆盖默认预算
+        actor_id: 当前行动者，地图保留它周围的区域和到其他参与者的步数
+
+    Returns:
+        CombatContext: 各部分的文本，以及需要写回状态的摘要进度
+    """
+    budget = budget or CONTEXT_TOKEN_BUDGETS.get(agent, 1500)
+    participants = compact_participants(state.get("participants") or [])
+    combat_map = relevant_map(state.get("map"), state.get("participants") or [], actor_id)
+    map_text = compact_json(combat_map) if combat_map else "无地图信息"
+
+    # 之前的上下文是固定剧情，最多占预算的四分之一，超出时保留最新的部分
+    previous = state.get("previous_context") or []
+    keep = _fit_tail(previous, budget // 4, 0)
+    previous_text = "\n".join(previous[len(previous) - keep:])
+
+    fixed = estimate_tokens(participants) + estimate_tokens(map_text) + estimate_tokens(previous_text)
+    log_budget = max(budget - fixed, _MIN_LOG_BUDGET)
+    summary_budget = int(log_budget * _SUMMARY_SHARE)
+
+    # 从上次的摘要进度继续：只有新增的日志需要考虑
+    progress = (state.get("context_summaries") or {}).get(agent) or {}
+    summary: List[str] = list(progress.get("summary", []))
+    folded = progress.get("folded", 0)
+    omitted = progress.get("omitted", 0)
+    log = state.get("combat_log") or []
+    folded = min(folded, len(log))
+
+    pending = log[folded:]
+    recent_count = _fit_tail(pending, log_budget - summary_budget, _MIN_RECENT_EVENTS)
+    for line in pending[:len(pending) - recent_count]:
+        entry = summarize_event(line)
+        if entry:
+            summary.append(entry)
+    folded = len(log) - recent_count
+
+    # 摘要超出预算时丢弃最早的条目
+    drop = len(summary) - _fit_tail(summary, summary_budget, 0)
+    if drop > 0:
+        summary = summary[drop:]
+        omitted += drop
+
+    parts = []
+    if omitted:
+        parts.append(f"（更早的 {omitted} 条事件已省略）")
+    if summary:
+        parts.append("之前发生的事（摘要）：\n" + "\n".join(f"- {entry}" for entry in summary))
+    recent = log[folded:]
+    if recent:
+        parts.append("最近发生的事：\n" + "\n".join(recent))
+
+    return CombatContext(
+        previous_context=previous_text,
+        log_text="\n".join(parts),
+        participants=participants,
+        map=map_text,
+        summary_update={agent: {"summary": summary, "folded": folded, "omitted": omitted}},
+    )
@@ -0,0 +1,217 @@
+# === src/intent_classifier.py ===
+
+"""
+本地意图分类器
+
+在 player_input_triage_agent 之前运行的第一层分类：
+先用关键词/正则规则识别明显的输入，再用一个基于字符 n-gram 的
+朴素贝叶斯分类器打分。只有置信度低于阈值时才调用 LLM 分类。
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .types import ClassifiedIntent
+
+# 加载环境变量
+load_dotenv()
+
+# 低于该置信度时交给 LLM 分类
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.8"))
+
+# 额外的标注数据（JSONL，每行 {"text": ..., "intent": ...}），可选
+INTENT_TRAINING_DATA = os.getenv("INTENT_TRAINING_DATA")
+
+class IntentPrediction(NamedTuple):
+    intent: ClassifiedIntent
+    confidence: float
+    source: str  # "rule" 或 "model"
+
+# ==================== 规则层 ====================
+
+# 按顺序匹配：先识别提问和场外发言，再识别行动，避免"我能闪避吗？"被当成行动
+# "等一下"只有单独成句时才算场外发言，"我等一下再攻击"不算
+# 行动动词必须出现在句首（可带"我/我要"和"用手枪/朝怪物"这类短语），"它会攻击我"不算行动
+_RULES: List[Tuple[ClassifiedIntent, "re.Pattern[str]"]] = [
+    (ClassifiedIntent.OOC, re.compile(
+        r"^\s*[(（]|ooc|场外|暂停一下|^等一下[!！。.…~～]*$|去趟厕所|先吃饭|哈哈哈|brb", re.IGNORECASE
+    )),
+    (ClassifiedIntent.QUERY, re.compile(
+        r"规则|怎么算|怎么判定|多少|还剩|能不能|可不可以|可以.{0,8}吗|是否|什么是|为什么|如何|有哪些"
+        r"|[?？]\s*$|[吗呢][。.!！~～]*\s*$"
+    )),
+    (ClassifiedIntent.DIRECT_ACTION, re.compile(
+        r"^(我|我要|我想|我决定)?\s*(闪避|躲开|躲避|反击|对抗|格挡)"
+        r"|^(我|我要|我想|我决定)?\s*((用|拿|朝|对|向|给)[^，。,.!！\s]{0,10}?)?"
+        r"(攻击|射击|开枪|开火|砍|刺|劈|捅|挥拳|踢|扑向|冲向|瞄准|扣动扳机|投掷|急救|包扎|逃跑|撤退|后退|移动到|跑向)"
+    )),
+]
+
+_RULE_CONFIDENCE = 0.95
+
+# 去掉 CLI 加在输入前面的 "名字: " 前缀；"OOC:"、"场外："是场外标记，不是说话人，保留
+_SPEAKER_PREFIX = re.compile(r"^(?!\s*(?:ooc|场外)\s*[:：])[^:：\n]{1,30}[:：]\s*", re.IGNORECASE)
+
+def normalize_input(text: str) -> str:
+    """去掉说话人前缀和多余空白"""
+    return _SPEAKER_PREFIX.sub("", text.strip(), count=1).strip()
+
+def _match_rules(text: str) -> Optional[ClassifiedIntent]:
+    for intent, pattern in _RULES:
+        if pattern.search(text):
+            return intent
+    return None
+
+# ==================== 统计层 ====================
+
+# 内置的标注样本
+_SEED_EXAMPLES: List[Tuple[str, ClassifiedIntent]] = [
+    ("我用手枪射击食尸鬼", ClassifiedIntent.DIRECT_ACTION),
+    ("我闪避", ClassifiedIntent.DIRECT_ACTION),
+    ("闪避", ClassifiedIntent.DIRECT_ACTION),
+    ("对抗", ClassifiedIntent.DIRECT_ACTION),
+    ("我选择反击", ClassifiedIntent.DIRECT_ACTION),
+    ("用猎刀砍它", ClassifiedIntent.DIRECT_ACTION),
+    ("我冲过去给它一拳", ClassifiedIntent.DIRECT_ACTION),
+    ("朝怪物开两枪", ClassifiedIntent.DIRECT_ACTION),
+    ("我拿手电筒砸它的头", ClassifiedIntent.DIRECT_ACTION),
+    ("我给杰克包扎伤口", ClassifiedIntent.DIRECT_ACTION),
+    ("我转身逃向门口", ClassifiedIntent.DIRECT_ACTION),
+    ("我躲到书架后面", ClassifiedIntent.DIRECT_ACTION),
+    ("用绳索绊倒食尸鬼", ClassifiedIntent.DIRECT_ACTION),
+    ("我点燃打火机扔向它", ClassifiedIntent.DIRECT_ACTION),
+    ("我攻击离我最近的食尸鬼", ClassifiedIntent.DIRECT_ACTION),
+    ("我的HP还剩多少", ClassifiedIntent.QUERY),
+    ("闪避的规则是什么", ClassifiedIntent.QUERY),
+    ("手枪的伤害是多少", ClassifiedIntent.QUERY),
+    ("我能不能同时攻击两个敌人", ClassifiedIntent.QUERY),
+    ("反击和闪避有什么区别", ClassifiedIntent.QUERY),
+    ("食尸鬼现在什么状态", ClassifiedIntent.QUERY),
+    ("困难成功怎么判定", ClassifiedIntent.QUERY),
+    ("现在是第几轮", ClassifiedIntent.QUERY),
+    ("我还有几发子弹", ClassifiedIntent.QUERY),
+    ("重伤会有什么影响", ClassifiedIntent.QUERY),
+    ("（今天先玩到这里吧）", ClassifiedIntent.OOC),
+    ("哈哈哈这个骰运太差了", ClassifiedIntent.OOC),
+    ("等我一下去拿个外卖", ClassifiedIntent.OOC),
+    ("ooc 这个守秘人好凶", ClassifiedIntent.OOC),
+    ("我们下次什么时候开团", ClassifiedIntent.OOC),
+    ("场外：我网有点卡", ClassifiedIntent.OOC),
+    ("kp你好可爱", ClassifiedIntent.OOC),
+    ("这团好刺激啊", ClassifiedIntent.OOC),
+    ("嗯……", ClassifiedIntent.FUZZY_INTENT),
+    ("我不知道该怎么办", ClassifiedIntent.FUZZY_INTENT),
+    ("看看情况再说", ClassifiedIntent.FUZZY_INTENT),
+    ("做点什么吧", ClassifiedIntent.FUZZY_INTENT),
+    ("我想想", ClassifiedIntent.FUZZY_INTENT),
+    ("随便", ClassifiedIntent.FUZZY_INTENT),
+    ("我准备一下", ClassifiedIntent.FUZZY_INTENT),
+]
+
+def _features(text: str) -> List[str]:
+    """字符一元和二元特征"""
+    chars = [c for c in text.lower() if not c.isspace()]
+    return chars + [a + b for a, b in zip(chars, chars[1:])]
+
+class NaiveBayesIntentModel:
+    """字符 n-gram 多项式朴素贝叶斯，只依赖标准库"""
+
+    def __init__(self, alpha: float = 0.5):
+        self.alpha = alpha
+        self.class_log_prior: Dict[ClassifiedIntent, float] = {}
+        self.feature_log_prob: Dict[ClassifiedIntent, Dict[str, float]] = {}
+        self.unknown_log_prob: Dict[ClassifiedIntent, float] = {}
+
+    def fit(self, examples: Iterable[Tuple[str, ClassifiedIntent]]) -> "NaiveBayesIntentModel":
+        class_counts: Counter = Counter()
+        feature_counts: Dict[ClassifiedIntent, Counter] = defaultdict(Counter)
+        vocabulary = set()
+        for text, intent in examples:
+            features = _features(text)
+            class_counts[intent] += 1
+            feature_counts[intent].update(features)
+            vocabulary.update(features)
+
+        total = sum(class_counts.values())
+        vocab_size = len(vocabulary)
+        for intent, count in class_counts.items():
+            self.class_log_prior[intent] = math.log(count / total)
+            denominator = sum(feature_counts[intent].values()) + self.alpha * vocab_size
+            self.feature_log_prob[intent] = {
+                feature: math.log((n + self.alpha) / denominator)
+                for feature, n in feature_counts[intent].items()
+            }
+            self.unknown_log_prob[intent] = math.log(self.alpha / denominator)
+        return self
+
+    def predict(self, text: str) -> Tuple[ClassifiedIntent, float]:
+        """返回最可能的意图和置信度"""
+        features = _features(text)
+        scores = {}
+        for intent, prior in self.class_log_prior.items():
+            log_probs = self.feature_log_prob[intent]
+            unknown = self.unknown_log_prob[intent]
+            scores[intent] = prior + sum(log_probs.get(f, unknown) for f in features)
+
+        best = max(scores, key=scores.get)
+        # 朴素贝叶斯的后验概率过于自信，按特征数归一化后再做 softmax
+        scale = max(len(features), 1) ** 0.5
+        scores = {intent: score / scale for intent, score in scores.items()}
+        best_score = scores[best]
+        normalizer = sum(math.exp(score - best_score) for score in scores.values())
+        return best, 1.0 / normalizer
+
+def _load_training_data(path: str) -> List[Tuple[str, ClassifiedIntent]]:
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append((record["text"], ClassifiedIntent(record["intent"])))
+    return examples
+
+_model: Optional[NaiveBayesIntentModel] = None
+
+def get_intent_model() -> NaiveBayesIntentModel:
+    """第一次使用时训练模型"""
+    global _model
+    if _model is None:
+        examples = list(_SEED_EXAMPLES)
+        if INTENT_TRAINING_DATA:
+            examples.extend(_load_training_data(INTENT_TRAINING_DATA))
+        _model = NaiveBayesIntentModel().fit(examples)
+    return _model
+
+# ==================== 对外接口 ====================
+
+def classify_intent(player_input: str) -> IntentPrediction:
+    """本地意图分类
+
+    Args:
+        player_input: 玩家输入，可以带 "名字: " 前缀
+
+    Returns:
+        IntentPrediction: 意图、置信度以及来源（规则或模型）
+    """
+    text = normalize_input(player_input)
+    if not text:
+        return IntentPrediction(ClassifiedIntent.FUZZY_INTENT, 0.0, "rule")
+
+    rule_intent = _match_rules(text)
+    if rule_intent is not None:
+        return IntentPrediction(rule_intent, _RULE_CONFIDENCE, "rule")
+
+    intent, confidence = get_intent_model().predict(text)
+    return IntentPrediction(intent, confidence, "model")
+
+# 示例用法
+if __name__ == "__main__":
+    for text in ["艾米莉亚·克拉克: 我用手枪射击食尸鬼", "我闪避", "我的HP还剩多少？", "（去倒杯水）", "嗯……让我想想", "拿手电筒晃它的眼睛",
+                 "它会攻击我吗", "我要逃跑吗", "我等一下再攻击", "OOC: 我去倒水", "艾米莉亚·克拉克: OOC: 我去倒水"]:
+        print(text, classify_intent(text))
@@ -0,0 +1,259 @@
+# === src/llm_cache.py ===
+
+"""
+LLM 响应缓存
+
+实现 langchain 的 BaseCache 接口，由 get_llm(agent) 挂到模型实例上。
+缓存键是模型参数(llm_string) + 归一化后的提示词，条目保存在本地 SQLite 文件里，
+按 TTL 和总大小淘汰（最久未使用的先删）。
+
+- 每个智能体单独开启（LLM_CACHE_AGENTS），并有自己的命中/未命中计数
+- 规则查询和 OOC 可以开启近似匹配：只比较玩家的问题（提示词里 `玩家的输入: "…"` 的部分），
+  提示词的其余部分（日志、游戏状态、规则片段）必须完全相同，问题的字符二元组 Jaccard 相似度超过阈值即视为命中
+- 战斗结算智能体（玩家行动、怪物AI）永远不缓存
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, FrozenSet, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+
+from .telemetry import record_cache_hit
+
+# 加载环境变量
+load_dotenv()
+
+def _env_set(name: str, default: str) -> FrozenSet[str]:
+    return frozenset(a.strip() for a in os.getenv(name, default).split(",") if a.strip())
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # 秒
+LLM_CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024)
+# 开启缓存的智能体
+LLM_CACHE_AGENTS = _env_set("LLM_CACHE_AGENTS", "rules_keeper,ooc")
+# 开启近似匹配的智能体
+LLM_CACHE_APPROXIMATE_AGENTS = _env_set("LLM_CACHE_APPROXIMATE_AGENTS", "")
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.9"))
+
+# 结算战斗的智能体，输出依赖掷骰和当前状态，不能复用
+UNCACHEABLE_AGENTS = frozenset({"player_action", "monster_ai"})
+
+# 近似匹配时最多比较的候选条目数
+_APPROXIMATE_CANDIDATES = 200
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_prompt(prompt: str) -> str:
+    """合并空白，去掉模板缩进带来的差异"""
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+# 规则查询和 OOC 提示词中玩家的问题
+_PLAYER_INPUT = re.compile(r'玩家的输入: "(.*)"，')
+
+def split_prompt(prompt: str) -> Tuple[Optional[str], Optional[str]]:
+    """把提示词分成上下文键和玩家的问题
+
+    prompt 是 langchain 序列化的消息列表。上下文键是去掉问题后全部消息内容的哈希，
+    近似匹配只在上下文键相同的条目之间进行。找不到问题时返回 (None, None)，只做精确匹配。
+    """
+    try:
+        messages = json.loads(prompt)
+        contents = [str(message["kwargs"]["content"]) for message in messages]
+    except (ValueError, TypeError, KeyError):
+        return None, None
+    question = None
+    for i, content in enumerate(contents):
+        match = _PLAYER_INPUT.search(content)
+        if match:
+            question = normalize_prompt(match.group(1))
+            contents[i] = content[:match.start(1)] + content[match.end(1):]
+            break
+    if question is None:
+        return None, None
+    context = normalize_prompt("\x00".join(contents))
+    return hashlib.sha256(context.encode("utf-8")).hexdigest(), question
+
+def _bigrams(text: str) -> FrozenSet[str]:
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1)) or frozenset([text])
+
+def _similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# ==================== 磁盘存储 ====================
+
+class ResponseCacheStore:
+    """SQLite 存储，所有智能体共用一个文件"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                agent TEXT NOT NULL,
+                llm_string TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                context_key TEXT,
+                question TEXT
+            )"""
+        )
+        # 旧版本创建的文件没有近似匹配用的列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_cache)")}
+        for column in ("context_key", "question"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE llm_cache ADD COLUMN {column} TEXT")
+        self._conn.execute("DROP INDEX IF EXISTS llm_cache_agent")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_context ON llm_cache (agent, llm_string, context_key, accessed_at)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at >= ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def find_similar(self, agent: str, llm_string: str, context_key: str, question: str, threshold: float) -> Optional[str]:
+        """在同一智能体、同一模型参数、同一上下文的最近条目里找问题最相似的一条"""
+        target = _bigrams(question)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, question FROM llm_cache WHERE agent = ? AND llm_string = ? AND context_key = ? "
+                "AND created_at >= ? ORDER BY accessed_at DESC LIMIT ?",
+                (agent, llm_string, context_key, time.time() - self.ttl, _APPROXIMATE_CANDIDATES),
+            ).fetchall()
+        best_key, best_score = None, threshold
+        for key, candidate in rows:
+            score = _similarity(target, _bigrams(candidate))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return self.get(best_key) if best_key else None
+
+    def put(self, key: str, agent: str, llm_string: str, prompt: str, value: str,
+            context_key: Optional[str] = None, question: Optional[str] = None) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8")) + len(prompt.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache "
+                "(key, agent, llm_string, prompt, value, size, created_at, accessed_at, context_key, question) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, agent, llm_string, prompt, value, size, now, now, context_key, question),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """删除过期条目，超出容量时按最近使用时间淘汰"""
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC").fetchall():
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self, agent: Optional[str] = None) -> None:
+        with self._lock:
+            if agent is None:
+                self._conn.execute("DELETE FROM llm_cache")
+            else:
+                self._conn.execute("DELETE FROM llm_cache WHERE agent = ?", (agent,))
+            self._conn.commit()
+
+# ==================== langchain 缓存 ====================
+
+class LLMResponseCache(BaseCache):
+    """单个智能体的缓存视图，带命中计数"""
+
+    def __init__(self, store: ResponseCacheStore, agent: str, approximate: bool = False,
+                 similarity: float = LLM_CACHE_SIMILARITY):
+        self.store = store
+        self.agent = agent
+        self.approximate = approximate
+        self.similarity = similarity
+        self.stats: Dict[str, int] = {"hits": 0, "approximate_hits": 0, "misses": 0}
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        normalized = normalize_prompt(prompt)
+        value = self.store.get(self.store.make_key(normalized, llm_string))
+        if value is not None:
+            self.stats["hits"] += 1
+            record_cache_hit()
+            return loads(value)
+        if self.approximate:
+            context_key, question = split_prompt(prompt)
+            if context_key is not None:
+                value = self.store.find_similar(self.agent, llm_string, context_key, question, self.similarity)  # type: ignore[arg-type]
+                if value is not None:
+                    self.stats["approximate_hits"] += 1
+                    record_cache_hit()
+                    return loads(value)
+        self.stats["misses"] += 1
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        normalized = normalize_prompt(prompt)
+        context_key, question = split_prompt(prompt)
+        self.store.put(
+            self.store.make_key(normalized, llm_string), self.agent, llm_string, normalized, dumps(list(return_val)),
+            context_key, question,
+        )
+
+    def clear(self, **kwargs: Any) -> None:
+        self.store.clear(self.agent)
+
+# ==================== 对外接口 ====================
+
+_store: Optional[ResponseCacheStore] = None
+_caches: Dict[str, LLMResponseCache] = {}
+
+def get_response_cache(agent: Optional[str]) -> Optional[LLMResponseCache]:
+    """返回智能体的缓存；未开启或不允许缓存时返回 None"""
+    global _store
+    if not LLM_CACHE_ENABLED or not agent or agent in UNCACHEABLE_AGENTS or agent not in LLM_CACHE_AGENTS:
+        return None
+    if agent not in _caches:
+        if _store is None:
+            _store = ResponseCacheStore()
+        _caches[agent] = LLMResponseCache(_store, agent, approximate=agent in LLM_CACHE_APPROXIMATE_AGENTS)
+    return _caches[agent]
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """每个智能体的命中/未命中计数"""
+    return {agent: dict(cache.stats) for agent, cache in _caches.items()}
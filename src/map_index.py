@@ -0,0 +1,207 @@
+# === src/map_index.py ===
+
+"""
+地图图索引
+
+每张地图只建一次索引（按区域和连通关系缓存，检查点恢复出的新字典也能命中）：
+- 区域名映射成整数 id，邻接表是 id 元组（adjacent_zones 里引用但没有定义的区域也算节点）
+- 从每个区域做一次 BFS，得到全源最短步数表
+- 可达区域、范围内区域、最短路径的查询结果按参数缓存
+
+智能体通过 map_query_tool（见 tools.map_tools）查询距离和范围，不需要自己推理 adjacent_zones；
+提示词里的地图也只保留与当前行动者和目标有关的区域（relevant_map），
+不再把整张地图塞进每个提示词。
+"""
+
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from .types import Map, Participant, ParticipantStatus
+
+# 加载环境变量
+load_dotenv()
+
+# 提示词里保留行动者周围几步以内的区域
+MAP_CONTEXT_RADIUS = int(os.getenv("MAP_CONTEXT_RADIUS", "1"))
+# 缓存的地图索引数
+MAP_INDEX_CACHE_SIZE = int(os.getenv("MAP_INDEX_CACHE_SIZE", "32"))
+
+# 步数表里不可达的标记
+UNREACHABLE = -1
+
+MapKey = Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+class MapIndex:
+    """地图的连通关系和全源最短步数"""
+
+    def __init__(self, zones: MapKey):
+        names: List[str] = [zone for zone, _ in zones]
+        ids: Dict[str, int] = {zone: i for i, zone in enumerate(names)}
+        for _, adjacent in zones:
+            for neighbor in adjacent:
+                if neighbor not in ids:
+                    ids[neighbor] = len(names)
+                    names.append(neighbor)
+        edges: List[Tuple[int, ...]] = [() for _ in names]
+        for zone, adjacent in zones:
+            edges[ids[zone]] = tuple(dict.fromkeys(ids[neighbor] for neighbor in adjacent))
+
+        self.names: Tuple[str, ...] = tuple(names)
+        self.ids = ids
+        self.adjacency: Tuple[Tuple[int, ...], ...] = tuple(edges)
+        self.distances: Tuple[Tuple[int, ...], ...] = tuple(self._bfs(start) for start in range(len(names)))
+        self._within: Dict[Tuple[int, int], Tuple[str, ...]] = {}
+        self._paths: Dict[Tuple[int, int], Optional[Tuple[str, ...]]] = {}
+
+    def _bfs(self, start: int) -> Tuple[int, ...]:
+        distances = [UNREACHABLE] * len(self.names)
+        distances[start] = 0
+        queue = deque([start])
+        while queue:
+            zone = queue.popleft()
+            step = distances[zone] + 1
+            for neighbor in self.adjacency[zone]:
+                if distances[neighbor] == UNREACHABLE:
+                    distances[neighbor] = step
+                    queue.append(neighbor)
+        return tuple(distances)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def distance(self, start: Optional[str], goal: Optional[str]) -> Optional[int]:
+        """两个区域之间的步数；未知区域或不可达时返回 None"""
+        if start is None or goal is None:
+            return None
+        if start == goal:
+            return 0
+        a, b = self.ids.get(start), self.ids.get(goal)
+        if a is None or b is None:
+            return None
+        steps = self.distances[a][b]
+        return None if steps == UNREACHABLE else steps
+
+    def neighbors(self, zone: str) -> Tuple[str, ...]:
+        zone_id = self.ids.get(zone)
+        return () if zone_id is None else tuple(self.names[i] for i in self.adjacency[zone_id])
+
+    def within(self, zone: str, steps: int) -> Tuple[str, ...]:
+        """steps 步以内能到达的区域（含自身），按步数排序"""
+        zone_id = self.ids.get(zone)
+        if zone_id is None:
+            return ()
+        key = (zone_id, steps)
+        cached = self._within.get(key)
+        if cached is None:
+            row = self.distances[zone_id]
+            cached = tuple(self.names[i] for i in sorted(
+                (i for i, d in enumerate(row) if d != UNREACHABLE and d <= steps), key=row.__getitem__,
+            ))
+            self._within[key] = cached
+        return cached
+
+    def reachable(self, zone: str) -> Tuple[str, ...]:
+        """能到达的全部区域"""
+        return self.within(zone, len(self.names))
+
+    def path(self, start: str, goal: str) -> Optional[Tuple[str, ...]]:
+        """最短路径（含起点和终点）；不可达时返回 None"""
+        a, b = self.ids.get(start), self.ids.get(goal)
+        if a is None or b is None:
+            return None
+        key = (a, b)
+        if key not in self._paths:
+            self._paths[key] = self._walk(a, b)
+        return self._paths[key]
+
+    def _walk(self, a: int, b: int) -> Optional[Tuple[str, ...]]:
+        if self.distances[a][b] == UNREACHABLE:
+            return None
+        # 沿步数表前进：每步走到离终点近一步的邻居
+        route = [a]
+        while route[-1] != b:
+            here = route[-1]
+            route.append(next(
+                neighbor for neighbor in self.adjacency[here]
+                if self.distances[neighbor][b] == self.distances[here][b] - 1
+            ))
+        return tuple(self.names[i] for i in route)
+
+def _map_key(combat_map: Map) -> MapKey:
+    return tuple(
+        (zone, tuple(data.get("adjacent_zones", [])))
+        for zone, data in (combat_map.get("zones") or {}).items()
+    )
+
+@lru_cache(maxsize=MAP_INDEX_CACHE_SIZE)
+def _build_index(key: MapKey) -> MapIndex:
+    return MapIndex(key)
+
+def get_map_index(combat_map: Optional[Map]) -> Optional[MapIndex]:
+    """地图的索引，相同连通关系的地图共用一份；没有地图时返回 None"""
+    if not combat_map:
+        return None
+    return _build_index(_map_key(combat_map))
+
+# ==================== 提示词用的地图 ====================
+
+def relevant_zones(
+    combat_map: Map,
+    participants: Sequence[Participant],
+    actor_id: Optional[str] = None,
+    radius: int = MAP_CONTEXT_RADIUS,
+) -> List[str]:
+    """与当前局面有关的区域：在场参与者所在的区域，加上行动者 radius 步以内的区域"""
+    index = get_map_index(combat_map)
+    zones: Dict[str, None] = {}
+    actor = next((p for p in participants if p["id"] == actor_id), None) if actor_id else None
+    if index is not None and actor is not None and actor.get("location"):
+        zones.update(dict.fromkeys(index.within(actor["location"], radius)))
+    for participant in participants:
+        location = participant.get("location")
+        if location and participant["status"] == ParticipantStatus.ACTIVE:
+            zones.setdefault(location)
+    return list(zones)
+
+def relevant_map(
+    combat_map: Optional[Map],
+    participants: Sequence[Participant],
+    actor_id: Optional[str] = None,
+    radius: int = MAP_CONTEXT_RADIUS,
+) -> Optional[Dict[str, Any]]:
+    """只包含有关区域的地图，并附上行动者到其他在场参与者的步数
+
+    没有任何参与者有位置时返回整张地图。
+    """
+    if not combat_map:
+        return None
+    names = relevant_zones(combat_map, participants, actor_id, radius)
+    all_zones = combat_map.get("zones") or {}
+    if not names:
+        return dict(combat_map)
+    subset: Dict[str, Any] = {
+        "name": combat_map.get("name"),
+        "zones": {name: all_zones[name] for name in names if name in all_zones},
+    }
+    omitted = len(all_zones) - len(subset["zones"])
+    if omitted > 0:
+        subset["omitted_zones"] = omitted
+
+    actor = next((p for p in participants if p["id"] == actor_id), None) if actor_id else None
+    if actor is not None and actor.get("location"):
+        index = get_map_index(combat_map)
+        subset["distances"] = {
+            p["id"]: index.distance(actor["location"], p.get("location"))  # type: ignore[union-attr]
+            for p in _others(participants, actor_id)
+        }
+    return subset
+
+def _others(participants: Iterable[Participant], actor_id: Optional[str]) -> Iterable[Participant]:
+    return (
+        p for p in participants
+        if p["id"] != actor_id and p.get("location") and p["status"] == ParticipantStatus.ACTIVE
+    )
@@ -0,0 +1,60 @@
+# === src/participant_store.py ===
+
+"""
+参与者存储
+
+维护每一方（调查员/敌人）仍能行动和已倒下的人数，判断战斗是否结束不再需要扫描全部参与者。
+
+GraphState 中保存 List[Participant]；每一方的人数作为 GraphState.side_counts 跟着状态走，
+由 apply_attack_outcome / apply_participant_deltas 在参与者变化时用 recount 增量更新，
+determine_next_step 直接读取。一场战斗只有几个参与者，单个参与者用 find_participant 顺序查找，不复制。
+"""
+
+from typing import Dict, Iterable, Optional
+
+from .types import Participant, ParticipantStatus
+
+SIDES = ("investigator", "enemy")
+
+# 每一方能行动和已倒下的人数：{"investigator": {"active": 2, "down": 0}, "enemy": {...}}
+SideCounts = Dict[str, Dict[str, int]]
+
+def is_down(participant: Participant) -> bool:
+    """已无法行动（状态不是 active，或 HP 归零）"""
+    return participant["status"] != ParticipantStatus.ACTIVE or participant["stats"].get("HP", 0) <= 0
+
+def count_sides(participants: Iterable[Participant]) -> SideCounts:
+    """全量统计每一方的人数；只在战斗开始或状态里还没有计数时使用"""
+    counts: SideCounts = {side: {"active": 0, "down": 0} for side in SIDES}
+    for participant in participants:
+        counts.setdefault(participant["type"], {"active": 0, "down": 0})["down" if is_down(participant) else "active"] += 1
+    return counts
+
+def copy_counts(counts: SideCounts) -> SideCounts:
+    """复制计数，节点更新副本而不修改输入状态"""
+    return {side: dict(side_counts) for side, side_counts in counts.items()}
+
+def recount(counts: SideCounts, before: Participant, after: Participant) -> None:
+    """一个参与者从 before 变成 after 后原地更新计数"""
+    was_down, now_down = is_down(before), is_down(after)
+    if was_down == now_down:
+        return
+    side = counts.setdefault(after["type"], {"active": 0, "down": 0})
+    side["down" if was_down else "active"] -= 1
+    side["down" if now_down else "active"] += 1
+
+def side_defeated(counts: SideCounts, side: str) -> bool:
+    """某一方是否已经没有能行动的参与者"""
+    return counts.get(side, {}).get("active", 0) == 0
+
+def find_participant(participants: Iterable[Participant], key: Optional[str]) -> Optional[Participant]:
+    """按 id 或名字查找参与者（返回原对象，不复制）"""
+    if not key:
+        return None
+    by_name = None
+    for participant in participants:
+        if participant["id"] == key:
+            return participant
+        if by_name is None and participant["name"] == key:
+            by_name = participant
+    return by_name
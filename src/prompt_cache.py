@@ -0,0 +1,93 @@
+# === src/prompt_cache.py ===
+
+"""
+适合提供方前缀缓存的提示词布局
+
+提供方的提示词缓存只对完全相同的前缀生效。提示词因此分成两部分：
+- 前缀（system 消息）：不含变量的规则说明，也可以追加一局战斗内不变的内容，
+  同一局里每个回合的前缀逐字节相同
+- 后缀（human 消息和工具调用的 scratchpad）：日志、参与者状态、相关区域的地图、玩家输入等每回合变化的内容
+
+使用 ChatAnthropic 时（PROMPT_CACHE=true，默认）在前缀的每一段末尾自动加上 cache_control 断点，
+工具定义排在 system 之前，也会一起缓存。其他提供方（Gemini 的隐式缓存）只需要前缀稳定，不加断点。
+缓存读写的 token 数由 telemetry 记录（coc_llm_cached_tokens_total）。
+
+两种形式的前缀文本完全相同（分段拼接即整个 system 消息），录制回放的提示词哈希不受影响。
+"""
+
+import hashlib
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+# 加载环境变量
+load_dotenv()
+
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "true").lower() == "true"
+
+_CACHE_CONTROL = {"type": "ephemeral"}
+
+def supports_cache_breakpoints(llm: Any) -> bool:
+    """模型是否是 ChatAnthropic（包括录制模式包装的）"""
+    while llm is not None:
+        if type(llm).__module__.startswith("langchain_anthropic"):
+            return True
+        llm = getattr(llm, "inner", None)
+    return False
+
+class CachedPrompt:
+    """分成稳定前缀和可变后缀的提示词
+
+    Args:
+        prefix: system 消息的各段，按稳定程度从高到低排列；每段以换行结尾，拼接即完整的 system 消息
+        suffix: human 消息模板，放每回合变化的内容
+        scratchpad: 是否追加工具调用的 agent_scratchpad
+    """
+
+    def __init__(self, prefix: Sequence[str], suffix: str, scratchpad: bool = False):
+        self.prefix = list(prefix)
+        self.suffix = suffix
+        self.scratchpad = scratchpad
+        self._templates: Dict[bool, ChatPromptTemplate] = {}
+
+    def template(self, cache_breakpoints: bool = False) -> ChatPromptTemplate:
+        """提示词模板；cache_breakpoints 为真时前缀每段都是带 cache_control 的内容块"""
+        if cache_breakpoints not in self._templates:
+            if cache_breakpoints:
+                system: Any = [
+                    {"type": "text", "text": segment, "cache_control": _CACHE_CONTROL}
+                    for segment in self.prefix
+                ]
+            else:
+                system = "".join(self.prefix)
+            messages: List[Any] = [("system", system), ("human", self.suffix)]
+            if self.scratchpad:
+                messages.append(MessagesPlaceholder("agent_scratchpad"))
+            self._templates[cache_breakpoints] = ChatPromptTemplate.from_messages(messages)
+        return self._templates[cache_breakpoints]
+
+    def for_llm(self, llm: Any) -> ChatPromptTemplate:
+        """按模型选择模板：ChatAnthropic 加断点"""
+        return self.template(PROMPT_CACHE and supports_cache_breakpoints(llm))
+
+    def format_messages(self, **kwargs: Any) -> List[BaseMessage]:
+        return self.template().format_messages(**kwargs)
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return str(content)
+
+def prefix_digest(messages: Sequence[BaseMessage]) -> Optional[str]:
+    """提示词前缀（开头的 system 消息）的哈希；没有 system 消息时返回 None"""
+    prefix = []
+    for message in messages:
+        if message.type != "system":
+            break
+        prefix.append(_text(message.content))
+    if not prefix:
+        return None
+    return hashlib.sha256("".join(prefix).encode("utf-8")).hexdigest()
@@ -0,0 +1,404 @@
+# === src/replay_llm.py ===
+
+"""
+LLM 录制 / 回放
+
+由 LLM_MODE 选择 get_llm() 返回的模型：
+- live: 直接调用 Claude / Gemini（默认）
+- record: 包装真实模型，把每次调用的提示词和响应（包括 AgentExecutor 的工具调用轮次）追加到 JSONL
+- replay: 不访问网络，按提示词哈希从 JSONL 中取出录制的响应，并模拟延迟
+
+回放规则：
+- 提示词哈希完全相同的录制按录制顺序依次使用（用完后从头循环）
+- 找不到相同提示词时（例如工具返回了不同的掷骰结果），在工具集和 system 前缀都相同的录制中
+  按录制顺序取下一条尚未使用的响应，不会拿到其他智能体的响应；没有这样的录制或
+  LLM_REPLAY_STRICT=true 时抛出异常
+- 规则引擎的随机数（先攻、检定、伤害）用录制文件里的种子初始化（seed_rules_rng），
+  回放时掷出和录制时相同的骰子，整场战斗逐步一致
+- 延迟 = 首字延迟 + 每个输出 token 的延迟，再乘以 (1 ± 抖动)，抖动由 LLM_REPLAY_SEED 决定，可复现
+
+用法:
+    LLM_MODE=record python src/coc_keeper_demo.py   # 联网录制
+    LLM_MODE=replay python src/coc_keeper_demo.py   # 离线回放
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    message_chunk_to_message,
+    message_to_dict,
+    messages_from_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from .context_builder import estimate_tokens
+from .prompt_cache import prefix_digest
+
+# 加载环境变量
+load_dotenv()
+
+LLM_MODE = os.getenv("LLM_MODE", "live").lower()
+
+def current_mode() -> str:
+    """当前的 LLM_MODE（每次读取环境变量，切换后智能体注册表会重建模型）"""
+    return os.getenv("LLM_MODE", LLM_MODE).lower()
+LLM_RECORDING_PATH = os.getenv("LLM_RECORDING_PATH", ".cache/llm_recording.jsonl")
+LLM_REPLAY_STRICT = os.getenv("LLM_REPLAY_STRICT", "false").lower() == "true"
+# 延迟模型（秒）：首字延迟、每个输出 token 的延迟、抖动比例
+LLM_REPLAY_FIRST_TOKEN = float(os.getenv("LLM_REPLAY_FIRST_TOKEN", "0"))
+LLM_REPLAY_PER_TOKEN = float(os.getenv("LLM_REPLAY_PER_TOKEN", "0"))
+LLM_REPLAY_JITTER = float(os.getenv("LLM_REPLAY_JITTER", "0"))
+LLM_REPLAY_SEED = int(os.getenv("LLM_REPLAY_SEED", "0"))
+
+# 回放流式输出时每块的字符数
+_STREAM_CHUNK_CHARS = 8
+
+class ReplayMiss(LookupError):
+    """严格回放模式下找不到录制的响应"""
+
+# ==================== 提示词哈希 ====================
+
+def _text(content: Any) -> str:
+    """消息内容中的文本（Claude 的内容可能是分块列表）"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content)
+
+def _normalize_message(message: BaseMessage) -> Dict[str, Any]:
+    """与提供方无关的消息表示：不含调用 id、元数据"""
+    item: Dict[str, Any] = {"type": message.type, "content": _text(message.content)}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        item["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in tool_calls]
+    return item
+
+def fallback_group(messages: Sequence[BaseMessage], tool_names: Sequence[str]) -> str:
+    """非严格回放可以互相替代的录制：工具集和 system 前缀都相同（同一个智能体的同一类调用）"""
+    return f"{','.join(sorted(tool_names))}|{prefix_digest(messages)}"
+
+def prompt_key(messages: Sequence[BaseMessage], tools: Optional[Sequence[Dict[str, Any]]] = None) -> str:
+    """提示词哈希：消息内容 + 可用工具名"""
+    payload = {
+        "messages": [_normalize_message(message) for message in messages],
+        "tools": sorted(tool["function"]["name"] for tool in tools or []),
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+# ==================== 录制文件 ====================
+
+class RecordingStore:
+    """JSONL 录制文件：每行 {key, messages, tools, response, latency}，录制开始时另有一行 {seed}"""
+
+    def __init__(self, path: str = LLM_RECORDING_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Optional[List[Dict[str, Any]]] = None
+        self._by_key: Dict[str, List[int]] = {}
+        self._key_cursor: Dict[str, int] = {}
+        self._by_group: Dict[str, List[int]] = {}
+        self._group_cursor: Dict[str, int] = {}
+        self._seeds: List[int] = []
+        self._used: set = set()
+        self._cursor = 0
+        self.hits = 0
+        self.fallbacks = 0
+
+    def append(self, key: str, messages: Sequence[BaseMessage], tools: Optional[List[Dict[str, Any]]],
+               response: BaseMessage, latency: float) -> None:
+        entry = {
+            "key": key,
+            "messages": [message_to_dict(message) for message in messages],
+            "tools": [tool["function"]["name"] for tool in tools or []],
+            "response": message_to_dict(response),
+            "latency": round(latency, 4),
+        }
+        self._write(entry)
+
+    def append_seed(self, seed: int) -> None:
+        """记录这次录制的规则引擎随机数种子"""
+        self._write({"seed": seed})
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if self._entries is None:
+            entries = []
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        if "key" in entry:
+                            entries.append(entry)
+                        elif "seed" in entry:
+                            self._seeds.append(int(entry["seed"]))
+            self._entries = entries
+            for index, entry in enumerate(entries):
+                self._by_key.setdefault(entry["key"], []).append(index)
+                group = fallback_group(messages_from_dict(entry["messages"]), entry["tools"])
+                self._by_group.setdefault(group, []).append(index)
+        return self._entries
+
+    def recorded_seed(self) -> Optional[int]:
+        """录制文件里的第一个种子（回放从文件开头按顺序使用录制）"""
+        with self._lock:
+            self._load()
+            return self._seeds[0] if self._seeds else None
+
+    def lookup(self, key: str, group: Optional[str] = None, strict: bool = LLM_REPLAY_STRICT) -> AIMessage:
+        """取出录制的响应，见模块说明中的回放规则
+
+        Args:
+            key: 提示词哈希（prompt_key）
+            group: 非严格回放时可以替代的录制（fallback_group）
+            strict: 找不到相同提示词时是否直接抛出异常
+        """
+        with self._lock:
+            entries = self._load()
+            if not entries:
+                raise ReplayMiss(f"录制文件为空或不存在: {self.path}")
+            indexes = self._by_key.get(key)
+            if indexes:
+                position = self._key_cursor.get(key, 0)
+                index = indexes[position % len(indexes)]
+                self._key_cursor[key] = position + 1
+                self.hits += 1
+            elif strict:
+                raise ReplayMiss(f"没有录制提示词 {key[:12]} 的响应")
+            else:
+                index = self._next_unused(key, group)
+                self.fallbacks += 1
+            self._used.add(index)
+            self._cursor = max(self._cursor, index + 1)
+            return messages_from_dict([entries[index]["response"]])[0]
+
+    def _next_unused(self, key: str, group: Optional[str]) -> int:
+        indexes = self._by_group.get(group) if group is not None else None
+        if not indexes:
+            raise ReplayMiss(f"没有与提示词 {key[:12]} 工具集和 system 前缀相同的录制")
+        # 从上次使用的位置往后找，再回到开头
+        ordered = [index for index in indexes if index >= self._cursor] + [index for index in indexes if index < self._cursor]
+        for index in ordered:
+            if index not in self._used:
+                return index
+        # 这一组全部用过一遍后按顺序循环
+        position = self._group_cursor.get(group, 0)
+        self._group_cursor[group] = position + 1
+        return indexes[position % len(indexes)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"recorded": len(self._load()), "hits": self.hits, "fallbacks": self.fallbacks}
+
+_stores: Dict[str, RecordingStore] = {}
+_stores_lock = threading.Lock()
+
+def get_recording_store(path: str = LLM_RECORDING_PATH) -> RecordingStore:
+    """同一个文件共用一个存储，所有智能体的回放顺序是全局的"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = RecordingStore(path)
+        return _stores[path]
+
+# ==================== 延迟模型 ====================
+
+class LatencyModel:
+    """首字延迟 + 每 token 延迟，带可复现的抖动"""
+
+    def __init__(self, first_token: float = LLM_REPLAY_FIRST_TOKEN, per_token: float = LLM_REPLAY_PER_TOKEN,
+                 jitter: float = LLM_REPLAY_JITTER, seed: int = LLM_REPLAY_SEED):
+        self.first_token = first_token
+        self.per_token = per_token
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _scale(self) -> float:
+        if not self.jitter:
+            return 1.0
+        with self._lock:
+            return max(0.0, 1 + self._random.uniform(-self.jitter, self.jitter))
+
+    def first_token_delay(self) -> float:
+        return self.first_token * self._scale()
+
+    def token_delay(self, tokens: int) -> float:
+        return self.per_token * tokens * self._scale()
+
+def _output_tokens(message: BaseMessage) -> int:
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("output_tokens"):
+        return int(usage["output_tokens"])
+    text = _text(message.content) + json.dumps(getattr(message, "tool_calls", None) or [], ensure_ascii=False)
+    return estimate_tokens(text)
+
+def _chunk_tokens(chunk: AIMessageChunk) -> int:
+    text = _text(chunk.content) + "".join(call.get("args") or "" for call in chunk.tool_call_chunks)
+    return estimate_tokens(text)
+
+# ==================== 模型 ====================
+
+class _ToolBindingMixin:
+    """bind_tools：把工具统一转换成 OpenAI 格式绑定到调用参数上，录制和回放的哈希因此一致"""
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+class RecordingChatModel(_ToolBindingMixin, BaseChatModel):
+    """包装真实模型，把每次调用追加到录制文件"""
+
+    inner: BaseChatModel
+    store: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"recording-{self.inner._llm_type}"
+
+    def _bound_inner(self, kwargs: Dict[str, Any]):
+        tools = kwargs.pop("tools", None)
+        return (self.inner.bind_tools(tools, **kwargs) if tools else self.inner.bind(**kwargs)), tools
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        model, tools = self._bound_inner(kwargs)
+        started = time.perf_counter()
+        response = model.invoke(messages, stop=stop)
+        self.store.append(prompt_key(messages, tools), messages, tools, response, time.perf_counter() - started)
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        model, tools = self._bound_inner(kwargs)
+        started = time.perf_counter()
+        response = await model.ainvoke(messages, stop=stop)
+        self.store.append(prompt_key(messages, tools), messages, tools, response, time.perf_counter() - started)
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        model, tools = self._bound_inner(kwargs)
+        started = time.perf_counter()
+        aggregate: Optional[AIMessageChunk] = None
+        async for chunk in model.astream(messages, stop=stop):
+            # 不支持流式的模型直接返回完整消息
+            pieces = [chunk] if isinstance(chunk, AIMessageChunk) else _split_response(chunk)
+            for piece in pieces:
+                aggregate = piece if aggregate is None else aggregate + piece
+                yield ChatGenerationChunk(message=piece)
+        if aggregate is not None:
+            response = message_chunk_to_message(aggregate)
+            self.store.append(prompt_key(messages, tools), messages, tools, response, time.perf_counter() - started)
+
+class ReplayChatModel(_ToolBindingMixin, BaseChatModel):
+    """从录制文件回放响应，不访问网络"""
+
+    store: Any = None
+    latency: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _lookup(self, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> AIMessage:
+        tools = kwargs.get("tools")
+        group = fallback_group(messages, [tool["function"]["name"] for tool in tools or []])
+        return self.store.lookup(prompt_key(messages, tools), group)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        response = self._lookup(messages, kwargs)
+        time.sleep(self.latency.first_token_delay() + self.latency.token_delay(_output_tokens(response)))
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        response = self._lookup(messages, kwargs)
+        await asyncio.sleep(self.latency.first_token_delay() + self.latency.token_delay(_output_tokens(response)))
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        response = self._lookup(messages, kwargs)
+        time.sleep(self.latency.first_token_delay())
+        for chunk in _split_response(response):
+            time.sleep(self.latency.token_delay(_chunk_tokens(chunk)))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        response = self._lookup(messages, kwargs)
+        await asyncio.sleep(self.latency.first_token_delay())
+        for chunk in _split_response(response):
+            await asyncio.sleep(self.latency.token_delay(_chunk_tokens(chunk)))
+            yield ChatGenerationChunk(message=chunk)
+
+def _split_response(response: AIMessage) -> List[AIMessageChunk]:
+    """把录制的响应切成流式块；工具调用作为最后一块整体输出"""
+    text = _text(response.content)
+    chunks = [AIMessageChunk(content=text[i:i + _STREAM_CHUNK_CHARS]) for i in range(0, len(text), _STREAM_CHUNK_CHARS)]
+    if response.tool_calls:
+        chunks.append(AIMessageChunk(content="", tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"], ensure_ascii=False), "id": call.get("id"), "index": i}
+            for i, call in enumerate(response.tool_calls)
+        ]))
+    if not chunks:
+        chunks.append(AIMessageChunk(content=""))
+    chunks[-1].usage_metadata = response.usage_metadata
+    chunks[-1].response_metadata = dict(response.response_metadata)
+    return chunks
+
+def seed_rules_rng(mode: Optional[str] = None) -> Optional[int]:
+    """初始化规则引擎使用的 random 模块，在开始战斗前调用
+
+    录制模式生成新种子并写入录制文件；回放模式使用录制文件里的种子，掷骰结果和录制时一致，
+    工具返回、提示词和哈希因此也一致。文件里没有种子时使用 LLM_REPLAY_SEED。其他模式不做任何事。
+
+    Returns:
+        Optional[int]: 使用的种子
+    """
+    mode = mode or current_mode()
+    if mode == "record":
+        seed = random.SystemRandom().randrange(2 ** 32)
+        get_recording_store().append_seed(seed)
+    elif mode == "replay":
+        seed = get_recording_store().recorded_seed()
+        if seed is None:
+            seed = LLM_REPLAY_SEED
+    else:
+        return None
+    random.seed(seed)
+    return seed
+
+def wrap_llm(llm: Optional[BaseChatModel], mode: Optional[str] = None) -> BaseChatModel:
+    """按 LLM_MODE 包装 get_llm 创建的模型；回放模式不需要真实模型"""
+    mode = mode or current_mode()
+    if mode == "replay":
+        return ReplayChatModel(store=get_recording_store(), latency=LatencyModel())
+    if llm is None:
+        raise ValueError("需要真实模型")
+    if mode == "record":
+        return RecordingChatModel(inner=llm, store=get_recording_store())
+    return llm
@@ -0,0 +1,139 @@
+# === src/round_planner.py ===
+
+"""
+怪物回合的并发规划
+
+多个敌人在先攻顺序中连续行动时，工作流按 determine_next_step → monster_ai 逐个循环，
+每个需要 LLM 决策的怪物都要付一次串行的 LLM 延迟。
+
+轮到这一串怪物中的第一个时，基于同一份状态快照用 asyncio.gather 同时请求所有需要 LLM 的怪物的决策，
+计划保存在 GraphState.monster_plans 中；之后仍按先攻顺序逐个结算。
+结算前检查计划是否过时：怪物自身或它的目标（以及计划里改动的参与者）的状态、HP 被之前的行动改变，
+或者已经进入下一轮时，只为这个怪物重新规划。
+
+战术引擎能直接决定的怪物（见 tactics）不需要规划。
+规划、采用和重新规划的次数记录在 planning_stats 中。
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .tactics import MONSTER_TACTICS, is_intelligent
+from .types import GraphState, Participant, ParticipantStatus
+
+# 加载环境变量
+load_dotenv()
+
+CONCURRENT_MONSTER_PLANNING = os.getenv("CONCURRENT_MONSTER_PLANNING", "true").lower() == "true"
+
+MonsterPlan = Dict[str, Any]
+
+class PlanningStats:
+    """并发规划的统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.phases = 0  # 并发规划的次数
+            self.planned = 0  # 并发请求的决策数
+            self.used = 0  # 直接采用的计划数
+            self.replanned = 0  # 因局势变化重新规划的次数
+
+    def record_phase(self, planned: int) -> None:
+        with self._lock:
+            self.phases += 1
+            self.planned += planned
+
+    def record_use(self, current: bool) -> None:
+        with self._lock:
+            if current:
+                self.used += 1
+            else:
+                self.replanned += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "phases": self.phases,
+                "planned": self.planned,
+                "used": self.used,
+                "replanned": self.replanned,
+            }
+
+planning_stats = PlanningStats()
+
+def get_planning_stats() -> Dict[str, Any]:
+    """并发规划的采用和重新规划次数"""
+    return planning_stats.to_dict()
+
+def needs_llm(participant: Participant) -> bool:
+    """该怪物的行动是否需要 LLM 决策"""
+    return not MONSTER_TACTICS or is_intelligent(participant)
+
+def situation(participants: List[Participant], ids: List[Optional[str]]) -> List[List[Any]]:
+    """计划所依赖的参与者的局势：[id, 状态, HP]，用于判断计划是否过时"""
+    by_id = {p["id"]: p for p in participants}
+    result = []
+    for pid in dict.fromkeys(pid for pid in ids if pid):
+        participant = by_id.get(pid)
+        if participant is not None:
+            result.append([pid, ParticipantStatus(participant["status"]).value, participant["stats"].get("HP", 0)])
+        else:
+            result.append([pid, None, None])
+    return result
+
+def plan_dependencies(actor_id: str, decision: Dict[str, Any]) -> List[Optional[str]]:
+    """计划依赖的参与者：怪物自身、攻击目标、增量里改动的参与者"""
+    ids: List[Optional[str]] = [actor_id, (decision.get("action") or {}).get("target")]
+    deltas = decision.get("result")
+    if isinstance(deltas, list):
+        ids.extend(delta.get("id") for delta in deltas if isinstance(delta, dict))
+    return ids
+
+def plan_is_current(state: GraphState, plan: MonsterPlan) -> bool:
+    """计划是否仍然适用：同一轮，并且依赖的参与者局势没有变化"""
+    if plan.get("round") != state.get("round_number"):
+        return False
+    ids = [entry[0] for entry in plan.get("situation", [])]
+    return situation(state["participants"], ids) == plan.get("situation")
+
+def upcoming_monster_turns(state: GraphState) -> List[str]:
+    """从当前行动者开始，先攻顺序里连续行动、需要 LLM 决策的怪物"""
+    by_id = {p["id"]: p for p in state["participants"]}
+    order = state["initiative_order"]
+    upcoming = []
+    for actor_id in order[max(state["current_actor_index"], 0):]:
+        participant = by_id.get(actor_id)
+        if participant is None or participant["type"] != "enemy":
+            break
+        if participant["status"] == ParticipantStatus.ACTIVE and needs_llm(participant):
+            upcoming.append(actor_id)
+    return upcoming
+
+async def plan_monster_phase(
+    state: GraphState,
+    plan_one: Callable[[GraphState, str], Awaitable[MonsterPlan]],
+) -> Dict[str, MonsterPlan]:
+    """基于当前状态快照并发规划接下来连续行动的怪物
+
+    Args:
+        state: 当前状态（只读）
+        plan_one: 为单个怪物请求决策，返回计划
+
+    Returns:
+        怪物 id -> 计划；只有一个怪物需要规划时不并发，直接返回它的计划
+    """
+    actor_ids = upcoming_monster_turns(state)
+    if not actor_ids:
+        return {}
+    plans = await asyncio.gather(*(plan_one(state, actor_id) for actor_id in actor_ids))
+    if len(actor_ids) > 1:
+        planning_stats.record_phase(len(actor_ids))
+    return dict(zip(actor_ids, plans))
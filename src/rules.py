@@ -0,0 +1,485 @@
+# === src/rules.py ===
+
+"""
+CoC 7版规则判定引擎
+
+纯 Python 实现的技能检定、对抗检定（闪避/反击）、成功等级和伤害计算。
+智能体只需要决定意图（攻击谁、用什么武器、闪避还是反击），
+判定结果由这里一次性给出，不再需要 LLM 反复调用掷骰工具。
+"""
+
+import random
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+from .participant_store import SideCounts, recount
+from .tools.dice_notation import compile_dice
+from .tools.dice_tools import DiceResult
+from .types import Participant, ParticipantStatus
+
+# ==================== 成功等级 ====================
+
+class SuccessLevel(str, Enum):
+    FUMBLE = "fumble"
+    FAILURE = "failure"
+    REGULAR = "regular"
+    HARD = "hard"
+    EXTREME = "extreme"
+    CRITICAL = "critical"
+
+# 成功等级的高低顺序，用于对抗检定比较
+_LEVEL_RANK = {
+    SuccessLevel.FUMBLE: 0,
+    SuccessLevel.FAILURE: 1,
+    SuccessLevel.REGULAR: 2,
+    SuccessLevel.HARD: 3,
+    SuccessLevel.EXTREME: 4,
+    SuccessLevel.CRITICAL: 5,
+}
+
+_LEVEL_NAMES = {
+    SuccessLevel.FUMBLE: "大失败",
+    SuccessLevel.FAILURE: "失败",
+    SuccessLevel.REGULAR: "常规成功",
+    SuccessLevel.HARD: "困难成功",
+    SuccessLevel.EXTREME: "极难成功",
+    SuccessLevel.CRITICAL: "大成功",
+}
+
+def level_rank(level: SuccessLevel) -> int:
+    """成功等级的数值，越大越好"""
+    return _LEVEL_RANK[level]
+
+def determine_success_level(roll: int, skill: int) -> SuccessLevel:
+    """根据百分骰结果和技能值确定成功等级
+
+    技能值低于50时，96-100为大失败；否则只有100是大失败。
+    """
+    if roll == 1:
+        return SuccessLevel.CRITICAL
+    if roll == 100 or (skill < 50 and roll >= 96):
+        return SuccessLevel.FUMBLE
+    if roll <= skill // 5:
+        return SuccessLevel.EXTREME
+    if roll <= skill // 2:
+        return SuccessLevel.HARD
+    if roll <= skill:
+        return SuccessLevel.REGULAR
+    return SuccessLevel.FAILURE
+
+# ==================== 技能检定 ====================
+
+@dataclass
+class CheckResult:
+    skill_name: str
+    skill_value: int
+    roll: int
+    level: SuccessLevel
+
+    @property
+    def success(self) -> bool:
+        return level_rank(self.level) >= level_rank(SuccessLevel.REGULAR)
+
+    def describe(self) -> str:
+        return f"{self.skill_name}检定 1d100={self.roll}/{self.skill_value}（{_LEVEL_NAMES[self.level]}）"
+
+def skill_check(
+    skill_value: int,
+    skill_name: str = "技能",
+    bonus: int = 0,
+    penalty: int = 0,
+    rng: Optional[random.Random] = None,
+) -> CheckResult:
+    """技能检定
+
+    Args:
+        skill_value: 技能值
+        skill_name: 技能名称，用于描述
+        bonus: 奖励骰数量
+        penalty: 惩罚骰数量，与奖励骰互相抵消
+        rng: 可选的随机数生成器
+
+    Returns:
+        CheckResult: 检定结果
+    """
+    net = bonus - penalty
+    if net > 0:
+        notation = f"1d100b{net}"
+    elif net < 0:
+        notation = f"1d100p{-net}"
+    else:
+        notation = "1d100"
+    _, roll, _ = compile_dice(notation).roll(rng=rng)
+    return CheckResult(skill_name, skill_value, roll, determine_success_level(roll, skill_value))
+
+# ==================== 武器与伤害加值 ====================
+
+@dataclass(frozen=True)
+class Weapon:
+    name: str
+    skill: str  # 使用的技能，"fighting" 或 "firearms"
+    damage: str  # 伤害骰表示法，可包含 DB
+    impaling: bool = False  # 是否为贯穿武器
+
+# 常用武器表，键为道具名
+WEAPONS: Dict[str, Weapon] = {
+    "徒手": Weapon("徒手", "fighting", "1d3+DB"),
+    "手枪": Weapon("手枪", "firearms", "1d10", impaling=True),
+    "步枪": Weapon("步枪", "firearms", "2d6+4", impaling=True),
+    "霰弹枪": Weapon("霰弹枪", "firearms", "4d6"),
+    "猎刀": Weapon("猎刀", "fighting", "1d4+2+DB", impaling=True),
+    "小刀": Weapon("小刀", "fighting", "1d4+DB", impaling=True),
+    "棍棒": Weapon("棍棒", "fighting", "1d8+DB"),
+    "爪击": Weapon("爪击", "fighting", "1d6+DB"),
+    "啃咬": Weapon("啃咬", "fighting", "1d4+DB", impaling=True),
+}
+
+UNARMED = WEAPONS["徒手"]
+
+_SKILL_NAMES = {"fighting": "格斗", "firearms": "射击", "dodge": "闪避"}
+
+def get_weapon(name: Optional[str]) -> Weapon:
+    """按名称查找武器，找不到时视为徒手"""
+    if not name:
+        return UNARMED
+    return WEAPONS.get(name, UNARMED)
+
+def damage_bonus_for(stats: Dict[str, Any]) -> str:
+    """根据 STR+SIZ 计算伤害加值(DB)"""
+    total = stats.get("STR", 50) + stats.get("SIZ", 50)
+    if total <= 64:
+        return "-2"
+    if total <= 84:
+        return "-1"
+    if total <= 124:
+        return "0"
+    if total <= 164:
+        return "+1d4"
+    if total <= 204:
+        return "+1d6"
+    # 205 以上每 80 点多一个 1d6
+    return f"+{2 + (total - 205) // 80}d6"
+
+def _max_damage(notation: str, damage_bonus: str) -> int:
+    """伤害表达式的最大值（极难成功时使用）"""
+    compiled = compile_dice(notation)
+    db = compiled.resolve_damage_bonus(damage_bonus)
+    total = 0
+    for term in compiled.terms:
+        if term.kind == "dice":
+            total += term.sign * term.count * term.sides
+        elif term.kind == "const":
+            total += term.sign * term.value
+        elif db is not None:
+            total += term.sign * _max_damage(db.notation, "0")
+    return total
+
+# ==================== 攻击判定 ====================
+
+# 防守方的应对方式
+DEFENSE_DODGE = "dodge"
+DEFENSE_FIGHT_BACK = "fight_back"
+DEFENSE_NONE = "none"
+
+@dataclass
+class AttackOutcome:
+    attacker_id: str
+    defender_id: str
+    weapon: str
+    response: str
+    attack: CheckResult
+    defense: Optional[CheckResult] = None
+    hit: bool = False
+    damage: int = 0
+    damage_roll: Optional[DiceResult] = None
+    damage_target_id: Optional[str] = None  # 受到伤害的一方（反击成功时是攻击者）
+    success_level: Optional[SuccessLevel] = None  # 造成伤害一方的成功等级，决定伤害计算方式
+    damage_weapon: Optional[str] = None  # 造成伤害的武器（反击成功时是防守方的武器）
+    notes: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "attacker_id": self.attacker_id,
+            "defender_id": self.defender_id,
+            "weapon": self.weapon,
+            "response": self.response,
+            "attack": {"roll": self.attack.roll, "skill": self.attack.skill_value, "level": self.attack.level.value},
+            "defense": (
+                {"roll": self.defense.roll, "skill": self.defense.skill_value, "level": self.defense.level.value}
+                if self.defense else None
+            ),
+            "hit": self.hit,
+            "damage": self.damage,
+            "damage_target_id": self.damage_target_id,
+            "success_level": self.success_level.value if self.success_level else None,
+            "damage_weapon": self.damage_weapon,
+        }
+
+def choose_defense(defender: Participant, weapon: Weapon) -> str:
+    """非玩家角色的默认应对：枪械无法闪避，否则选闪避和格斗中较高的一项"""
+    if weapon.skill == "firearms":
+        return DEFENSE_NONE
+    stats = defender["stats"]
+    return DEFENSE_DODGE if stats.get("dodge", 0) >= stats.get("fighting", 0) else DEFENSE_FIGHT_BACK
+
+def _roll(notation: str, damage_bonus: str, rng: Optional[random.Random]) -> DiceResult:
+    rolls, total, modifier = compile_dice(notation).roll(damage_bonus, rng)
+    return DiceResult(dice=notation, rolls=rolls, total=total, modifier=modifier, final_result=total + modifier)
+
+def _roll_damage(
+    weapon: Weapon,
+    damage_bonus: str,
+    level: SuccessLevel,
+    rng: Optional[random.Random],
+) -> Tuple[int, Optional[DiceResult]]:
+    """计算伤害：极难成功以上取最大伤害，贯穿武器再额外投一次伤害骰"""
+    if level_rank(level) >= level_rank(SuccessLevel.EXTREME):
+        damage = _max_damage(weapon.damage, damage_bonus)
+        if weapon.impaling:
+            extra = _roll(weapon.damage, damage_bonus, rng)
+            return damage + max(extra.final_result, 0), extra
+        return damage, None
+    result = _roll(weapon.damage, damage_bonus, rng)
+    return max(result.final_result, 0), result
+
+def resolve_attack(
+    attacker: Participant,
+    defender: Participant,
+    weapon_name: Optional[str] = None,
+    response: Optional[str] = None,
+    rng: Optional[random.Random] = None,
+    defender_weapon: Optional[str] = None,
+) -> AttackOutcome:
+    """一次完整的攻击判定
+
+    Args:
+        attacker: 攻击者
+        defender: 防守者
+        weapon_name: 武器名，找不到时按徒手处理
+        response: 防守方应对（"dodge"、"fight_back"、"none"），为空时自动选择
+        rng: 可选的随机数生成器
+        defender_weapon: 反击成功时防守方使用的近战武器（如怪物的爪击），为空或不是近战武器时按徒手处理
+
+    Returns:
+        AttackOutcome: 命中、伤害和受伤的一方
+    """
+    weapon = get_weapon(weapon_name)
+    if weapon.skill == "firearms":
+        response = DEFENSE_NONE
+    elif response is None:
+        response = choose_defense(defender, weapon)
+
+    attack = skill_check(
+        attacker["stats"].get(weapon.skill, 0), _SKILL_NAMES[weapon.skill], rng=rng
+    )
+    outcome = AttackOutcome(
+        attacker_id=attacker["id"],
+        defender_id=defender["id"],
+        weapon=weapon.name,
+        response=response,
+        attack=attack,
+    )
+
+    if response == DEFENSE_DODGE:
+        outcome.defense = skill_check(defender["stats"].get("dodge", 0), "闪避", rng=rng)
+        # 闪避：攻击方等级必须更高才能命中，平手算闪避成功
+        outcome.hit = attack.success and level_rank(attack.level) > level_rank(outcome.defense.level)
+        winner, winner_level, target = attacker, attack.level, defender
+    elif response == DEFENSE_FIGHT_BACK:
+        outcome.defense = skill_check(defender["stats"].get("fighting", 0), "格斗", rng=rng)
+        # 反击：平手时攻击方获胜；防守方等级更高时反过来造成伤害
+        if attack.success and level_rank(attack.level) >= level_rank(outcome.defense.level):
+            outcome.hit = True
+            winner, winner_level, target = attacker, attack.level, defender
+        elif outcome.defense.success:
+            outcome.hit = True
+            outcome.notes.append(f"{defender['name']} 反击成功")
+            winner, winner_level, target = defender, outcome.defense.level, attacker
+        else:
+            winner = None
+    else:
+        outcome.hit = attack.success
+        winner, winner_level, target = attacker, attack.level, defender
+
+    if attack.level == SuccessLevel.FUMBLE:
+        outcome.notes.append(f"{attacker['name']} 攻击大失败")
+
+    if outcome.hit and winner is not None:
+        if winner is attacker:
+            used_weapon = weapon
+        else:
+            # 反击时使用防守方的近战武器
+            used_weapon = get_weapon(defender_weapon)
+            if used_weapon.skill != "fighting":
+                used_weapon = UNARMED
+        damage, damage_roll = _roll_damage(
+            used_weapon, damage_bonus_for(winner["stats"]), winner_level, rng
+        )
+        outcome.damage = damage
+        outcome.damage_roll = damage_roll
+        outcome.damage_target_id = target["id"]
+        outcome.success_level = winner_level
+        outcome.damage_weapon = used_weapon.name
+
+    return outcome
+
+def apply_damage(participant: Participant, damage: int) -> Participant:
+    """对参与者造成伤害，返回更新后的副本
+
+    敌人 HP 归零即死亡；调查员一次受到不低于最大 HP 的伤害才会死亡，否则陷入昏迷。
+    一次受到不低于最大 HP 一半的伤害会留下"重伤"效果。
+    """
+    stats = dict(participant["stats"])
+    max_hp = stats.get("max_HP", stats.get("HP", 0))
+    stats["HP"] = max(stats.get("HP", 0) - damage, 0)
+
+    updated: Participant = {**participant, "stats": stats, "effects": list(participant["effects"])}
+    if damage > 0 and max_hp and damage * 2 >= max_hp and "重伤" not in updated["effects"]:
+        updated["effects"].append("重伤")
+    if stats["HP"] <= 0:
+        if participant["type"] == "enemy" or damage >= max_hp:
+            updated["status"] = ParticipantStatus.DEAD
+        else:
+            updated["status"] = ParticipantStatus.UNCONSCIOUS
+    return updated
+
+def apply_attack_outcome(
+    participants: List[Participant],
+    outcome: AttackOutcome,
+    counts: Optional[SideCounts] = None,
+) -> List[Participant]:
+    """把攻击结果写回参与者列表，返回新列表；给出 counts 时原地更新每一方的人数"""
+    if not outcome.hit or outcome.damage_target_id is None:
+        return participants
+    updated = list(participants)
+    for i, participant in enumerate(updated):
+        if participant["id"] == outcome.damage_target_id:
+            updated[i] = apply_damage(participant, outcome.damage)
+            if counts is not None:
+                recount(counts, participant, updated[i])
+            break
+    return updated
+
+# ==================== 参与者增量更新 ====================
+
+# LLM 可以修改的数值：当前值 -> 上限，增量是相对值
+_DELTA_STATS = {"HP": "max_HP", "SAN": "max_SAN"}
+_DELTA_LISTS = {"add_effects": "effects", "remove_effects": "effects", "add_items": "items", "remove_items": "items"}
+
+def apply_participant_deltas(
+    participants: List[Participant],
+    deltas: List[Dict[str, Any]],
+    counts: Optional[SideCounts] = None,
+) -> Tuple[List[Participant], List[str]]:
+    """校验并合并 LLM 给出的增量更新
+
+    增量格式: {"id": "ghoul_1", "HP": -3, "SAN": -1, "status": "unconscious", "location": "走廊",
+    "add_effects": [...], "remove_effects": [...], "add_items": [...], "remove_items": [...]}
+    HP/SAN 是相对变化并限制在 [0, 上限]；HP 归零且没有给出状态时，敌人死亡、调查员昏迷。
+    其他字段（属性、技能等）不允许修改。给出 counts 时原地更新每一方的人数。
+
+    Returns:
+        (更新后的新列表, 被拒绝的字段说明)
+    """
+    index = {p["id"]: i for i, p in enumerate(participants)}
+    updated = list(participants)
+    errors: List[str] = []
+
+    for delta in deltas:
+        if not isinstance(delta, dict) or delta.get("id") not in index:
+            errors.append(f"未知的参与者: {delta!r}")
+            continue
+        i = index[delta["id"]]
+        participant = updated[i]
+        stats = dict(participant["stats"])
+        changed: Dict[str, Any] = {}
+
+        for key, value in delta.items():
+            if key == "id":
+                continue
+            if key in _DELTA_STATS:
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    errors.append(f"{delta['id']}.{key} 必须是数字: {value!r}")
+                    continue
+                upper = stats.get(_DELTA_STATS[key], stats.get(key, 0))
+                stats[key] = min(max(stats.get(key, 0) + int(value), 0), upper)
+                changed["stats"] = stats
+            elif key == "status":
+                try:
+                    changed["status"] = ParticipantStatus(value)
+                except ValueError:
+                    errors.append(f"{delta['id']}.status 无效: {value!r}")
+            elif key == "location":
+                changed["location"] = str(value)
+            elif key in _DELTA_LISTS:
+                field_name = _DELTA_LISTS[key]
+                values = changed.get(field_name, list(participant[field_name]))
+                for item in value if isinstance(value, list) else [value]:
+                    if key.startswith("add_") and item not in values:
+                        values.append(item)
+                    elif key.startswith("remove_") and item in values:
+                        values.remove(item)
+                changed[field_name] = values
+            else:
+                errors.append(f"{delta['id']}.{key} 不允许修改")
+
+        if changed:
+            participant = {**participant, **changed}
+            if stats.get("HP", 1) <= 0 and "status" not in changed and participant["status"] == ParticipantStatus.ACTIVE:
+                participant["status"] = (
+                    ParticipantStatus.DEAD if participant["type"] == "enemy" else ParticipantStatus.UNCONSCIOUS
+                )
+            if counts is not None:
+                recount(counts, updated[i], participant)
+            updated[i] = participant
+
+    return updated, errors
+
+def describe_attack(outcome: AttackOutcome, participants: List[Participant]) -> str:
+    """生成攻击结果的文字描述（包含掷骰结果），供战斗日志和叙述使用"""
+    names = {p["id"]: p["name"] for p in participants}
+    attacker = names.get(outcome.attacker_id, outcome.attacker_id)
+    defender = names.get(outcome.defender_id, outcome.defender_id)
+
+    parts = [f"{attacker} 使用{outcome.weapon}攻击 {defender}：{outcome.attack.describe()}"]
+    if outcome.defense is not None:
+        response = "闪避" if outcome.response == DEFENSE_DODGE else "反击"
+        parts.append(f"{defender} 选择{response}，{outcome.defense.describe()}")
+    parts.extend(outcome.notes)
+
+    if outcome.hit and outcome.damage_target_id is not None:
+        target = names.get(outcome.damage_target_id, outcome.damage_target_id)
+        level = outcome.success_level or SuccessLevel.REGULAR
+        extreme = level_rank(level) >= level_rank(SuccessLevel.EXTREME)
+        roll = outcome.damage_roll
+        if roll is None:
+            damage_text = f"{_LEVEL_NAMES[level]}，造成最大伤害 {outcome.damage} 点"
+        elif extreme:
+            # 贯穿武器：最大伤害再加一次伤害骰
+            damage_text = f"{_LEVEL_NAMES[level]}贯穿，最大伤害加 {roll.dice}={roll.final_result}，共 {outcome.damage} 点"
+        else:
+            damage_text = f"伤害 {roll.dice}={roll.final_result}"
+            if outcome.damage != roll.final_result:
+                damage_text += f"，实际 {outcome.damage} 点"
+        if outcome.damage_weapon and outcome.damage_target_id == outcome.attacker_id:
+            # 反击成功，伤害来自防守方的武器
+            damage_text = f"{outcome.damage_weapon}，{damage_text}"
+        target_after = next((p for p in participants if p["id"] == outcome.damage_target_id), None)
+        hp_text = f"，{target} 剩余HP {target_after['stats'].get('HP', 0)}" if target_after else ""
+        parts.append(f"命中 {target}！{damage_text}{hp_text}")
+    else:
+        parts.append("未能造成伤害")
+    return "。".join(parts) + "。"
+
+# 示例用法
+if __name__ == "__main__":
+    from .coc_keeper_demo import create_ghoul1, create_investigator1
+
+    investigator = create_investigator1()
+    ghoul = create_ghoul1()
+    participants = [investigator, ghoul]
+
+    outcome = resolve_attack(ghoul, investigator, "爪击", DEFENSE_DODGE)
+    participants = apply_attack_outcome(participants, outcome)
+    print(describe_attack(outcome, participants))
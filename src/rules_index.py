@@ -0,0 +1,257 @@
+# === src/rules_index.py ===
+
+"""
+本地规则检索索引
+
+对规则语料做 BM25 全文检索，供 rules_keeper_agent 使用。
+中文不分词，直接用字符一元和二元组作为词项，去掉常见虚字。
+索引在第一次使用时构建并保存到磁盘，语料内容变化时自动重建。
+
+- 高置信度的命中直接用语料原文回答，不调用 LLM
+- 其他情况把检索到的几段规则放进提示词
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .intent_classifier import normalize_input
+
+# 加载环境变量
+load_dotenv()
+
+# 额外的规则语料：JSONL（每行 {"title": ..., "text": ...}）或以空行分段的纯文本，可选
+RULES_CORPUS = os.getenv("RULES_CORPUS")
+RULES_INDEX_PATH = os.getenv("RULES_INDEX_PATH", ".cache/rules_index.json")
+# 覆盖率不低于该值、至少命中 RULES_DIRECT_MIN_TERMS 个查询词项、且明显领先第二名时直接用语料回答
+RULES_DIRECT_THRESHOLD = float(os.getenv("RULES_DIRECT_THRESHOLD", "0.75"))
+RULES_DIRECT_MIN_TERMS = int(os.getenv("RULES_DIRECT_MIN_TERMS", "2"))
+# 放进提示词的段落数
+RULES_TOP_K = int(os.getenv("RULES_TOP_K", "3"))
+
+# BM25 参数
+_K1 = 1.5
+_B = 0.75
+# 直接回答时第一名相对第二名的最小领先倍数
+_DIRECT_MARGIN = 1.5
+
+_INDEX_VERSION = 1
+
+class RulePassage(NamedTuple):
+    title: str
+    text: str
+
+class RuleMatch(NamedTuple):
+    passage: RulePassage
+    score: float
+    coverage: float  # 查询词项（按 idf 加权，语料中没有的词项按最高 idf 计）被该段落覆盖的比例
+    matched: int  # 该段落命中的查询词项数
+
+# 内置语料：战斗相关的核心规则，与 rules.py 的判定保持一致
+_BUILTIN_CORPUS: List[RulePassage] = [
+    RulePassage("成功等级", "技能检定投1d100，结果不高于技能值为常规成功，不高于技能值的一半为困难成功，不高于技能值的五分之一为极难成功，投出1为大成功。"),
+    RulePassage("大失败", "投出100为大失败；技能值低于50时，投出96到100都是大失败。"),
+    RulePassage("奖励骰与惩罚骰", "奖励骰和惩罚骰会额外投掷十位骰，奖励骰取较低的十位，惩罚骰取较高的十位。奖励骰和惩罚骰互相抵消。"),
+    RulePassage("闪避", "被近战攻击时可以选择闪避，用闪避技能与攻击者的格斗技能做对抗检定。攻击者的成功等级必须高于闪避者才能命中，平手时闪避成功。"),
+    RulePassage("反击", "被近战攻击时可以选择反击，用格斗技能与攻击者做对抗检定。平手时攻击方获胜；反击方成功等级更高时，反过来对攻击者造成伤害。"),
+    RulePassage("闪避与反击的区别", "闪避平手时算闪避成功，但不会造成伤害；反击平手时攻击方获胜，但反击成功可以对攻击者造成伤害。"),
+    RulePassage("枪械攻击", "枪械攻击使用射击技能，目标无法闪避或反击，射击检定成功即命中。"),
+    RulePassage("伤害加值", "伤害加值(DB)由力量STR加体型SIZ决定：64及以下为-2，65到84为-1，85到124为0，125到164为+1d4，165到204为+1d6。近战武器和徒手伤害要加上伤害加值。"),
+    RulePassage("极难成功与贯穿", "攻击取得极难成功或大成功时造成武器的最大伤害；贯穿武器（如刀、枪）还会额外再投一次伤害骰。"),
+    RulePassage("重伤", "一次受到不低于最大生命值一半的伤害即为重伤。"),
+    RulePassage("昏迷与死亡", "敌人生命值归零即死亡。调查员生命值归零时陷入昏迷；一次受到不低于最大生命值的伤害则直接死亡。"),
+    RulePassage("先攻", "每轮开始时决定行动顺序，敏捷DEX越高越先行动。"),
+    RulePassage("武器伤害", "徒手1d3+DB，手枪1d10，步枪2d6+4，霰弹枪4d6，猎刀1d4+2+DB，小刀1d4+DB，棍棒1d8+DB。"),
+]
+
+# ==================== 分词 ====================
+
+_STOP_CHARS = frozenset("我你他她它们的了吗呢吧啊呀是在有和与么什怎样个这那就都也还要会能可以请问")
+_WORD = re.compile(r"[a-z0-9]+|[一-鿿]")
+# 提问时常用但不表达内容的词，只从查询中去掉
+_QUERY_FILLERS = re.compile(r"规则|什么|怎么算|怎么|如何|多少|为什么|有没有|是不是")
+
+def tokenize(text: str) -> List[str]:
+    """中文字符一元/二元组 + 英文数字单词"""
+    units = _WORD.findall(text.lower())
+    tokens = [u for u in units if u not in _STOP_CHARS]
+    for a, b in zip(units, units[1:]):
+        if len(a) == 1 and len(b) == 1 and a not in _STOP_CHARS and b not in _STOP_CHARS:
+            tokens.append(a + b)
+    return tokens
+
+# ==================== BM25 索引 ====================
+
+class RulesIndex:
+    """BM25 倒排索引"""
+
+    def __init__(self, passages: List[RulePassage]):
+        self.passages = passages
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self.idf: Dict[str, float] = {}
+        self.avg_length = 0.0
+
+    def build(self) -> "RulesIndex":
+        self.postings = {}
+        self.doc_lengths = []
+        for doc_id, passage in enumerate(self.passages):
+            counts = Counter(tokenize(f"{passage.title} {passage.text}"))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+        n = len(self.passages)
+        self.avg_length = sum(self.doc_lengths) / n if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+        return self
+
+    def search(self, query: str, top_k: int = RULES_TOP_K) -> List[RuleMatch]:
+        """按 BM25 分数返回前 top_k 个段落"""
+        terms = set(tokenize(_QUERY_FILLERS.sub(" ", query)))
+        # 语料中没有的词项说明问题涉及语料以外的内容，按只出现在零个段落里的 idf 计入总权重
+        n = len(self.passages)
+        oov_idf = math.log(1 + (n + 0.5) / 0.5)
+        query_weight = sum(self.idf.get(t, oov_idf) for t in terms)
+        scores: Dict[int, float] = {}
+        covered: Dict[int, float] = {}
+        matched: Counter = Counter()
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = tf + _K1 * (1 - _B + _B * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_K1 + 1) / norm
+                covered[doc_id] = covered.get(doc_id, 0.0) + idf
+                matched[doc_id] += 1
+        ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        return [
+            RuleMatch(self.passages[d], scores[d], covered[d] / query_weight if query_weight else 0.0, matched[d])
+            for d in ranked
+        ]
+
+    def to_dict(self, fingerprint: str) -> Dict:
+        return {
+            "version": _INDEX_VERSION,
+            "fingerprint": fingerprint,
+            "passages": [list(p) for p in self.passages],
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+            "idf": self.idf,
+            "avg_length": self.avg_length,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RulesIndex":
+        index = cls([RulePassage(*p) for p in data["passages"]])
+        index.postings = {term: [tuple(p) for p in docs] for term, docs in data["postings"].items()}
+        index.doc_lengths = data["doc_lengths"]
+        index.idf = data["idf"]
+        index.avg_length = data["avg_length"]
+        return index
+
+# ==================== 语料加载与持久化 ====================
+
+def load_corpus(path: str) -> List[RulePassage]:
+    """读取规则语料：.jsonl 按行读取，其他文件按空行分段（首行作为标题）"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".jsonl"):
+        return [
+            RulePassage(record.get("title", ""), record["text"])
+            for record in (json.loads(line) for line in content.splitlines() if line.strip())
+        ]
+    passages = []
+    for block in re.split(r"\n\s*\n", content):
+        lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
+        if lines:
+            passages.append(RulePassage(lines[0].lstrip("# "), " ".join(lines[1:]) or lines[0]))
+    return passages
+
+def _fingerprint(passages: List[RulePassage]) -> str:
+    payload = json.dumps([list(p) for p in passages], ensure_ascii=False)
+    return hashlib.sha256(f"{_INDEX_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+def load_or_build_index(passages: List[RulePassage], path: Optional[str] = RULES_INDEX_PATH) -> RulesIndex:
+    """读取磁盘上的索引；不存在或语料已变化时重新构建并保存"""
+    fingerprint = _fingerprint(passages)
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("fingerprint") == fingerprint:
+                return RulesIndex.from_dict(data)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = RulesIndex(passages).build()
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(fingerprint), f, ensure_ascii=False)
+    return index
+
+_index: Optional[RulesIndex] = None
+
+def get_rules_index() -> RulesIndex:
+    """第一次使用时加载索引"""
+    global _index
+    if _index is None:
+        passages = list(_BUILTIN_CORPUS)
+        if RULES_CORPUS:
+            passages.extend(load_corpus(RULES_CORPUS))
+        _index = load_or_build_index(passages)
+    return _index
+
+# ==================== 对外接口 ====================
+
+class RulesLookup(NamedTuple):
+    matches: List[RuleMatch]
+    direct_answer: Optional[str]  # 置信度足够高时可以直接回复的规则原文
+
+def lookup_rules(question: str, top_k: int = RULES_TOP_K) -> RulesLookup:
+    """检索与问题相关的规则段落
+
+    Args:
+        question: 玩家的问题，可以带 "名字: " 前缀
+        top_k: 返回的段落数
+
+    Returns:
+        RulesLookup: 检索结果，以及可以直接使用的回答（如果有）
+    """
+    matches = get_rules_index().search(normalize_input(question), top_k)
+    if not matches:
+        return RulesLookup([], None)
+
+    best = matches[0]
+    # 没有第二名时无法判断领先程度，交给 LLM
+    if (len(matches) > 1
+            and best.coverage >= RULES_DIRECT_THRESHOLD
+            and best.matched >= RULES_DIRECT_MIN_TERMS
+            and best.score >= matches[1].score * _DIRECT_MARGIN):
+        return RulesLookup(matches, f"【{best.passage.title}】{best.passage.text}")
+    return RulesLookup(matches, None)
+
+def format_passages(matches: List[RuleMatch]) -> str:
+    """把检索结果整理成提示词中的规则片段"""
+    if not matches:
+        return "无"
+    return "\n".join(f"- 【{m.passage.title}】{m.passage.text}" for m in matches)
+
+# 示例用法
+if __name__ == "__main__":
+    for q in ["闪避的规则是什么？", "反击和闪避有什么区别", "伤害加值怎么算", "手枪能闪避吗", "我的HP还剩多少",
+              "我还有几发子弹", "我现在重伤了吗"]:
+        result = lookup_rules(q)
+        print(q, result.direct_answer, [(m.passage.title, round(m.score, 2), round(m.coverage, 2)) for m in result.matches])
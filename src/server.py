@@ -0,0 +1,469 @@
+# === src/server.py ===
+
+"""
+多会话战斗服务器
+
+基于 asyncio 的 HTTP / WebSocket 服务器（仅用标准库），在同一个编译好的 combat_workflow 上
+同时托管多场战斗，每个会话一个 thread_id。
+
+HTTP（请求和响应都是JSON；推进战斗的响应是逐行JSON流）:
+    GET    /health                    服务器状态
+    GET    /metrics                   Prometheus 文本格式的指标（见 telemetry）
+    POST   /sessions                  创建会话 {"participants": [...], "map": {...}}（都可省略，使用预设）
+    GET    /sessions/{id}             会话概况
+    POST   /sessions/{id}/advance     推进战斗 {"input": "..."}，逐行返回事件，直到需要输入或战斗结束
+    DELETE /sessions/{id}             结束会话
+
+WebSocket（/ws，每条消息一个JSON对象，"request_id" 会原样带回）:
+    {"op": "create", "participants": [...], "map": {...}}
+    {"op": "advance", "session_id": "...", "input": "..."}
+    {"op": "state", "session_id": "..."}
+    {"op": "close", "session_id": "..."}
+    服务器推送 {"type": 事件类型, "session_id": ..., "node": ..., "data": {...}}
+
+背压:
+- 同一会话同一时间只有一次推进在运行，排队的推进超过 SERVER_MAX_PENDING 时返回 429 / busy
+- 全局同时运行的工作流步数不超过 SERVER_MAX_CONCURRENT_STEPS，其余排队等待
+- 会话数达到 SERVER_MAX_SESSIONS 时拒绝创建（503），空闲超过 SERVER_SESSION_TTL 的会话自动清理
+- 输出逐条等待客户端读取（drain），慢客户端只拖慢自己的会话
+
+用法:
+    python -m src.server --host 127.0.0.1 --port 8765
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .combat_session import CombatSession, new_combat_state
+from .combat_stream import CombatEvent
+from .replay_llm import seed_rules_rng
+from .telemetry import render_prometheus
+
+# 加载环境变量
+load_dotenv()
+
+SERVER_MAX_SESSIONS = int(os.getenv("SERVER_MAX_SESSIONS", "200"))
+SERVER_MAX_PENDING = int(os.getenv("SERVER_MAX_PENDING", "1"))
+SERVER_MAX_CONCURRENT_STEPS = int(os.getenv("SERVER_MAX_CONCURRENT_STEPS", "16"))
+SERVER_SESSION_TTL = float(os.getenv("SERVER_SESSION_TTL", "3600"))
+
+# 请求体和 WebSocket 消息的大小上限
+_MAX_BODY = 256 * 1024
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class ServerError(Exception):
+    """返回给客户端的错误"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class SessionBusy(ServerError):
+    def __init__(self, session_id: str):
+        super().__init__(429, f"会话 {session_id} 正忙，请等待当前输入处理完成")
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+def _event_message(session_id: str, event: CombatEvent) -> Dict[str, Any]:
+    return {"session_id": session_id, **event.to_dict()}
+
+# ==================== 会话管理 ====================
+
+class SessionManager:
+    """管理所有战斗会话"""
+
+    def __init__(
+        self,
+        workflow: Any = None,
+        max_sessions: int = SERVER_MAX_SESSIONS,
+        max_pending: int = SERVER_MAX_PENDING,
+        max_concurrent_steps: int = SERVER_MAX_CONCURRENT_STEPS,
+        session_ttl: float = SERVER_SESSION_TTL,
+    ):
+        if workflow is None:
+            from .coc_keeper import combat_workflow
+
+            workflow = combat_workflow
+        self.workflow = workflow
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.session_ttl = session_ttl
+        self.step_slots = asyncio.Semaphore(max_concurrent_steps)
+        self.sessions: Dict[str, CombatSession] = {}
+
+    def create(self, participants: Optional[list] = None, combat_map: Optional[dict] = None) -> CombatSession:
+        if len(self.sessions) >= self.max_sessions:
+            raise ServerError(503, "会话数已达上限")
+        if participants is None or combat_map is None:
+            from .coc_keeper_demo import create_default_map, create_ghoul1, create_investigator1
+
+            participants = participants or [create_investigator1(), create_ghoul1()]
+            combat_map = combat_map or create_default_map()
+        if not isinstance(participants, list) or not participants:
+            raise ServerError(400, "participants 必须是非空列表")
+        session = CombatSession(new_combat_state(participants, combat_map), workflow=self.workflow)
+        self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id: Optional[str]) -> CombatSession:
+        session = self.sessions.get(session_id or "")
+        if session is None:
+            raise ServerError(404, f"会话 {session_id} 不存在")
+        return session
+
+    async def advance(self, session_id: Optional[str], player_input: str = ""):
+        """推进会话，产出事件；排队过多时抛出 SessionBusy"""
+        session = self.get(session_id)
+        # pending 包括正在运行的一次；检查和 session.advance 占位之间没有 await，不会被其他请求插入
+        if session.pending > self.max_pending:
+            raise SessionBusy(session.id)
+        async for event in session.advance(player_input, self.step_slots):
+            yield event
+
+    async def close(self, session_id: Optional[str]) -> None:
+        session = self.sessions.pop(self.get(session_id).id)
+        # 清理检查点，释放该会话占用的内存
+        delete_thread = getattr(getattr(self.workflow, "checkpointer", None), "adelete_thread", None)
+        if delete_thread is not None:
+            async with session.lock:
+                await delete_thread(session.thread_id)
+
+    async def reap_idle(self) -> int:
+        """清理空闲超时的会话"""
+        now = time.time()
+        expired = [
+            session.id for session in self.sessions.values()
+            if session.pending == 0 and now - session.last_active > self.session_ttl
+        ]
+        closed = 0
+        for session_id in expired:
+            try:
+                await self.close(session_id)
+            except ServerError:
+                # 等待会话锁期间已被客户端关闭
+                continue
+            closed += 1
+        return closed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.sessions),
+            "busy_sessions": sum(1 for session in self.sessions.values() if session.busy),
+            "max_sessions": self.max_sessions,
+        }
+
+# ==================== HTTP ====================
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """读取一个 HTTP 请求：(方法, 路径, 头部, 请求体)"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ServerError(400, "无效的请求行")
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", "0") or 0)
+    except ValueError:
+        raise ServerError(400, "无效的 Content-Length")
+    if length < 0:
+        raise ServerError(400, "无效的 Content-Length")
+    if length > _MAX_BODY:
+        raise ServerError(413, "请求体过大")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+def _write_head(writer: asyncio.StreamWriter, status: int, content_type: str, length: Optional[int] = None) -> None:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}", f"Content-Type: {content_type}; charset=utf-8",
+             "Connection: close", "Cache-Control: no-cache"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, data: Any) -> None:
+    body = _dumps(data).encode("utf-8")
+    _write_head(writer, status, "application/json", len(body))
+    writer.write(body)
+    await writer.drain()
+
+def _parse_body(body: bytes) -> Dict[str, Any]:
+    if not body:
+        return {}
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise ServerError(400, "请求体不是有效的JSON")
+    if not isinstance(data, dict):
+        raise ServerError(400, "请求体必须是JSON对象")
+    return data
+
+# ==================== WebSocket ====================
+
+class WebSocket:
+    """最小的 WebSocket 实现（RFC 6455）：文本消息、分片、ping/pong、关闭"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._send_lock = asyncio.Lock()
+
+    @staticmethod
+    def accept_key(key: str) -> str:
+        return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+
+    async def _send_frame(self, opcode: int, payload: bytes) -> None:
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        async with self._send_lock:
+            self.writer.write(header + payload)
+            await self.writer.drain()
+
+    async def send(self, data: Any) -> None:
+        await self._send_frame(0x1, _dumps(data).encode("utf-8"))
+
+    async def close(self, code: int = 1000) -> None:
+        try:
+            await self._send_frame(0x8, struct.pack("!H", code))
+        except ConnectionError:
+            pass
+
+    async def receive(self) -> Optional[str]:
+        """下一条文本消息；连接关闭时返回 None"""
+        message = b""
+        while True:
+            try:
+                first, second = await self.reader.readexactly(2)
+            except asyncio.IncompleteReadError:
+                return None
+            fin, opcode = first & 0x80, first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+            elif length == 127:
+                (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+            if len(message) + length > _MAX_BODY:
+                await self.close(1009)
+                return None
+            mask = await self.reader.readexactly(4) if second & 0x80 else b""
+            payload = await self.reader.readexactly(length)
+            if mask:
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+            if opcode == 0x8:
+                await self.close()
+                return None
+            if opcode == 0x9:
+                await self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            message += payload
+            if fin:
+                return message.decode("utf-8", errors="replace")
+
+# ==================== 服务器 ====================
+
+class CombatServer:
+    """HTTP / WebSocket 前端"""
+
+    def __init__(self, manager: Optional[SessionManager] = None):
+        self.manager = manager or SessionManager()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._reaper = asyncio.create_task(self._reap_loop())
+        return self._server
+
+    async def stop(self) -> None:
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _reap_loop(self) -> None:
+        interval = max(min(self.manager.session_ttl / 4, 60.0), 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            await self.manager.reap_idle()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await _read_request(reader)
+            if request is not None:
+                method, path, headers, body = request
+                if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._handle_websocket(reader, writer, headers)
+                else:
+                    await self._handle_http(writer, method, path, body)
+        except ServerError as e:
+            await _send_json(writer, e.status, {"error": e.message})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _handle_http(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes) -> None:
+        parts = [part for part in path.split("/") if part]
+        manager = self.manager
+
+        if parts == ["health"] and method == "GET":
+            await _send_json(writer, 200, {"status": "ok", **manager.stats()})
+        elif parts == ["metrics"] and method == "GET":
+            text = render_prometheus().encode("utf-8")
+            _write_head(writer, 200, "text/plain; version=0.0.4", len(text))
+            writer.write(text)
+            await writer.drain()
+        elif parts == ["sessions"] and method == "POST":
+            data = _parse_body(body)
+            session = manager.create(data.get("participants"), data.get("map"))
+            await _send_json(writer, 201, session.snapshot())
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "GET":
+            await _send_json(writer, 200, manager.get(parts[1]).snapshot())
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            await manager.close(parts[1])
+            await _send_json(writer, 200, {"session_id": parts[1], "closed": True})
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "advance" and method == "POST":
+            await self._stream_advance(writer, parts[1], str(_parse_body(body).get("input") or ""))
+        elif parts and parts[0] in ("health", "metrics", "sessions"):
+            raise ServerError(405, "不支持的请求方法")
+        else:
+            raise ServerError(404, "未知的路径")
+
+    async def _stream_advance(self, writer: asyncio.StreamWriter, session_id: str, player_input: str) -> None:
+        """以逐行JSON流返回推进战斗的事件"""
+        events = self.manager.advance(session_id, player_input)
+        try:
+            first = await events.__anext__()
+        except StopAsyncIteration:
+            first = None
+        # 第一个事件到达之前的错误（会话不存在、忙）仍然可以作为普通错误响应返回
+        _write_head(writer, 200, "application/x-ndjson")
+        try:
+            if first is not None:
+                writer.write((_dumps(_event_message(session_id, first)) + "\n").encode("utf-8"))
+                await writer.drain()
+            async for event in events:
+                writer.write((_dumps(_event_message(session_id, event)) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            raise
+        except Exception as e:
+            writer.write((_dumps({"session_id": session_id, "type": "error", "data": {"message": str(e)}}) + "\n").encode("utf-8"))
+            await writer.drain()
+        finally:
+            await events.aclose()
+
+    async def _handle_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict[str, str]) -> None:
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise ServerError(400, "缺少 Sec-WebSocket-Key")
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {WebSocket.accept_key(key)}\r\n\r\n"
+        ).encode("latin-1"))
+        await writer.drain()
+
+        socket = WebSocket(reader, writer)
+        tasks = set()
+        try:
+            while True:
+                text = await socket.receive()
+                if text is None:
+                    break
+                # 推进战斗在后台运行，同一个连接可以同时操作多个会话
+                task = asyncio.create_task(self._handle_ws_message(socket, text))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _handle_ws_message(self, socket: WebSocket, text: str) -> None:
+        request_id = None
+        try:
+            data = _parse_body(text.encode("utf-8"))
+            request_id = data.get("request_id")
+            reply: Callable[[Dict[str, Any]], Awaitable[None]] = (
+                lambda message: socket.send({**message, "request_id": request_id} if request_id is not None else message)
+            )
+            op = data.get("op")
+            manager = self.manager
+            if op == "create":
+                session = manager.create(data.get("participants"), data.get("map"))
+                await reply({"type": "session_created", "session_id": session.id, "data": session.snapshot()})
+            elif op == "advance":
+                async for event in manager.advance(data.get("session_id"), str(data.get("input") or "")):
+                    await reply(_event_message(data["session_id"], event))
+            elif op == "state":
+                session = manager.get(data.get("session_id"))
+                await reply({"type": "state", "session_id": session.id, "data": session.snapshot()})
+            elif op == "close":
+                await manager.close(data.get("session_id"))
+                await reply({"type": "session_closed", "session_id": data.get("session_id")})
+            else:
+                raise ServerError(400, f"未知的操作: {op}")
+        except ServerError as e:
+            await socket.send({"type": "error", "request_id": request_id, "data": {"status": e.status, "message": e.message}})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            await socket.send({"type": "error", "request_id": request_id, "data": {"status": 500, "message": str(e)}})
+
+async def serve(host: str = "127.0.0.1", port: int = 8765) -> None:
+    # 录制 / 回放时固定掷骰结果
+    seed_rules_rng()
+    server = CombatServer()
+    listener = await server.start(host, port)
+    print(f"🎲 战斗服务器已启动: http://{host}:{port}  (WebSocket: ws://{host}:{port}/ws)")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.stop()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CoC 多会话战斗服务器")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8765")))
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n👋 服务器已停止")
+
+if __name__ == "__main__":
+    main()
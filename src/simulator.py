@@ -0,0 +1,391 @@
+# === src/simulator.py ===
+
+"""
+无界面自动战斗模拟器
+
+不调用 LLM，用规则引擎和可替换的行动策略把一场战斗打到底，
+在进程池里重复成千上万次，统计胜率、回合数和伤害分布，用来平衡遭遇战。
+
+- 参与者沿用 types.Participant，先攻沿用 coc_keeper.roll_initiative（每轮重投，和工作流一致）
+- 攻击由 rules.resolve_attack 结算，防守方的闪避/反击按 rules.choose_defense 自动选择
+- 策略是普通函数：(行动者, 己方, 敌方, rng) -> Action 或 None（不行动）；
+  进程池按引用传递函数，自定义策略必须定义在模块顶层
+
+用法:
+    python -m src.simulator --investigators investigator1 --enemies ghoul1 --runs 20000
+    python -m src.simulator -i investigator1 investigator2 -e ghoul1 ghoul2 \\
+        --investigator-policy weakest --enemy-policy random --workers 8 --seed 1 --json report.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Union
+
+from dotenv import load_dotenv
+
+from .coc_keeper import roll_initiative
+from .rules import WEAPONS, _max_damage, apply_attack_outcome, resolve_attack
+from .tactics import fight_back_weapon
+from .types import Participant, ParticipantStatus
+
+# 加载环境变量
+load_dotenv()
+
+SIMULATOR_WORKERS = int(os.getenv("SIMULATOR_WORKERS", "0"))  # 0 表示 CPU 核数
+SIMULATOR_MAX_ROUNDS = int(os.getenv("SIMULATOR_MAX_ROUNDS", "30"))  # 超过后判平局
+
+SIDES = ("investigator", "enemy")
+DRAW = "draw"
+
+# 没有携带武器的敌人使用的天生攻击
+NATURAL_WEAPONS = ("爪击", "啃咬")
+
+# ==================== 策略 ====================
+
+class Action(NamedTuple):
+    target_id: str
+    weapon: Optional[str] = None
+
+Policy = Callable[[Participant, List[Participant], List[Participant], random.Random], Optional[Action]]
+
+@lru_cache(maxsize=None)
+def _weapon_max_damage(name: str) -> int:
+    return _max_damage(WEAPONS[name].damage, "0")
+
+def best_weapon(actor: Participant) -> Optional[str]:
+    """按 技能值 x 最大伤害 选出最好的武器；没有武器时敌人用天生攻击，调查员徒手"""
+    candidates = [item for item in actor["items"] if item in WEAPONS]
+    if not candidates and actor["type"] == "enemy":
+        candidates = list(NATURAL_WEAPONS)
+    if not candidates:
+        return None
+    stats = actor["stats"]
+    return max(candidates, key=lambda name: stats.get(WEAPONS[name].skill, 0) * _weapon_max_damage(name))
+
+def random_policy(actor: Participant, allies: List[Participant], enemies: List[Participant], rng: random.Random) -> Optional[Action]:
+    """随机攻击一个敌人"""
+    return Action(rng.choice(enemies)["id"], best_weapon(actor)) if enemies else None
+
+def weakest_policy(actor: Participant, allies: List[Participant], enemies: List[Participant], rng: random.Random) -> Optional[Action]:
+    """集火当前 HP 最低的敌人"""
+    if not enemies:
+        return None
+    return Action(min(enemies, key=lambda p: p["stats"].get("HP", 0))["id"], best_weapon(actor))
+
+def strongest_policy(actor: Participant, allies: List[Participant], enemies: List[Participant], rng: random.Random) -> Optional[Action]:
+    """优先攻击威胁最大（格斗/射击技能最高）的敌人"""
+    if not enemies:
+        return None
+    target = max(enemies, key=lambda p: max(p["stats"].get("fighting", 0), p["stats"].get("firearms", 0)))
+    return Action(target["id"], best_weapon(actor))
+
+POLICIES: Dict[str, Policy] = {
+    "random": random_policy,
+    "weakest": weakest_policy,
+    "strongest": strongest_policy,
+}
+
+def _resolve_policy(policy: Union[str, Policy]) -> Policy:
+    if callable(policy):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError(f"未知的策略: {policy}（可用: {', '.join(POLICIES)}）")
+    return POLICIES[policy]
+
+# ==================== 单场战斗 ====================
+
+@dataclass
+class FightResult:
+    winner: str  # "investigator"、"enemy" 或 "draw"
+    rounds: int
+    damage_dealt: Dict[str, int]
+    damage_taken: Dict[str, int]
+    final_status: Dict[str, ParticipantStatus]
+
+def simulate_fight(
+    participants: List[Participant],
+    policies: Dict[str, Policy],
+    rng: random.Random,
+    max_rounds: int = SIMULATOR_MAX_ROUNDS,
+) -> FightResult:
+    """模拟一场战斗
+
+    Args:
+        participants: 参与者（不会被修改）
+        policies: 阵营 -> 策略
+        rng: 结算攻击用的随机数生成器（先攻使用 random 模块，和工作流一致）
+        max_rounds: 回合上限，超过后判平局
+    """
+    dealt = {p["id"]: 0 for p in participants}
+    taken = {p["id"]: 0 for p in participants}
+    state: Dict[str, Any] = {"participants": participants}
+    winner = DRAW
+    rounds = 0
+
+    while rounds < max_rounds and winner == DRAW:
+        rounds += 1
+        for actor_id in roll_initiative(state)["initiative_order"]:  # type: ignore[arg-type]
+            participants = state["participants"]
+            actor = next(p for p in participants if p["id"] == actor_id)
+            if actor["status"] != ParticipantStatus.ACTIVE:
+                continue
+            allies = [p for p in participants if p["type"] == actor["type"] and p["status"] == ParticipantStatus.ACTIVE]
+            enemies = [p for p in participants if p["type"] != actor["type"] and p["status"] == ParticipantStatus.ACTIVE]
+            action = policies[actor["type"]](actor, allies, enemies, rng)
+            target = next((p for p in enemies if action is not None and p["id"] == action.target_id), None)
+            if target is None:
+                continue
+
+            outcome = resolve_attack(actor, target, action.weapon, None, rng, fight_back_weapon(target))
+            if outcome.hit and outcome.damage_target_id is not None:
+                # 反击成功时是防守方造成伤害
+                dealer = target["id"] if outcome.damage_target_id == actor["id"] else actor["id"]
+                dealt[dealer] += outcome.damage
+                taken[outcome.damage_target_id] += outcome.damage
+                state["participants"] = apply_attack_outcome(participants, outcome)
+                # 只有受伤的一方可能全部倒下
+                victim_side = actor["type"] if outcome.damage_target_id == actor["id"] else target["type"]
+                if _side_defeated(state["participants"], victim_side):
+                    winner = "investigator" if victim_side == "enemy" else "enemy"
+                    break
+
+    return FightResult(
+        winner=winner,
+        rounds=rounds,
+        damage_dealt=dealt,
+        damage_taken=taken,
+        final_status={p["id"]: p["status"] for p in state["participants"]},
+    )
+
+def _side_defeated(participants: List[Participant], side: str) -> bool:
+    return not any(p["type"] == side and p["status"] == ParticipantStatus.ACTIVE for p in participants)
+
+# ==================== 统计 ====================
+
+@dataclass
+class SimulationReport:
+    """多场战斗的汇总；各字段都是计数，可以直接相加合并"""
+
+    runs: int = 0
+    outcomes: Counter = field(default_factory=Counter)  # 胜方 -> 场数
+    rounds: Counter = field(default_factory=Counter)  # 回合数 -> 场数
+    damage_dealt: Dict[str, Counter] = field(default_factory=dict)  # 参与者 -> {伤害: 场数}
+    damage_taken: Dict[str, Counter] = field(default_factory=dict)
+    downed: Counter = field(default_factory=Counter)  # 参与者 -> 战斗结束时倒下的场数
+    deaths: Counter = field(default_factory=Counter)  # 参与者 -> 死亡场数
+    names: Dict[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    def add(self, result: FightResult) -> None:
+        self.runs += 1
+        self.outcomes[result.winner] += 1
+        self.rounds[result.rounds] += 1
+        for pid, damage in result.damage_dealt.items():
+            self.damage_dealt.setdefault(pid, Counter())[damage] += 1
+        for pid, damage in result.damage_taken.items():
+            self.damage_taken.setdefault(pid, Counter())[damage] += 1
+        for pid, status in result.final_status.items():
+            if status != ParticipantStatus.ACTIVE:
+                self.downed[pid] += 1
+            if status == ParticipantStatus.DEAD:
+                self.deaths[pid] += 1
+
+    def merge(self, other: "SimulationReport") -> None:
+        self.runs += other.runs
+        self.outcomes.update(other.outcomes)
+        self.rounds.update(other.rounds)
+        for target, source in ((self.damage_dealt, other.damage_dealt), (self.damage_taken, other.damage_taken)):
+            for pid, histogram in source.items():
+                target.setdefault(pid, Counter()).update(histogram)
+        self.downed.update(other.downed)
+        self.deaths.update(other.deaths)
+        self.names.update(other.names)
+
+    def win_rate(self, side: str) -> float:
+        return self.outcomes[side] / self.runs if self.runs else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "win_rates": {side: self.win_rate(side) for side in (*SIDES, DRAW)},
+            "rounds": {**_summarize(self.rounds), "histogram": _histogram(self.rounds)},
+            "participants": {
+                pid: {
+                    "name": self.names.get(pid, pid),
+                    "downed_rate": self.downed[pid] / self.runs if self.runs else 0.0,
+                    "death_rate": self.deaths[pid] / self.runs if self.runs else 0.0,
+                    "damage_dealt": {**_summarize(self.damage_dealt[pid]), "histogram": _histogram(self.damage_dealt[pid])},
+                    "damage_taken": {**_summarize(self.damage_taken[pid]), "histogram": _histogram(self.damage_taken[pid])},
+                }
+                for pid in self.damage_dealt
+            },
+        }
+
+    def format_text(self) -> str:
+        lines = [f"模拟 {self.runs} 场，用时 {self.elapsed:.1f}s"]
+        lines.append("胜率: " + "  ".join(f"{side} {self.win_rate(side):6.1%}" for side in (*SIDES, DRAW)))
+        rounds = _summarize(self.rounds)
+        lines.append(f"回合数: 平均 {rounds['mean']:.2f}  中位数 {rounds['p50']}  p90 {rounds['p90']}  最多 {rounds['max']}")
+        lines.append(f"{'参与者':14s} {'倒下率':>7s} {'死亡率':>7s} {'造成伤害(均值/p90)':>18s} {'受到伤害(均值/p90)':>18s}")
+        for pid in self.damage_dealt:
+            dealt, taken = _summarize(self.damage_dealt[pid]), _summarize(self.damage_taken[pid])
+            lines.append(
+                f"{self.names.get(pid, pid):14s} {self.downed[pid] / self.runs:7.1%} {self.deaths[pid] / self.runs:7.1%} "
+                f"{dealt['mean']:12.2f} / {dealt['p90']:<4d} {taken['mean']:12.2f} / {taken['p90']:<4d}"
+            )
+        return "\n".join(lines)
+
+def _quantile(histogram: Counter, q: float) -> int:
+    total = sum(histogram.values())
+    threshold = q * total
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen >= threshold:
+            return value
+    return 0
+
+def _summarize(histogram: Counter) -> Dict[str, Any]:
+    total = sum(histogram.values())
+    if not total:
+        return {"mean": 0.0, "p50": 0, "p90": 0, "max": 0}
+    return {
+        "mean": sum(value * count for value, count in histogram.items()) / total,
+        "p50": _quantile(histogram, 0.5),
+        "p90": _quantile(histogram, 0.9),
+        "max": max(histogram),
+    }
+
+def _histogram(histogram: Counter) -> Dict[str, int]:
+    return {str(value): histogram[value] for value in sorted(histogram)}
+
+# ==================== 批量运行 ====================
+
+def _run_chunk(
+    participants: List[Participant],
+    policies: Dict[str, Union[str, Policy]],
+    runs: int,
+    seed: Optional[int],
+    max_rounds: int,
+) -> SimulationReport:
+    """在当前进程里连续模拟 runs 场"""
+    rng = random.Random(seed)
+    if seed is not None:
+        # 先攻使用 random 模块
+        random.seed(seed)
+    resolved = {side: _resolve_policy(policy) for side, policy in policies.items()}
+    report = SimulationReport(names={p["id"]: p["name"] for p in participants})
+    for _ in range(runs):
+        report.add(simulate_fight(participants, resolved, rng, max_rounds))
+    return report
+
+def run_simulation(
+    participants: List[Participant],
+    runs: int = 10000,
+    investigator_policy: Union[str, Policy] = "random",
+    enemy_policy: Union[str, Policy] = "random",
+    workers: int = SIMULATOR_WORKERS,
+    seed: Optional[int] = None,
+    max_rounds: int = SIMULATOR_MAX_ROUNDS,
+    chunks_per_worker: int = 4,
+) -> SimulationReport:
+    """把 runs 场战斗分块分给进程池，合并各块的统计
+
+    Args:
+        participants: 双方参与者
+        runs: 模拟场数
+        investigator_policy / enemy_policy: 策略名（见 POLICIES）或模块顶层的策略函数
+        workers: 进程数，0 为 CPU 核数，1 为在当前进程里运行
+        seed: 随机种子；同样的种子、场数和进程数得到同样的结果
+        max_rounds: 回合上限
+        chunks_per_worker: 每个进程分到的块数，块越多负载越均衡
+    """
+    policies = {"investigator": investigator_policy, "enemy": enemy_policy}
+    for policy in policies.values():
+        _resolve_policy(policy)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+
+    if workers == 1 or runs < workers * 2:
+        report = _run_chunk(participants, policies, runs, seed, max_rounds)
+    else:
+        chunk_count = min(runs, workers * chunks_per_worker)
+        sizes = [runs // chunk_count + (1 if i < runs % chunk_count else 0) for i in range(chunk_count)]
+        seeds = [None if seed is None else seed * 1_000_003 + i for i in range(chunk_count)]
+        report = SimulationReport(names={p["id"]: p["name"] for p in participants})
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_run_chunk, participants, policies, size, chunk_seed, max_rounds)
+                for size, chunk_seed in zip(sizes, seeds)
+            ]
+            for future in futures:
+                report.merge(future.result())
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+# ==================== 命令行 ====================
+
+def build_roster(names: Sequence[str], presets: Dict[str, Callable[[], Participant]]) -> List[Participant]:
+    """按预设名创建参与者，同一预设出现多次时加序号区分"""
+    roster: List[Participant] = []
+    seen: Counter = Counter()
+    for name in names:
+        if name not in presets:
+            raise ValueError(f"未知的预设: {name}（可用: {', '.join(presets)}）")
+        participant = copy.deepcopy(presets[name]())
+        seen[participant["id"]] += 1
+        count = seen[participant["id"]]
+        if count > 1:
+            participant["id"] = f"{participant['id']}#{count}"
+            participant["name"] = f"{participant['name']}#{count}"
+        roster.append(participant)
+    return roster
+
+def _presets() -> Dict[str, Callable[[], Participant]]:
+    from . import coc_keeper_demo as demo
+    return {
+        "investigator1": demo.create_investigator1,
+        "investigator2": demo.create_investigator2,
+        "ghoul1": demo.create_ghoul1,
+        "ghoul2": demo.create_ghoul2,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="无界面自动战斗模拟")
+    parser.add_argument("-i", "--investigators", nargs="+", default=["investigator1"], help="调查员预设")
+    parser.add_argument("-e", "--enemies", nargs="+", default=["ghoul1"], help="敌人预设")
+    parser.add_argument("--runs", type=int, default=10000, help="模拟场数")
+    parser.add_argument("--investigator-policy", default="random", choices=list(POLICIES))
+    parser.add_argument("--enemy-policy", default="random", choices=list(POLICIES))
+    parser.add_argument("--workers", type=int, default=SIMULATOR_WORKERS, help="进程数（0为CPU核数）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--max-rounds", type=int, default=SIMULATOR_MAX_ROUNDS, help="回合上限")
+    parser.add_argument("--json", default=None, help="把完整报告（含分布）写入该文件")
+    args = parser.parse_args()
+
+    presets = _presets()
+    participants = build_roster(args.investigators, presets) + build_roster(args.enemies, presets)
+    report = run_simulation(
+        participants, args.runs, args.investigator_policy, args.enemy_policy,
+        workers=args.workers, seed=args.seed, max_rounds=args.max_rounds,
+    )
+    print(report.format_text())
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"报告已写入 {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
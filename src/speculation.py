@@ -0,0 +1,131 @@
+# === src/speculation.py ===
+
+"""
+推测执行
+
+本地分类器认为输入像是直接行动、但置信度不足以跳过LLM分类时，
+让 LLM 意图分类和行动解析同时开始：
+- 分类结果确认是直接行动：直接采用已经（或即将）完成的行动结果，省掉一次串行的LLM延迟
+- 分类结果不同：取消推测任务，丢弃结果（它的掷骰事件也不会发出，见 combat_stream）
+
+命中率、浪费的 token 和节省的时间记录在 speculation_stats 中。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import get_usage_metadata_callback
+
+# 加载环境变量
+load_dotenv()
+
+# 默认关闭：未命中时推测执行的LLM调用会白白消耗 token
+SPECULATIVE_ACTION = os.getenv("SPECULATIVE_ACTION", "false").lower() == "true"
+# 本地分类器猜测为直接行动的置信度不低于该值时才推测执行
+SPECULATION_MIN_CONFIDENCE = float(os.getenv("SPECULATION_MIN_CONFIDENCE", "0.5"))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+class SpeculationStats:
+    """推测执行的统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.attempts = 0
+            self.hits = 0
+            self.misses = 0
+            self.used_tokens = 0  # 命中时采用的推测调用消耗的 token
+            self.wasted_tokens = 0  # 未命中时丢弃的推测调用消耗的 token（只统计已完成的LLM调用）
+            self.saved_seconds = 0.0  # 命中时推测任务与分类重叠的时间
+
+    def record(self, hit: bool, tokens: int, overlap: float = 0.0) -> None:
+        with self._lock:
+            self.attempts += 1
+            if hit:
+                self.hits += 1
+                self.used_tokens += tokens
+                self.saved_seconds += overlap
+            else:
+                self.misses += 1
+                self.wasted_tokens += tokens
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.attempts if self.attempts else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / self.attempts, 4) if self.attempts else 0.0,
+                "used_tokens": self.used_tokens,
+                "wasted_tokens": self.wasted_tokens,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+speculation_stats = SpeculationStats()
+
+def get_speculation_stats() -> Dict[str, Any]:
+    """推测执行的命中率和 token 统计"""
+    return speculation_stats.to_dict()
+
+def _total_tokens(usage: Dict[str, Any]) -> int:
+    return sum(item.get("total_tokens", 0) for item in usage.values())
+
+async def speculate(
+    decide: Awaitable[T],
+    speculative: Callable[[], Awaitable[R]],
+    accept: Callable[[T], bool],
+) -> Tuple[T, Optional[R]]:
+    """在等待决定的同时推测执行
+
+    Args:
+        decide: 决定是否需要推测结果的协程（如意图分类）
+        speculative: 创建推测任务的函数（如行动解析）
+        accept: 根据决定判断是否采用推测结果
+
+    Returns:
+        (决定, 推测结果)；未采用时推测结果为 None
+    """
+    # 在独立的用量回调中启动推测任务，只统计它自己的 token
+    with get_usage_metadata_callback() as usage:
+        task = asyncio.ensure_future(speculative())
+    started = time.perf_counter()
+    finished: Dict[str, float] = {}
+    task.add_done_callback(lambda _: finished.setdefault("at", time.perf_counter()))
+
+    try:
+        decision = await decide
+    except BaseException:
+        task.cancel()
+        raise
+    decided = time.perf_counter()
+
+    if not accept(decision):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # 推测结果不会被使用，它的错误也无关紧要
+            pass
+        speculation_stats.record(False, _total_tokens(usage.usage_metadata))
+        return decision, None
+
+    result = await task
+    # 推测任务与分类重叠运行的时间就是省下的延迟
+    overlap = min(decided, finished.get("at", decided)) - started
+    speculation_stats.record(True, _total_tokens(usage.usage_metadata), overlap)
+    return decision, result
@@ -0,0 +1,341 @@
+# === src/structured_output.py ===
+
+"""
+结构化输出
+
+玩家行动和怪物AI智能体的结果用 pydantic 模型描述：
+- 模型通过 submit_tool 作为一个 return_direct 的工具绑定到 AgentExecutor，
+  提供方按 JSON Schema 原生生成工具调用参数，工具直接把参数作为最终输出返回
+- 模型仍然用文本回复时，extract_json 一次扫描提取第一个 JSON 值：跳过代码块标记和前后的说明文字，
+  修正尾随逗号、单引号和中文引号、Python 的 True/False/None、注释，补齐被截断的括号
+- 提取或校验仍然失败时才进行有限次数的修复重试（STRUCTURED_OUTPUT_REPAIR_RETRIES），
+  把错误和 JSON Schema 交给模型重新输出
+
+每个智能体的解析结果（直接解析、容错恢复、修复成功、失败）计入 structured_output_stats。
+"""
+
+import json
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Type, TypeVar
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+# 加载环境变量
+load_dotenv()
+
+STRUCTURED_OUTPUT_REPAIR_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_REPAIR_RETRIES", "1"))
+
+# 提交结构化结果的工具名，提示词里要求模型最后调用它
+SUBMIT_TOOL_NAME = "submit_result"
+
+M = TypeVar("M", bound=BaseModel)
+
+# ==================== 结果模型 ====================
+
+class ParticipantDelta(BaseModel):
+    """参与者的增量更新，字段含义见 rules.apply_participant_deltas；未知字段保留，由合并时拒绝"""
+
+    model_config = ConfigDict(extra="allow")
+
+    id: str = Field(description="角色id")
+    HP: Optional[int] = Field(default=None, description="HP增减量")
+    SAN: Optional[int] = Field(default=None, description="SAN增减量")
+    status: Optional[str] = Field(default=None, description="新的状态，如 unconscious、dead、fled")
+    location: Optional[str] = Field(default=None, description="新的区域名")
+    add_effects: Optional[List[str]] = None
+    remove_effects: Optional[List[str]] = None
+    add_items: Optional[List[str]] = None
+    remove_items: Optional[List[str]] = None
+
+def _normalize_type(value: Any, allowed: tuple) -> Any:
+    """未知的行动类型按 other 处理，而不是让整个结果校验失败"""
+    if isinstance(value, str):
+        value = value.strip().lower()
+    return value if value in allowed else "other"
+
+def _as_list(value: Any) -> Any:
+    """result 字段偶尔被写成说明文字或单个对象"""
+    if isinstance(value, dict):
+        return [value]
+    return value if isinstance(value, list) else []
+
+class MonsterAction(BaseModel):
+    type: Literal["attack", "other"] = Field(default="other", description="attack 或 other")
+    target: Optional[str] = Field(default=None, description="攻击目标的id")
+    weapon: Optional[str] = Field(default=None, description="使用的武器，如爪击、啃咬、徒手")
+
+    @field_validator("type", mode="before")
+    @classmethod
+    def _type(cls, value: Any) -> Any:
+        return _normalize_type(value, ("attack", "other"))
+
+class MonsterActionResult(BaseModel):
+    """怪物AI的决策"""
+
+    description: str = Field(default="", description="行动意图(具体做了什么)")
+    action: Optional[MonsterAction] = None
+    result: List[ParticipantDelta] = Field(default_factory=list, description="仅当action.type为other时，参与者的变化量")
+    requiresPlayerInput: bool = Field(default=False, description="是否需要玩家补充信息")
+    temp_player_actor: Optional[str] = Field(default=None, description="需要补充信息的玩家的名字")
+
+    @field_validator("result", mode="before")
+    @classmethod
+    def _result(cls, value: Any) -> Any:
+        return _as_list(value)
+
+class PlayerAction(BaseModel):
+    type: Literal["attack", "dodge", "fight_back", "other"] = Field(default="other", description="attack、dodge、fight_back 或 other")
+    target: Optional[str] = Field(default=None, description="攻击目标的id")
+    weapon: Optional[str] = Field(default=None, description="使用的武器，如手枪、猎刀、徒手")
+
+    @field_validator("type", mode="before")
+    @classmethod
+    def _type(cls, value: Any) -> Any:
+        return _normalize_type(value, ("attack", "dodge", "fight_back", "other"))
+
+class PlayerActionResult(BaseModel):
+    """玩家行动的合法性判断和意图"""
+
+    isValid: bool = Field(description="输入是否合法")
+    description: str = Field(default="", description="不合法的原因，或者合法的行动意图(具体做了什么)")
+    action: Optional[PlayerAction] = None
+    result: List[ParticipantDelta] = Field(default_factory=list, description="仅当action.type为other时，参与者的变化量")
+    requiresPlayerInput: bool = Field(default=False, description="是否需要玩家补充信息")
+    temp_player_actor: Optional[str] = Field(default=None, description="需要补充信息的玩家名")
+
+    @field_validator("result", mode="before")
+    @classmethod
+    def _result(cls, value: Any) -> Any:
+        return _as_list(value)
+
+def submit_tool(schema: Type[BaseModel]) -> Any:
+    """把结果模型包装成 return_direct 工具：调用参数按 Schema 校验后原样作为最终输出"""
+    from langchain_core.tools import StructuredTool
+
+    def submit(**kwargs: Any) -> str:
+        # 嵌套字段已被转换成模型实例，重新按结果模型序列化
+        return json.dumps(schema(**kwargs).model_dump(mode="json", exclude_none=True), ensure_ascii=False)
+
+    return StructuredTool.from_function(
+        func=submit,
+        name=SUBMIT_TOOL_NAME,
+        description=f"提交最终的结构化结果（{schema.__doc__ or schema.__name__}）。完成所有掷骰后调用一次。",
+        args_schema=schema,
+        return_direct=True,
+    )
+
+# ==================== 容错提取 ====================
+
+# 字符串的开引号 -> 能结束它的引号；ASCII 引号开头的字符串里，中文引号只是普通字符
+_STRING_CLOSERS = {'"': '"', "'": "'", "“": '”"', "‘": "’'"}
+_LITERALS = {"True": "true", "False": "false", "None": "null", "true": "true", "false": "false", "null": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+def extract_json(text: str) -> Any:
+    """提取文本中的第一个 JSON 对象或数组
+
+    整段就是合法 JSON 时直接解析；否则一次扫描，顺带修正常见的小错误。
+
+    Raises:
+        ValueError: 找不到 JSON，或修正后仍然无法解析
+    """
+    try:
+        parsed = json.loads(text, strict=False)
+        if isinstance(parsed, (dict, list)):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+    start = next((i for i, ch in enumerate(text) if ch in "{["), -1)
+    if start < 0:
+        raise ValueError("回复中没有JSON")
+
+    out: List[str] = []
+    stack: List[str] = []
+    quote: Optional[str] = None  # 当前字符串的开引号
+    i, n = start, len(text)
+    while i < n:
+        ch = text[i]
+        if quote is not None:
+            if ch == "\\" and i + 1 < n:
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch in _STRING_CLOSERS[quote]:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')  # 单引号或中文引号字符串里的双引号
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in _STRING_CLOSERS:
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+        elif ch.isdigit() or ch == "-":
+            end = i + 1
+            while end < n and text[end] in "0123456789.eE+-":
+                end += 1
+            out.append(text[i:end])
+            i = end
+            continue
+        elif ch == "/" and text.startswith("//", i):
+            newline = text.find("\n", i)
+            i = n if newline < 0 else newline
+            continue
+        elif ch.isalpha() or ch == "_":
+            end = i
+            while end < n and (text[end].isalnum() or text[end] == "_"):
+                end += 1
+            word = text[i:end]
+            # 未加引号的键名补上引号
+            out.append(_LITERALS.get(word, f'"{word}"'))
+            i = end
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 被截断的回复：补齐字符串和括号
+    if quote is not None:
+        out.append('"')
+    if stack:
+        _drop_trailing_comma(out)
+        out.extend(reversed(stack))
+
+    candidate = "".join(out)
+    try:
+        return json.loads(candidate, strict=False)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON无法解析: {e.msg}（第{e.pos}个字符）") from e
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    for j in range(len(out) - 1, -1, -1):
+        if out[j].isspace():
+            continue
+        if out[j] == ",":
+            del out[j]
+        return
+
+# ==================== 解析与修复 ====================
+
+class StructuredOutputStats:
+    """每个智能体的解析结果计数"""
+
+    _FIELDS = ("parsed", "recovered", "repaired", "failures")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, agent: str, outcome: str) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(agent, dict.fromkeys(self._FIELDS, 0))
+            counts[outcome] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {agent: dict(counts) for agent, counts in self._counts.items()}
+
+structured_output_stats = StructuredOutputStats()
+
+def get_structured_output_stats() -> Dict[str, Dict[str, int]]:
+    """每个智能体的 parsed（直接解析）、recovered（容错提取）、repaired（修复重试成功）、failures（放弃）次数"""
+    return structured_output_stats.to_dict()
+
+def _validate(output: str, schema: Type[M]) -> M:
+    """提取 JSON 后按结果模型校验；提取或校验失败抛出 ValueError"""
+    data = extract_json(output)
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        raise ValueError(f"结果不符合Schema: {e.errors()[0]['loc']} {e.errors()[0]['msg']}") from e
+
+def _is_strict_json(output: str) -> bool:
+    try:
+        json.loads(output)
+        return True
+    except (json.JSONDecodeError, TypeError):
+        return False
+
+async def parse_structured_output(
+    agent: str,
+    output: str,
+    schema: Type[M],
+    repair: Optional[Callable[[str, str], Awaitable[str]]] = None,
+    retries: int = STRUCTURED_OUTPUT_REPAIR_RETRIES,
+) -> Optional[M]:
+    """把智能体的回复解析成结果模型
+
+    Args:
+        agent: 智能体名，用于计数
+        output: 模型回复（工具调用的参数 JSON 或文本）
+        schema: 结果模型
+        repair: 修复函数 (上一次回复, 错误说明) -> 新回复；为空时不重试
+        retries: 最多修复几次
+
+    Returns:
+        结果模型；全部失败时返回 None
+    """
+    try:
+        result = _validate(output, schema)
+        structured_output_stats.record(agent, "parsed" if _is_strict_json(output) else "recovered")
+        return result
+    except ValueError as e:
+        error = str(e)
+
+    if repair is not None:
+        for _ in range(retries):
+            output = await repair(output, error)
+            try:
+                result = _validate(output, schema)
+                structured_output_stats.record(agent, "repaired")
+                return result
+            except ValueError as e:
+                error = str(e)
+
+    structured_output_stats.record(agent, "failures")
+    return None
+
+def repair_prompt(output: str, error: str, schema: Type[BaseModel]) -> str:
+    """修复重试的提示词"""
+    return (
+        f"你上一次的回复无法解析：{error}\n"
+        f"上一次的回复：\n{output[:2000]}\n\n"
+        "请保持原来的意图，严格按照下面的 JSON Schema 重新输出结果，只输出一个JSON对象，不要任何其他内容：\n"
+        f"{json.dumps(schema.model_json_schema(), ensure_ascii=False)}"
+    )
+
+# 回归样例：(模型回复, 期望提取出的值)
+_EXTRACT_CASES = [
+    ('{"description": "食尸鬼低吼“你逃不掉”，扑了上来"}', {"description": "食尸鬼低吼“你逃不掉”，扑了上来"}),
+    ('好的：{"description": "他喊道“快跑”", "result": [],}', {"description": "他喊道“快跑”", "result": []}),
+    ('{“description”: “中文引号”, "isValid": True}', {"description": "中文引号", "isValid": True}),
+    ("```json\n{'isValid': False, 'description': '他说\"走\"'}\n```", {"isValid": False, "description": '他说"走"'}),
+    ('{"action": {"type": "attack", "target": "inv1"', {"action": {"type": "attack", "target": "inv1"}}),
+]
+
+if __name__ == "__main__":
+    for text, expected in _EXTRACT_CASES:
+        result = extract_json(text)
+        assert result == expected, f"{text!r}: {result!r}"
+    print(f"{len(_EXTRACT_CASES)} 个提取样例全部通过")
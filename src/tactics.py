@@ -0,0 +1,224 @@
+# === src/tactics.py ===
+
+"""
+怪物战术引擎
+
+按怪物类型的战术配置，根据属性、状态、效果和地图直接决定怪物的行动，
+不调用 LLM。只有标记为 intelligent 的怪物（类型配置或参与者自身的 "intelligent" 字段）
+仍交给 monster_ai_agent 的 LLM 决策；其余怪物的叙述由守秘人叙述智能体统一完成。
+
+每种怪物的战术包括：
+- target: 目标选择方式（nearest / weakest / strongest / random，或 register_target_selector 注册的名字）
+- weapons: 首选的攻击方式，空时从携带的武器中选
+- flee_below: HP 比例低于该值时逃跑（0 为死战到底）
+- defense: 被近战攻击时的应对（auto 按技能高低 / dodge / fight_back）
+
+近战只能攻击同一区域的目标；目标在别的区域时沿 MapIndex 的最短路径移动一步，
+不可达时原地等待。枪械可以攻击任何连通区域里的目标。
+
+怪物类型取参与者的 "monster_type" 字段，没有时取 id 的前缀（ghoul_1 -> ghoul）。
+MONSTER_TACTICS_PATH 指向的 JSON 文件可以覆盖或新增类型：{"ghoul": {"flee_below": 0.2}, ...}
+"""
+
+import json
+import os
+import random
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .map_index import get_map_index
+from .participant_store import is_down
+from .rules import DEFENSE_DODGE, DEFENSE_FIGHT_BACK, WEAPONS, _max_damage, get_weapon
+from .types import Map, Participant, ParticipantStatus
+
+# 加载环境变量
+load_dotenv()
+
+MONSTER_TACTICS = os.getenv("MONSTER_TACTICS", "true").lower() == "true"
+MONSTER_TACTICS_PATH = os.getenv("MONSTER_TACTICS_PATH", "")
+
+# 行动类型
+ATTACK = "attack"
+MOVE = "move"
+FLEE = "flee"
+WAIT = "wait"
+
+DEFENSE_AUTO = "auto"
+
+@dataclass(frozen=True)
+class MonsterTactics:
+    target: str = "nearest"
+    weapons: Tuple[str, ...] = ()
+    flee_below: float = 0.0
+    defense: str = DEFENSE_AUTO
+    intelligent: bool = False
+
+# 内置的怪物类型；"default" 用于没有配置的类型
+TACTICS: Dict[str, MonsterTactics] = {
+    # 食尸鬼：没有智慧，扑向最近的猎物，被围攻也不退，近战时倾向反击
+    "ghoul": MonsterTactics(target="nearest", weapons=("爪击", "啃咬"), defense=DEFENSE_FIGHT_BACK),
+    # 深潜者：集火受伤最重的调查员，重伤时退回水中
+    "deep_one": MonsterTactics(target="weakest", weapons=("爪击",), flee_below=0.25),
+    # 邪教徒：会谈判、施法、利用地形，交给 LLM
+    "cultist": MonsterTactics(target="weakest", flee_below=0.3, intelligent=True),
+    "default": MonsterTactics(target="nearest", flee_below=0.2),
+}
+
+class TacticalDecision(NamedTuple):
+    kind: str  # attack / move / flee / wait
+    target_id: Optional[str] = None
+    weapon: Optional[str] = None
+    description: str = ""
+    zone: Optional[str] = None  # move 的下一个区域
+
+# ==================== 目标选择 ====================
+
+TargetSelector = Callable[[Participant, List[Participant], Optional[Map], random.Random], Participant]
+
+_FAR = 1_000_000
+
+def zone_distance(combat_map: Optional[Map], start: Optional[str], goal: Optional[str]) -> int:
+    """两个区域之间的步数；没有地图或位置时视为同一区域，不连通时返回一个很大的数"""
+    if not combat_map or not start or not goal or start == goal:
+        return 0
+    distance = get_map_index(combat_map).distance(start, goal)  # type: ignore[union-attr]
+    return _FAR if distance is None else distance
+
+def _hp(participant: Participant) -> int:
+    return participant["stats"].get("HP", 0)
+
+def _wounded(participant: Participant) -> bool:
+    return "重伤" in participant["effects"]
+
+def _nearest(actor: Participant, candidates: List[Participant], combat_map: Optional[Map], rng: random.Random) -> Participant:
+    # 距离相同时挑受伤的、HP低的
+    return min(candidates, key=lambda p: (
+        zone_distance(combat_map, actor.get("location"), p.get("location")), not _wounded(p), _hp(p),
+    ))
+
+def _weakest(actor: Participant, candidates: List[Participant], combat_map: Optional[Map], rng: random.Random) -> Participant:
+    return min(candidates, key=lambda p: (not _wounded(p), _hp(p)))
+
+def _strongest(actor: Participant, candidates: List[Participant], combat_map: Optional[Map], rng: random.Random) -> Participant:
+    return max(candidates, key=lambda p: max(p["stats"].get("fighting", 0), p["stats"].get("firearms", 0)))
+
+def _random(actor: Participant, candidates: List[Participant], combat_map: Optional[Map], rng: random.Random) -> Participant:
+    return rng.choice(candidates)
+
+TARGET_SELECTORS: Dict[str, TargetSelector] = {
+    "nearest": _nearest,
+    "weakest": _weakest,
+    "strongest": _strongest,
+    "random": _random,
+}
+
+def register_target_selector(name: str, selector: TargetSelector) -> None:
+    """注册自定义的目标选择方式"""
+    TARGET_SELECTORS[name] = selector
+
+def register_tactics(monster_type: str, tactics: MonsterTactics) -> None:
+    """注册或替换某种怪物的战术"""
+    TACTICS[monster_type] = tactics
+
+def _load_overrides(path: str) -> None:
+    """从 JSON 文件覆盖战术配置，未给出的字段沿用已有配置"""
+    with open(path, encoding="utf-8") as f:
+        overrides = json.load(f)
+    for monster_type, fields in overrides.items():
+        if "weapons" in fields:
+            fields["weapons"] = tuple(fields["weapons"])
+        TACTICS[monster_type] = replace(TACTICS.get(monster_type, TACTICS["default"]), **fields)
+
+if MONSTER_TACTICS_PATH and os.path.exists(MONSTER_TACTICS_PATH):
+    _load_overrides(MONSTER_TACTICS_PATH)
+
+# ==================== 决策 ====================
+
+def monster_type(participant: Participant) -> str:
+    return participant.get("monster_type") or participant["id"].split("_")[0]  # type: ignore[return-value]
+
+def tactics_for(participant: Participant) -> MonsterTactics:
+    return TACTICS.get(monster_type(participant), TACTICS["default"])
+
+def is_intelligent(participant: Participant) -> bool:
+    """是否需要 LLM 决策：参与者自身的标记优先于类型配置"""
+    flag = participant.get("intelligent")
+    return tactics_for(participant).intelligent if flag is None else bool(flag)
+
+def choose_weapon(actor: Participant, tactics: MonsterTactics) -> Optional[str]:
+    """首选攻击方式 > 携带的武器（按 技能值 x 最大伤害）> 徒手"""
+    candidates = [name for name in tactics.weapons if name in WEAPONS] or [
+        item for item in actor["items"] if item in WEAPONS
+    ]
+    if not candidates:
+        return None
+    stats = actor["stats"]
+    return max(candidates, key=lambda name: stats.get(WEAPONS[name].skill, 0) * _max_damage(WEAPONS[name].damage, "0"))
+
+def decide_monster_action(
+    actor: Participant,
+    participants: List[Participant],
+    combat_map: Optional[Map] = None,
+    rng: Optional[random.Random] = None,
+) -> Optional[TacticalDecision]:
+    """按战术决定怪物的行动；需要 LLM 决策的智能怪物返回 None，已经倒下或逃跑的怪物只能等待"""
+    if is_down(actor):
+        return TacticalDecision(WAIT, description=f"{actor['name']} 已经无法行动。")
+    if is_intelligent(actor):
+        return None
+    tactics = tactics_for(actor)
+    rng = rng or random.Random()
+
+    stats = actor["stats"]
+    max_hp = stats.get("max_HP") or stats.get("HP", 0)
+    if tactics.flee_below > 0 and max_hp and stats.get("HP", 0) / max_hp < tactics.flee_below:
+        return TacticalDecision(FLEE, description=f"{actor['name']} 伤势过重，转身逃离了战斗。")
+
+    candidates = [
+        p for p in participants
+        if p["type"] != actor["type"] and p["status"] == ParticipantStatus.ACTIVE
+    ]
+    if not candidates:
+        return TacticalDecision(WAIT, description=f"{actor['name']} 环顾四周，没有找到目标。")
+
+    selector = TARGET_SELECTORS.get(tactics.target, _nearest)
+    target = selector(actor, candidates, combat_map, rng)
+    weapon = choose_weapon(actor, tactics)
+    distance = zone_distance(combat_map, actor.get("location"), target.get("location"))
+    if distance == 0 or (get_weapon(weapon).skill == "firearms" and distance < _FAR):
+        return TacticalDecision(
+            ATTACK, target["id"], weapon, f"{actor['name']} 扑向 {target['name']}。",
+        )
+
+    # 近战够不到：沿最短路径向目标移动一步
+    path = get_map_index(combat_map).path(actor["location"], target["location"]) if distance < _FAR else None  # type: ignore[union-attr, arg-type]
+    if not path:
+        return TacticalDecision(WAIT, target["id"], description=f"{actor['name']} 找不到通往 {target['name']} 的路，只能原地徘徊。")
+    return TacticalDecision(
+        MOVE, target["id"], weapon, f"{actor['name']} 向 {target['name']} 逼近，移动到了{path[1]}。", zone=path[1],
+    )
+
+def fight_back_weapon(defender: Participant) -> Optional[str]:
+    """反击成功时防守方使用的武器：怪物用自己的攻击方式（如爪击），调查员返回 None（徒手）"""
+    if defender["type"] != "enemy":
+        return None
+    return choose_weapon(defender, tactics_for(defender))
+
+def choose_monster_defense(defender: Participant, weapon_name: Optional[str]) -> Optional[str]:
+    """怪物被攻击时的应对；返回 None 表示交给规则引擎默认选择"""
+    if defender["type"] != "enemy" or is_intelligent(defender):
+        return None
+    defense = tactics_for(defender).defense
+    if defense in (DEFENSE_DODGE, DEFENSE_FIGHT_BACK) and get_weapon(weapon_name).skill == "fighting":
+        return defense
+    return None
+
+def flee_delta(actor: Participant) -> Dict[str, Any]:
+    """逃跑对应的参与者增量"""
+    return {"id": actor["id"], "status": ParticipantStatus.FLED.value}
+
+def move_delta(actor: Participant, zone: str) -> Dict[str, Any]:
+    """移动对应的参与者增量"""
+    return {"id": actor["id"], "location": zone}
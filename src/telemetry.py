@@ -0,0 +1,424 @@
+# === src/telemetry.py ===
+
+"""
+指标和追踪
+
+- 每个图节点一个 span：耗时、节点内的 LLM 调用次数、工具调用次数、token 和缓存命中
+- 每次 LLM 调用一个 span：耗时、输入/输出 token、提供方提示词缓存读写的 token、模型请求的工具调用数、是否命中响应缓存
+- span 逐行写入本地 JSONL 追踪文件（TELEMETRY_TRACE_PATH）
+- 同时累计成 Prometheus 文本格式的指标：战斗服务器的 GET /metrics，
+  或 TELEMETRY_METRICS_PORT 指定端口上的独立 HTTP 服务
+
+TELEMETRY_ENABLED=false（默认）时 traced_node 原样返回节点函数，LLM 上不挂回调，
+缓存命中只多一次布尔判断，几乎没有额外开销。
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 加载环境变量
+load_dotenv()
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "false").lower() == "true"
+TELEMETRY_TRACE_PATH = os.getenv("TELEMETRY_TRACE_PATH", "logs/trace.jsonl")
+TELEMETRY_METRICS_PORT = int(os.getenv("TELEMETRY_METRICS_PORT", "0"))
+
+# 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Span:
+    """一个节点的执行；节点内的 LLM 调用把统计累加到这里"""
+
+    __slots__ = ("span_id", "name", "thread_id", "start", "llm_calls", "tool_calls",
+                 "input_tokens", "output_tokens", "cached_tokens", "cache_hits")
+
+    def __init__(self, name: str, thread_id: Optional[str]):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.thread_id = thread_id
+        self.start = time.perf_counter()
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.cache_hits = 0
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("telemetry_span", default=None)
+
+# ==================== 指标 ====================
+
+class Metrics:
+    """计数器和直方图，标签是有序的 (名字, 值) 元组"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        # (名字, 标签) -> [各桶计数..., 总数, 总和]
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            data = self._histograms.get(key)
+            if data is None:
+                data = self._histograms[key] = [0.0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    data[i] += 1
+            data[-2] += 1
+            data[-1] += value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前指标的字典形式：计数器的值，直方图的次数和总耗时"""
+        with self._lock:
+            counters = {f"{name}{_format_labels(labels)}": value for (name, labels), value in self._counters.items()}
+            histograms = {
+                f"{name}{_format_labels(labels)}": {"count": data[-2], "sum": data[-1]}
+                for (name, labels), data in self._histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        described = set()
+
+        def header(name: str) -> None:
+            if name not in described and name in self._help:
+                kind, text = self._help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), data in histograms:
+            header(name)
+            for upper, count in zip(self.buckets, data):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(upper)),))} {_format_value(count)}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {_format_value(data[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {_format_value(data[-2])}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {data[-1]:.6f}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+metrics = Metrics()
+metrics.describe("coc_node_duration_seconds", "histogram", "图节点耗时")
+metrics.describe("coc_node_errors_total", "counter", "抛出异常的节点执行次数")
+metrics.describe("coc_llm_duration_seconds", "histogram", "LLM调用耗时")
+metrics.describe("coc_llm_errors_total", "counter", "失败的LLM调用次数")
+metrics.describe("coc_llm_tokens_total", "counter", "LLM输入/输出token数")
+metrics.describe("coc_llm_cached_tokens_total", "counter", "提供方提示词缓存读取/写入的输入token数")
+metrics.describe("coc_llm_tool_calls_total", "counter", "模型请求的工具调用次数")
+metrics.describe("coc_llm_cache_hits_total", "counter", "响应缓存命中次数")
+
+# ==================== JSONL 追踪 ====================
+
+class TraceWriter:
+    """把 span 逐行追加到 JSONL 文件；文件在第一次写入时打开，退出时刷新"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Any = None
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_writer: Optional[TraceWriter] = None
+
+def _trace(record: Dict[str, Any]) -> None:
+    global _writer
+    if not TELEMETRY_TRACE_PATH:
+        return
+    if _writer is None:
+        _writer = TraceWriter(TELEMETRY_TRACE_PATH)
+        atexit.register(_writer.close)
+    _writer.write(record)
+
+def flush() -> None:
+    """把缓冲的追踪写入文件"""
+    if _writer is not None:
+        _writer.flush()
+
+# ==================== 节点 span ====================
+
+def traced_node(name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    """给图节点包一层 span；未开启时原样返回"""
+    if not TELEMETRY_ENABLED:
+        return func
+
+    import asyncio
+    from langchain_core.runnables import RunnableConfig
+
+    def _finish(span: Span, error: Optional[BaseException]) -> None:
+        duration = time.perf_counter() - span.start
+        metrics.observe("coc_node_duration_seconds", duration, node=name)
+        if error is not None:
+            metrics.inc("coc_node_errors_total", node=name, error=type(error).__name__)
+        _trace({
+            "type": "node",
+            "span_id": span.span_id,
+            "name": name,
+            "thread_id": span.thread_id,
+            "ts": time.time(),
+            "duration_ms": round(duration * 1000, 3),
+            "llm_calls": span.llm_calls,
+            "tool_calls": span.tool_calls,
+            "input_tokens": span.input_tokens,
+            "output_tokens": span.output_tokens,
+            "cached_tokens": span.cached_tokens,
+            "cache_hits": span.cache_hits,
+            "error": repr(error) if error is not None else None,
+        })
+
+    def _start(config: Optional[RunnableConfig]) -> Span:
+        return Span(name, ((config or {}).get("configurable") or {}).get("thread_id"))
+
+    # LangGraph 按签名里的 config 参数传入运行配置，用来取 thread_id
+    if asyncio.iscoroutinefunction(func):
+        async def async_wrapper(state: Any, config: RunnableConfig) -> Any:
+            span = _start(config)
+            token = _current_span.set(span)
+            try:
+                result = await func(state)
+            except BaseException as e:
+                _finish(span, e)
+                raise
+            finally:
+                _current_span.reset(token)
+            _finish(span, None)
+            return result
+        async_wrapper.__name__ = getattr(func, "__name__", name)
+        return async_wrapper
+
+    def wrapper(state: Any, config: RunnableConfig) -> Any:
+        span = _start(config)
+        token = _current_span.set(span)
+        try:
+            result = func(state)
+        except BaseException as e:
+            _finish(span, e)
+            raise
+        finally:
+            _current_span.reset(token)
+        _finish(span, None)
+        return result
+    wrapper.__name__ = getattr(func, "__name__", name)
+    return wrapper
+
+def record_cache_hit() -> None:
+    """响应缓存命中时调用，计入当前节点"""
+    if not TELEMETRY_ENABLED:
+        return
+    span = _current_span.get()
+    if span is not None:
+        span.cache_hits += 1
+
+# ==================== LLM span ====================
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """LLM 调用的回调：记录耗时、token、工具调用和缓存命中
+
+    run_inline 保证回调在调用方的上下文里执行，能拿到当前节点的 span。
+    """
+
+    run_inline = True
+
+    def __init__(self, agent: Optional[str] = None):
+        self.agent = agent
+        # run_id -> (开始时间, 所在节点, 开始时节点的缓存命中数, 模型名, thread_id)
+        self._runs: Dict[Any, Tuple[float, Optional[Span], int, str, Optional[str]]] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: Any,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self._start(run_id, metadata)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: Any,
+                     metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self._start(run_id, metadata)
+
+    def _start(self, run_id: Any, metadata: Optional[Dict[str, Any]]) -> None:
+        metadata = metadata or {}
+        span = _current_span.get()
+        self._runs[run_id] = (
+            time.perf_counter(),
+            span,
+            span.cache_hits if span is not None else 0,
+            str(metadata.get("ls_model_name") or ""),
+            metadata.get("thread_id") or (span.thread_id if span is not None else None),
+        )
+
+    def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, span, cache_hits_before, model, thread_id = run
+        duration = time.perf_counter() - start
+
+        input_tokens = output_tokens = tool_calls = cache_read = cache_creation = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+                # 提供方提示词缓存（见 prompt_cache）读取和写入的部分，已包含在 input_tokens 里
+                details = usage.get("input_token_details") or {}
+                cache_read += details.get("cache_read") or 0
+                cache_creation += details.get("cache_creation") or 0
+                tool_calls += len(getattr(message, "tool_calls", None) or [])
+        cache_hit = span is not None and span.cache_hits > cache_hits_before
+        if cache_hit:
+            # 缓存的响应带着录制时的 token 用量，实际没有消耗
+            input_tokens = output_tokens = cache_read = cache_creation = 0
+
+        node = span.name if span is not None else ""
+        labels = {"node": node, "agent": self.agent or ""}
+        metrics.observe("coc_llm_duration_seconds", duration, **labels)
+        metrics.inc("coc_llm_tokens_total", input_tokens, direction="input", **labels)
+        metrics.inc("coc_llm_tokens_total", output_tokens, direction="output", **labels)
+        if cache_read or cache_creation:
+            metrics.inc("coc_llm_cached_tokens_total", cache_read, kind="read", **labels)
+            metrics.inc("coc_llm_cached_tokens_total", cache_creation, kind="creation", **labels)
+        if tool_calls:
+            metrics.inc("coc_llm_tool_calls_total", tool_calls, **labels)
+        if cache_hit:
+            metrics.inc("coc_llm_cache_hits_total", **labels)
+        if span is not None:
+            span.llm_calls += 1
+            span.tool_calls += tool_calls
+            span.input_tokens += input_tokens
+            span.output_tokens += output_tokens
+            span.cached_tokens += cache_read
+
+        _trace({
+            "type": "llm",
+            "parent_id": span.span_id if span is not None else None,
+            "node": node,
+            "agent": self.agent,
+            "model": model,
+            "thread_id": thread_id,
+            "ts": time.time(),
+            "duration_ms": round(duration * 1000, 3),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_tokens": cache_read,
+            "cache_creation_tokens": cache_creation,
+            "tool_calls": tool_calls,
+            "cache_hit": cache_hit,
+        })
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        start, span, _, model, thread_id = run
+        node = span.name if span is not None else ""
+        metrics.inc("coc_llm_errors_total", node=node, agent=self.agent or "", error=type(error).__name__)
+        _trace({
+            "type": "llm",
+            "parent_id": span.span_id if span is not None else None,
+            "node": node,
+            "agent": self.agent,
+            "model": model,
+            "thread_id": thread_id,
+            "ts": time.time(),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "error": repr(error),
+        })
+
+def instrument_llm(llm: Any, agent: Optional[str] = None) -> Any:
+    """开启时给 LLM 挂上回调；未开启时原样返回"""
+    if not TELEMETRY_ENABLED or llm is None:
+        return llm
+    llm.callbacks = list(llm.callbacks or []) + [TelemetryCallbackHandler(agent)]
+    return llm
+
+# ==================== Prometheus 端点 ====================
+
+def render_prometheus() -> str:
+    return metrics.render_prometheus()
+
+_metrics_server: Any = None
+
+def start_metrics_server(port: int = TELEMETRY_METRICS_PORT, host: str = "127.0.0.1") -> Any:
+    """在后台线程启动只提供 GET /metrics 的 HTTP 服务（已启动时直接返回）"""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    _metrics_server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _metrics_server
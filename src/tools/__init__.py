@@ -3,9 +3,47 @@
 """
 工具模块
 
-包含骰子系统等工具函数。
+包含骰子系统、地图查询等工具函数。
 """
 
-from .dice_tools import roll_dice, roll_dice_tool, DiceResult
+from importlib import import_module
 
-__all__ = ["roll_dice", "roll_dice_tool", "DiceResult"] 
\ No newline at end of file
+# 按需导入，避免只用 roll_dice 时加载 NumPy
+_LAZY_ATTRS = {
+    "roll_dice": ".dice_tools",
+    "roll_dice_tool": ".dice_tools",
+    "DiceResult": ".dice_tools",
+    "compile_dice": ".dice_notation",
+    "CompiledDice": ".dice_notation",
+    "roll_dice_batch": ".dice_batch",
+    "roll_dice_many": ".dice_batch",
+    "BatchDiceResult": ".dice_batch",
+    "map_query": ".map_tools",
+    "map_query_tool": ".map_tools",
+    "spatial_context": ".map_tools",
+}
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
+
+__all__ = [
+    "roll_dice",
+    "roll_dice_tool",
+    "DiceResult",
+    "compile_dice",
+    "CompiledDice",
+    "roll_dice_batch",
+    "roll_dice_many",
+    "BatchDiceResult",
+    "map_query",
+    "map_query_tool",
+    "spatial_context",
+] 
\ No newline at end of file
@@ -0,0 +1,205 @@
+# === src/tools/dice_batch.py ===
+
+"""
+批量骰子引擎
+
+用 NumPy 一次性投掷成千上万次骰子，结果以数组形式保存，
+不再为每次投掷创建一个 pydantic 的 DiceResult。
+适用于无界面模拟和蒙特卡洛平衡测试。
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .dice_notation import CompiledDice, compile_dice
+from .dice_tools import DiceResult
+
+# 模块级随机数生成器，可通过 seed_batch_rng 重置
+_rng = np.random.default_rng()
+
+def seed_batch_rng(seed: Optional[int] = None) -> None:
+    """重置批量骰子使用的随机数生成器（用于可复现的模拟）"""
+    global _rng
+    _rng = np.random.default_rng(seed)
+
+# 批量骰子结果
+@dataclass(frozen=True)
+class BatchDiceResult:
+    notations: Tuple[str, ...]  # 去重后的骰子表示法
+    notation_index: np.ndarray  # (n,) 每次投掷对应 notations 中的下标
+    rolls: np.ndarray  # (n, max_count) 每颗骰子的点数，未使用的位置为 0
+    totals: np.ndarray  # (n,) 骰子点数之和
+    modifiers: np.ndarray  # (n,) 修正值
+    final_results: np.ndarray  # (n,) 最终结果（包含修正值）
+
+    def __len__(self) -> int:
+        return int(self.final_results.shape[0])
+
+    def dice_at(self, i: int) -> str:
+        """第 i 次投掷使用的骰子表示法"""
+        return self.notations[int(self.notation_index[i])]
+
+    def to_dice_result(self, i: int) -> DiceResult:
+        """把第 i 次投掷转换为普通的 DiceResult（仅在需要时才创建对象）"""
+        row = self.rolls[i]
+        return DiceResult(
+            dice=self.dice_at(i),
+            rolls=row[row > 0].tolist(),
+            total=int(self.totals[i]),
+            modifier=int(self.modifiers[i]),
+            final_result=int(self.final_results[i]),
+        )
+
+def _roll_block(count: int, sides: int, times: int, rng: np.random.Generator) -> np.ndarray:
+    """投掷 times 次 count 个 sides 面骰，返回 (times, count) 的数组"""
+    return rng.integers(1, sides + 1, size=(times, count), dtype=np.int64)
+
+def _roll_percentile_block(bonus: int, times: int, rng: np.random.Generator) -> np.ndarray:
+    """投掷 times 次带奖励骰/惩罚骰的百分骰，返回 (times, 1) 的数组"""
+    units = rng.integers(0, 10, size=(times, 1), dtype=np.int64)
+    tens = rng.integers(0, 10, size=(times, abs(bonus) + 1), dtype=np.int64)
+    candidates = tens * 10 + units
+    candidates[candidates == 0] = 100
+    chosen = candidates.min(axis=1) if bonus > 0 else candidates.max(axis=1)
+    return chosen.reshape(times, 1)
+
+def _roll_compiled(
+    compiled: CompiledDice,
+    times: int,
+    rng: np.random.Generator,
+    damage_bonus: Optional[str],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """向量化地投掷编译后的表达式
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (rolls (times, 骰子数), totals, modifiers)
+    """
+    db = compiled.resolve_damage_bonus(damage_bonus)
+
+    blocks: List[np.ndarray] = []
+    totals = np.zeros(times, dtype=np.int64)
+    modifiers = np.full(times, compiled.constant, dtype=np.int64)
+    for term in compiled.terms:
+        if term.kind == "dice":
+            if term.bonus:
+                block = _roll_percentile_block(term.bonus, times, rng)
+            else:
+                block = _roll_block(term.count, term.sides, times, rng)
+            blocks.append(block)
+            totals += term.sign * block.sum(axis=1)
+        elif term.kind == "db":
+            db_rolls, db_totals, db_modifiers = _roll_compiled(db, times, rng, None)
+            blocks.append(db_rolls)
+            totals += term.sign * db_totals
+            modifiers += term.sign * db_modifiers
+
+    if blocks:
+        rolls = np.concatenate(blocks, axis=1)
+    else:
+        rolls = np.zeros((times, 0), dtype=np.int64)
+    return rolls, totals, modifiers
+
+def roll_dice_batch(
+    dice_notation: str,
+    times: int,
+    rng: Optional[np.random.Generator] = None,
+    damage_bonus: Optional[str] = None,
+) -> BatchDiceResult:
+    """同一个骰子表示法重复投掷多次
+
+    Args:
+        dice_notation: 骰子表示法，如 "1d20", "2d6+3", "1d8+1d4+2", "1d6+DB", "1d100b"
+        times: 投掷次数
+        rng: 可选的随机数生成器，默认使用模块级生成器
+        damage_bonus: 伤害加值，表示法含 DB 时必填
+
+    Returns:
+        BatchDiceResult: 数组形式的批量结果
+
+    Raises:
+        ValueError: 无效的骰子表示法或投掷次数
+    """
+    if times <= 0:
+        raise ValueError(f"无效的投掷次数: {times}")
+
+    rng = rng or _rng
+    rolls, totals, modifiers = _roll_compiled(compile_dice(dice_notation), times, rng, damage_bonus)
+
+    return BatchDiceResult(
+        notations=(dice_notation,),
+        notation_index=np.zeros(times, dtype=np.int32),
+        rolls=rolls,
+        totals=totals,
+        modifiers=modifiers,
+        final_results=totals + modifiers,
+    )
+
+def roll_dice_many(
+    dice_notations: Sequence[str],
+    rng: Optional[np.random.Generator] = None,
+    damage_bonus: Optional[str] = None,
+) -> BatchDiceResult:
+    """一次调用投掷一组（可以各不相同的）骰子表示法
+
+    相同的表示法会被分组，每组只做一次向量化投掷。
+
+    Args:
+        dice_notations: 骰子表示法列表
+        rng: 可选的随机数生成器，默认使用模块级生成器
+        damage_bonus: 伤害加值，表示法含 DB 时必填
+
+    Returns:
+        BatchDiceResult: 结果顺序与 dice_notations 一致
+
+    Raises:
+        ValueError: 列表为空或包含无效的骰子表示法
+    """
+    if len(dice_notations) == 0:
+        raise ValueError("骰子表示法列表不能为空")
+
+    rng = rng or _rng
+
+    # 按表示法分组，记录每组在结果中的位置
+    groups: Dict[str, List[int]] = {}
+    for i, notation in enumerate(dice_notations):
+        groups.setdefault(notation, []).append(i)
+
+    notations = tuple(groups.keys())
+    group_results = [
+        _roll_compiled(compile_dice(notation), len(groups[notation]), rng, damage_bonus)
+        for notation in notations
+    ]
+    max_count = max(rolls.shape[1] for rolls, _, _ in group_results)
+
+    n = len(dice_notations)
+    notation_index = np.empty(n, dtype=np.int32)
+    rolls = np.zeros((n, max_count), dtype=np.int64)
+    totals = np.empty(n, dtype=np.int64)
+    modifiers = np.empty(n, dtype=np.int64)
+
+    for group_id, (notation, (group_rolls, group_totals, group_modifiers)) in enumerate(zip(notations, group_results)):
+        positions = np.asarray(groups[notation], dtype=np.int64)
+        notation_index[positions] = group_id
+        rolls[positions, :group_rolls.shape[1]] = group_rolls
+        totals[positions] = group_totals
+        modifiers[positions] = group_modifiers
+
+    return BatchDiceResult(
+        notations=notations,
+        notation_index=notation_index,
+        rolls=rolls,
+        totals=totals,
+        modifiers=modifiers,
+        final_results=totals + modifiers,
+    )
+
+# 示例用法
+if __name__ == "__main__":
+    batch = roll_dice_batch("1d100", 100000)
+    print(f"1d100 x {len(batch)}: 平均 {batch.final_results.mean():.2f}")
+
+    mixed = roll_dice_many(["1d20", "2d6+3", "1d8+1d4+2", "1d6+DB", "1d100b"], damage_bonus="+1d4")
+    for i in range(len(mixed)):
+        print(mixed.to_dice_result(i))
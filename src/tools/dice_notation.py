@@ -0,0 +1,185 @@
+# === src/tools/dice_notation.py ===
+
+"""
+骰子表达式编译器
+
+把骰子表示法解析一次，编译成可重复使用的 CompiledDice，
+编译结果保存在有界的 LRU 缓存里，热路径上不再重复解析。
+
+支持的语法（不区分大小写，忽略空格）：
+- 骰子项: "1d20", "d6", "2d6"
+- 常数项: "+3", "-1"
+- 伤害加值: "+DB"，投掷时由 damage_bonus 参数给出（如 "+1d4", "-1", "0"）
+- 奖励/惩罚骰: "1d100b"、"1d100b2"（奖励骰）, "1d100p"、"1d100p1"（惩罚骰）
+- 多项组合: "1d8+1d4+2", "1d6+DB", "1d3-1"
+"""
+
+import random
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+# 编译缓存的容量
+DICE_CACHE_SIZE = 512
+
+# 单个项的正则：符号 + (骰子 | 常数 | DB)
+_TERM_PATTERN = re.compile(
+    r'([+-]?)(?:(\d*)d(\d+)(?:([bp])(\d*))?|(\d+)|(db))',
+    re.IGNORECASE,
+)
+
+class DiceTerm(NamedTuple):
+    """表达式中的一项"""
+    kind: str  # "dice", "const", "db"
+    sign: int  # 1 或 -1
+    count: int = 0  # 骰子数量
+    sides: int = 0  # 骰子面数
+    bonus: int = 0  # 奖励骰数量（>0）或惩罚骰数量（<0），仅用于 1d100
+    value: int = 0  # 常数项的值
+
+class CompiledDice:
+    """编译后的骰子表达式，可反复投掷"""
+
+    __slots__ = ("notation", "terms", "uses_damage_bonus", "constant")
+
+    def __init__(self, notation: str, terms: Tuple[DiceTerm, ...]):
+        self.notation = notation
+        self.terms = terms
+        self.uses_damage_bonus = any(t.kind == "db" for t in terms)
+        self.constant = sum(t.sign * t.value for t in terms if t.kind == "const")
+
+    def __repr__(self) -> str:
+        return f"CompiledDice({self.notation!r})"
+
+    @property
+    def dice_terms(self) -> Tuple[DiceTerm, ...]:
+        """所有骰子项"""
+        return tuple(t for t in self.terms if t.kind == "dice")
+
+    def resolve_damage_bonus(self, damage_bonus: Optional[str]) -> Optional["CompiledDice"]:
+        """编译伤害加值表达式；表达式不含 DB 时返回 None
+
+        Raises:
+            ValueError: 表达式含 DB 但没有给出伤害加值，或伤害加值本身含 DB
+        """
+        if not self.uses_damage_bonus:
+            return None
+        if damage_bonus is None:
+            raise ValueError(f"骰子表示法 {self.notation} 需要伤害加值(DB)")
+        compiled_db = compile_dice(damage_bonus)
+        if compiled_db.uses_damage_bonus:
+            raise ValueError(f"无效的伤害加值: {damage_bonus}")
+        return compiled_db
+
+    def roll(
+        self,
+        damage_bonus: Optional[str] = None,
+        rng: Optional[random.Random] = None,
+    ) -> Tuple[List[int], int, int]:
+        """投掷一次
+
+        Args:
+            damage_bonus: 伤害加值表达式，表达式含 DB 时必填
+            rng: 可选的随机数生成器，默认使用 random 模块
+
+        Returns:
+            Tuple[List[int], int, int]: (每颗骰子的点数, 骰子点数之和, 修正值)。
+            减号项的骰子计入总和时取负值；奖励/惩罚骰只记录最终采用的百分骰结果。
+        """
+        randint = (rng or random).randint
+        db = self.resolve_damage_bonus(damage_bonus)
+
+        rolls: List[int] = []
+        total = 0
+        modifier = self.constant
+        for term in self.terms:
+            if term.kind == "dice":
+                if term.bonus:
+                    value = _roll_percentile(term.bonus, randint)
+                    rolls.append(value)
+                    total += term.sign * value
+                    continue
+                for _ in range(term.count):
+                    value = randint(1, term.sides)
+                    rolls.append(value)
+                    total += term.sign * value
+            elif term.kind == "db":
+                db_rolls, db_total, db_modifier = db.roll(rng=rng)
+                rolls.extend(db_rolls)
+                total += term.sign * db_total
+                modifier += term.sign * db_modifier
+
+        return rolls, total, modifier
+
+def _roll_percentile(bonus: int, randint) -> int:
+    """带奖励骰（bonus>0）或惩罚骰（bonus<0）的百分骰
+
+    个位骰只投一次，十位骰额外投 |bonus| 颗，奖励骰取最低、惩罚骰取最高。
+    """
+    units = randint(0, 9)
+    candidates = []
+    for _ in range(abs(bonus) + 1):
+        value = randint(0, 9) * 10 + units
+        candidates.append(value if value else 100)
+    return min(candidates) if bonus > 0 else max(candidates)
+
+def _compile(dice_notation: str) -> CompiledDice:
+    text = dice_notation.replace(" ", "")
+    if not text:
+        raise ValueError(f"无效的骰子表示法: {dice_notation}")
+
+    terms: List[DiceTerm] = []
+    pos = 0
+    while pos < len(text):
+        match = _TERM_PATTERN.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"无效的骰子表示法: {dice_notation}")
+        sign_str, count_str, sides_str, bp, bp_count, const_str, db = match.groups()
+        # 除第一项外，每一项都必须有符号
+        if terms and not sign_str:
+            raise ValueError(f"无效的骰子表示法: {dice_notation}")
+        sign = -1 if sign_str == "-" else 1
+
+        if sides_str is not None:
+            count = int(count_str) if count_str else 1
+            sides = int(sides_str)
+            if count <= 0 or sides <= 0:
+                raise ValueError(f"无效的骰子参数: {dice_notation}")
+            bonus = 0
+            if bp:
+                if count != 1 or sides != 100:
+                    raise ValueError(f"奖励骰/惩罚骰只能用于1d100: {dice_notation}")
+                extra = int(bp_count) if bp_count else 1
+                if extra <= 0:
+                    raise ValueError(f"无效的骰子参数: {dice_notation}")
+                bonus = extra if bp.lower() == "b" else -extra
+            terms.append(DiceTerm("dice", sign, count=count, sides=sides, bonus=bonus))
+        elif const_str is not None:
+            terms.append(DiceTerm("const", sign, value=int(const_str)))
+        else:
+            terms.append(DiceTerm("db", sign))
+        pos = match.end()
+
+    return CompiledDice(dice_notation, tuple(terms))
+
+@lru_cache(maxsize=DICE_CACHE_SIZE)
+def compile_dice(dice_notation: str) -> CompiledDice:
+    """编译骰子表示法，结果会被缓存
+
+    Args:
+        dice_notation: 骰子表示法，如 "1d20", "1d8+1d4+2", "1d6+DB", "1d100b"
+
+    Returns:
+        CompiledDice: 编译后的表达式
+
+    Raises:
+        ValueError: 无效的骰子表示法
+    """
+    return _compile(dice_notation)
+
+# 示例用法
+if __name__ == "__main__":
+    for notation in ["1d20", "1d8+1d4+2", "1d6+DB", "1d100b", "1d100p2", "1d3-1"]:
+        compiled = compile_dice(notation)
+        print(notation, compiled.terms, compiled.roll(damage_bonus="+1d4"))
+    print(compile_dice.cache_info())
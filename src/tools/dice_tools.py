@@ -1,10 +1,9 @@
 # === src/tools/dice_tools.py ===
 
-import random
-import re
-from typing import List, Dict, Any
+from typing import List, Optional
 from pydantic import BaseModel
-from langchain.tools import tool
+
+from .dice_notation import compile_dice
 
 # 基础骰子结果类
 class DiceResult(BaseModel):
@@ -15,11 +14,12 @@ class DiceResult(BaseModel):
     final_result: int  # 最终结果（包含修正值）
 
 # 掷骰子函数
-def roll_dice(dice_notation: str) -> DiceResult:
+def roll_dice(dice_notation: str, damage_bonus: Optional[str] = None) -> DiceResult:
     """掷骰子函数
     
     Args:
-        dice_notation: 骰子表示法，如 "1d20", "2d6+3", "1d100-5"
+        dice_notation: 骰子表示法，如 "1d20", "2d6+3", "1d100-5", "1d8+1d4+2", "1d6+DB", "1d100b"
+        damage_bonus: 伤害加值，如 "+1d4", "-1"，表示法含 DB 时必填
         
     Returns:
         DiceResult: 骰子结果
@@ -27,63 +27,56 @@ def roll_dice(dice_notation: str) -> DiceResult:
     Raises:
         ValueError: 无效的骰子表示法
     """
-    # 解析骰子表示法，支持格式如 "1d20", "2d6+3", "1d100-5"
-    match = re.match(r'^(\d+)d(\d+)([+-]\d+)?$', dice_notation)
-    if not match:
-        raise ValueError(f"无效的骰子表示法: {dice_notation}")
-
-    count_str, sides_str, modifier_str = match.groups()
-    count = int(count_str)
-    sides = int(sides_str)
-    modifier = int(modifier_str) if modifier_str else 0
-
-    if count <= 0 or sides <= 0:
-        raise ValueError(f"无效的骰子参数: {dice_notation}")
-
-    # 掷骰子
-    rolls = []
-    for _ in range(count):
-        rolls.append(random.randint(1, sides))
-
-    total = sum(rolls)
-    final_result = total + modifier
+    # 编译结果有缓存，重复的表示法不会再次解析
+    rolls, total, modifier = compile_dice(dice_notation).roll(damage_bonus)
 
     return DiceResult(
         dice=dice_notation,
         rolls=rolls,
         total=total,
         modifier=modifier,
-        final_result=final_result
+        final_result=total + modifier
     )
 
-# 投掷骰子工具
-@tool
-def roll_dice_tool(dice_notation: str) -> str:
+# 投掷骰子工具（LangChain 工具对象在第一次访问 roll_dice_tool 时才创建）
+def _roll_dice_tool(dice_notation: str, damage_bonus: Optional[str] = None) -> str:
     """在《克苏鲁的呼唤》游戏中投掷骰子进行各种判定。
     
     用于命中判定、闪避判定、伤害计算等。支持标准骰子表示法如1d20（1个20面骰）、
-    2d6+3（2个6面骰加3点修正值）、1d100-5（1个100面骰减5点修正值）等。
+    2d6+3（2个6面骰加3点修正值）、1d100-5（1个100面骰减5点修正值）等，
+    也支持多项伤害如1d8+1d4+2、带伤害加值的1d6+DB，以及奖励骰1d100b/惩罚骰1d100p（可加数量，如1d100b2）。
     
     Args:
         dice_notation: 骰子表示法，如'1d20'用于技能检定,'2d6+3'用于伤害计算,'1d100'用于百分骰等
+        damage_bonus: 伤害加值(DB)，如'+1d4'、'-1'，表示法中含DB时必须提供
         
     Returns:
         str: JSON格式的骰子结果
     """
     try:
-        result = roll_dice(dice_notation)
+        result = roll_dice(dice_notation, damage_bonus)
         return result.model_dump_json()
     except ValueError as e:
         return f"错误: {str(e)}"
 
+def __getattr__(name):
+    # 只用 roll_dice 时不加载 LangChain
+    if name == "roll_dice_tool":
+        from langchain_core.tools import tool
+
+        value = tool("roll_dice_tool")(_roll_dice_tool)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # 示例用法
 if __name__ == "__main__":
     # 测试骰子系统
-    test_cases = ["1d20", "2d6+3", "1d100-5", "3d4"]
+    test_cases = ["1d20", "2d6+3", "1d100-5", "3d4", "1d8+1d4+2", "1d6+DB", "1d100b"]
     
     for dice in test_cases:
         try:
-            result = roll_dice(dice)
+            result = roll_dice(dice, damage_bonus="+1d4")
             print(f"{dice}: {result}")
         except ValueError as e:
             print(f"错误: {e}") 
\ No newline at end of file
@@ -0,0 +1,88 @@
+# === src/tools/map_tools.py ===
+
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ..map_index import get_map_index
+from ..types import Map, Participant, ParticipantStatus
+
+# 当前调用的地图和参与者；智能体调用前用 spatial_context 设置，工具在同一上下文里读取
+_spatial: ContextVar[Optional[Tuple[Optional[Map], Sequence[Participant]]]] = ContextVar("map_tools_spatial", default=None)
+
+@contextmanager
+def spatial_context(combat_map: Optional[Map], participants: Sequence[Participant]) -> Iterator[None]:
+    """在这个范围内，map_query_tool 查询给定的地图和参与者"""
+    token = _spatial.set((combat_map, participants))
+    try:
+        yield
+    finally:
+        _spatial.reset(token)
+
+def _resolve(name: Optional[str], participants: Sequence[Participant]) -> Optional[str]:
+    """参与者 id 或名字换成所在区域，其他按区域名处理"""
+    if not name:
+        return None
+    for participant in participants:
+        if name in (participant["id"], participant["name"]):
+            return participant.get("location")
+    return name
+
+def map_query(query: str, source: str, target: Optional[str] = None, steps: int = 1) -> Dict[str, Any]:
+    """按当前的地图回答空间查询，见 map_query_tool"""
+    combat_map, participants = _spatial.get() or (None, [])
+    index = get_map_index(combat_map)
+    if index is None:
+        raise ValueError("当前没有地图")
+    zone = _resolve(source, participants)
+    if zone is None:
+        raise ValueError(f"{source} 没有位置信息")
+
+    if query == "distance":
+        goal = _resolve(target, participants)
+        return {"from": zone, "to": goal, "steps": index.distance(zone, goal)}
+    if query == "path":
+        goal = _resolve(target, participants)
+        path = index.path(zone, goal) if goal else None
+        return {"from": zone, "to": goal, "path": list(path) if path else None}
+    if query == "neighbors":
+        return {"zone": zone, "neighbors": list(index.neighbors(zone))}
+    if query == "within":
+        zones = index.within(zone, steps)
+        occupants: Dict[str, List[str]] = {}
+        for participant in participants:
+            if participant.get("location") in zones and participant["status"] == ParticipantStatus.ACTIVE:
+                occupants.setdefault(participant["location"], []).append(participant["id"])  # type: ignore[index]
+        return {"zone": zone, "steps": steps, "zones": list(zones), "occupants": occupants}
+    raise ValueError(f"未知的查询类型: {query}")
+
+# 地图查询工具（LangChain 工具对象在第一次访问 map_query_tool 时才创建）
+def _map_query_tool(query: str, source: str, target: Optional[str] = None, steps: int = 1) -> str:
+    """查询战斗地图上的距离和范围，不需要自己根据 adjacent_zones 推算。
+
+    区域参数既可以是区域名，也可以是角色的id或名字（取角色当前所在的区域）。
+
+    Args:
+        query: 查询类型：distance（两处之间的步数）、path（最短路径）、neighbors（相邻区域）、
+            within（steps 步以内的区域和其中在场的角色）
+        source: 起点区域或角色
+        target: distance / path 的终点区域或角色
+        steps: within 的步数
+
+    Returns:
+        str: JSON格式的查询结果，步数为 null 表示不可达
+    """
+    try:
+        return json.dumps(map_query(query, source, target, steps), ensure_ascii=False)
+    except ValueError as e:
+        return f"错误: {str(e)}"
+
+def __getattr__(name):
+    if name == "map_query_tool":
+        from langchain_core.tools import tool
+
+        value = tool("map_query_tool")(_map_query_tool)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,8 @@
 # === src/types.py ===
 
 from enum import Enum
-from typing import List, Dict, Optional, TypedDict, Literal
+from typing import Any, List, Dict, Optional, TypedDict, Literal
+from typing_extensions import NotRequired
 
 # 定义参与者的状态
 class ParticipantStatus(str, Enum):
@@ -42,6 +43,9 @@ class Participant(TypedDict):
     status: ParticipantStatus
     effects: List[str]
     items: List[str]
+    location: NotRequired[str]  # 所在的地图区域
+    monster_type: NotRequired[str]  # 怪物类型，决定战术（见 tactics），缺省取 id 前缀
+    intelligent: NotRequired[bool]  # 有智慧的怪物由LLM决策行动
 
 # Triage Agent分类后的意图
 class ClassifiedIntent(str, Enum):
@@ -68,10 +72,12 @@ class GraphState(TypedDict, total=False):
     fight_ended: bool  # 战斗是否结束
 
     participants: List[Participant]
+    side_counts: Dict[str, Dict[str, int]]  # 每一方能行动/已倒下的人数，参与者变化时增量更新（见 participant_store）
     initiative_order: List[str]  # 本轮的行动顺序，是角色ID列表
     round_number: int  # 战斗轮数，0表示战斗尚未开始
     current_actor_index: int  # 当前行动者在 turn_order 中的索引
     temp_player_actor: str | None  # 临时行动者（玩家）的名字
+    pending_attack: Optional[Dict[str, str]]  # 等待玩家选择闪避或反击的攻击（attacker_id, defender_id, weapon）
     map: Map
     # 用于叙事的战斗日志
     combat_log: List[str]
@@ -80,5 +86,9 @@ class GraphState(TypedDict, total=False):
     is_valid_action: bool
     classified_intent: Optional[ClassifiedIntent]
     requires_player_input: bool
+    speculative_action: Optional[Dict[str, Any]]  # 分类时推测执行的行动结果，direct_action 直接使用
+    monster_plans: Dict[str, Dict[str, Any]]  # 并发规划的怪物决策（怪物id -> 计划），轮到时校验后采用
+    # 每个智能体的上下文滚动摘要进度（summary 摘要条目, folded 已折叠的日志条数, omitted 已丢弃的摘要条数）
+    context_summaries: Dict[str, Dict]
     # 最终结果
     llm_output: str 
\ No newline at end of file